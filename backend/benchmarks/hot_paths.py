@@ -0,0 +1,249 @@
+"""Microbenchmarks for the pure-Python work done on every turn, with a regression gate.
+
+Each case runs on synthetic transcripts of 10 to 500 messages and records the
+best per-call time over several repeats and the peak memory allocated by one
+call (``tracemalloc``). Results are compared against the baselines committed
+in ``baselines.json``; timings are only comparable on the machine that
+recorded them, so refresh the baselines (``--save``) when the reference
+machine changes, and after an intended change in cost.
+
+Shared machines drift by a third between runs, more than the gate allows.
+Each case is therefore timed next to a fixed reference loop, and
+``--compare`` scales its time by how much faster or slower that loop ran than
+when the baseline was recorded. Calls under 10 µs get more repeats, and a
+flagged case is timed again ``--confirm`` times (3): it only fails the gate if
+it regresses in every run, which a real regression does and a burst of load
+does not. Calls of a few µs still differ by a third from one process to the
+next, so time increases under ``--min-delta-us`` (5 µs) are ignored; the
+larger transcript sizes of the same case catch a real slowdown.
+
+Run with:
+    python -m backend.benchmarks.hot_paths                 # print results
+    python -m backend.benchmarks.hot_paths --save          # record baselines
+    python -m backend.benchmarks.hot_paths --compare       # exit 1 on a regression
+    python -m backend.benchmarks.hot_paths --compare --threshold 0.5 --only prompt
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import timeit
+import tracemalloc
+from typing import Callable
+
+from backend.benchmarks.serialization import make_conversation
+from backend.services.conversation import to_agent_messages, to_gemini_prompt
+from backend.services.encoding import conversation_payload, dumps
+from backend.services.voice_roleplay import VoiceRoleplayService, build_chat_prompt, build_goal_prompt
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+SIZES = (10, 50, 200, 500)
+
+SCENARIO = {
+    "scenario_title": "Ordering at a café",
+    "description": "Order a drink and a pastry, then pay",
+    "ai_character": "Barista",
+    "environment": "A busy café in Madrid",
+}
+GOALS = [
+    {"goal": "Greet the barista", "completed": True},
+    {"goal": "Order a drink", "completed": False},
+    {"goal": "Ask for the bill", "completed": False},
+]
+
+
+def _messages(n: int) -> list:
+    return make_conversation(n)["messages"]
+
+
+def _goal_reply(n: int) -> str:
+    # a fenced goal-checker reply with one boolean per ten messages
+    flags = ", ".join("true" if i % 3 else "false" for i in range(max(3, n // 10)))
+    return f"```json\n[{flags}]\n```"
+
+
+# Each case builds its inputs for a transcript of n messages and returns the call to time
+def agent_messages_case(n: int):
+    messages = _messages(n)
+    return lambda: to_agent_messages(messages)
+
+
+def gemini_prompt_case(n: int):
+    messages = _messages(n)
+    return lambda: to_gemini_prompt(messages, "¿Cuánto cuesta?")
+
+
+def parse_json_response_case(n: int):
+    # _parse_json_response does not touch the service's state
+    service = VoiceRoleplayService.__new__(VoiceRoleplayService)
+    reply = _goal_reply(n)
+    return lambda: service._parse_json_response(reply)
+
+
+def chat_prompt_case(n: int):
+    messages = _messages(n)
+    return lambda: build_chat_prompt("Un café, por favor", SCENARIO, messages)
+
+
+def goal_prompt_case(n: int):
+    messages = _messages(n)
+    return lambda: build_goal_prompt("Un café, por favor", messages, GOALS)
+
+
+def encode_conversation_case(n: int):
+    doc = make_conversation(n)
+    return lambda: dumps(conversation_payload(doc))
+
+
+CASES = {
+    "to_agent_messages": agent_messages_case,
+    "gemini_prompt": gemini_prompt_case,
+    "parse_json_response": parse_json_response_case,
+    "chat_prompt": chat_prompt_case,
+    "goal_prompt": goal_prompt_case,
+    "encode_conversation": encode_conversation_case,
+}
+
+
+# calls faster than this get SHORT_CALL_REPEAT repeats
+SHORT_CALL_SECONDS = 10e-6
+SHORT_CALL_REPEAT = 10
+
+
+def _reference():
+    # the same kind of work as the cases: small dicts, f-strings, a join
+    lines = []
+    for i in range(200):
+        message = {"role": "user", "content": str(i)}
+        lines.append(f"{message['role'].capitalize()}: {message['content']}")
+    return "\n".join(lines)
+
+
+def calibrate(repeat: int = 5) -> float:
+    """Best time of the reference loop, in µs."""
+    return round(min(timeit.repeat(_reference, number=100, repeat=repeat)) / 100 * 1e6, 3)
+
+
+def measure(call: Callable[[], object], repeat: int = 5) -> dict:
+    reference_us = calibrate()
+    number, _ = timeit.Timer(call).autorange()
+    best = min(timeit.repeat(call, number=number, repeat=repeat)) / number
+    if best < SHORT_CALL_SECONDS and repeat < SHORT_CALL_REPEAT:
+        # more samples of the minimum for calls where jitter is a large fraction
+        more = timeit.repeat(call, number=number, repeat=SHORT_CALL_REPEAT - repeat)
+        best = min(best, min(more) / number)
+
+    call()  # warm caches before measuring memory
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    reference_us = min(reference_us, calibrate())
+    return {"us": round(best * 1e6, 3), "peak_kib": round((peak - base) / 1024, 2), "reference_us": reference_us}
+
+
+def run(only: str = None, sizes=SIZES, repeat: int = 5) -> dict:
+    results = {}
+    for name, setup in CASES.items():
+        if only and only not in name:
+            continue
+        for n in sizes:
+            results[f"{name}[{n}]"] = measure(setup(n), repeat=repeat)
+    return results
+
+
+def rerun(keys, repeat: int = 5) -> dict:
+    """Measure the cases named ``name[n]`` in ``keys`` again."""
+    results = {}
+    for key in keys:
+        name, n = key[:-1].split("[")
+        results[key] = measure(CASES[name](int(n)), repeat=repeat)
+    return results
+
+
+def compare(
+    results: dict, baselines: dict, threshold: float, memory_threshold: float, min_delta_us: float = 5.0
+) -> list:
+    """Rows of ``(key, metric, baseline, current, ratio)`` that regressed past their threshold."""
+    regressions = []
+    for key, current in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+        # machine speed now relative to when the baseline was recorded
+        speed = 1.0
+        if baseline.get("reference_us") and current.get("reference_us"):
+            speed = baseline["reference_us"] / current["reference_us"]
+        for metric, limit in (("us", threshold), ("peak_kib", memory_threshold)):
+            before, after = baseline[metric], current[metric]
+            if metric == "us":
+                after = round(after * speed, 3)
+            # ignore sub-KiB noise in allocation peaks and few-µs timing noise
+            if after - before < (1 if metric == "peak_kib" else min_delta_us):
+                continue
+            if before > 0 and after / before > 1 + limit:
+                regressions.append((key, metric, before, after, after / before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", help="run cases whose name contains this")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help="write the results to the baselines file")
+    parser.add_argument("--compare", action="store_true", help="compare with the baselines; exit 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed time increase (0.25 = 25%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.10, help="allowed peak allocation increase")
+    parser.add_argument("--min-delta-us", type=float, default=5.0, help="ignore time increases smaller than this")
+    parser.add_argument("--confirm", type=int, default=3, help="re-time a flagged case this many times")
+    parser.add_argument("--baselines", default=BASELINES)
+    args = parser.parse_args()
+
+    results = run(args.only, args.sizes, args.repeat)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f).get("results", {})
+
+    print(f"{'case':<28}  {'us/call':>10}  {'baseline':>10}  {'peak KiB':>9}  {'baseline':>9}")
+    for key, current in results.items():
+        baseline = baselines.get(key, {})
+        print(
+            f"{key:<28}  {current['us']:>10.2f}  {baseline.get('us', float('nan')):>10.2f}"
+            f"  {current['peak_kib']:>9.2f}  {baseline.get('peak_kib', float('nan')):>9.2f}"
+        )
+
+    if args.save:
+        merged = {**baselines, **results}
+        with open(args.baselines, "w") as f:
+            json.dump(
+                {"python": platform.python_version(), "machine": platform.machine(), "results": merged},
+                f, indent=2, sort_keys=True,
+            )
+            f.write("\n")
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+
+    if args.compare:
+        limits = (args.threshold, args.memory_threshold, args.min_delta_us)
+        regressions = compare(results, baselines, *limits)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            # keep only what regresses again; the rows report the latest run
+            retried = rerun({key for key, *_ in regressions}, args.repeat)
+            regressions = compare(retried, baselines, *limits)
+        for key, metric, before, after, ratio in regressions:
+            print(f"REGRESSION {key} {metric}: {before} -> {after} ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {len(baselines)} baselines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark conversation response encoding.
+
+Compares the default FastAPI path (``jsonable_encoder`` + ``json.dumps``)
+against ``BSONJSONResponse`` on synthetic transcripts shaped like stored
+conversation documents.
+
+Run with: python -m backend.benchmarks.serialization [--messages 200 500]
+"""
+import json
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from backend.services.encoding import conversation_payload, dumps
+
+
+def make_conversation(n_messages: int) -> dict:
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    messages = []
+    for i in range(n_messages):
+        role = "user" if i % 2 else "assistant"
+        messages.append({
+            "role": role,
+            "content": f"Message {i}: " + "una frase de ejemplo para practicar " * 4,
+            "timestamp": start + timedelta(seconds=i * 7, milliseconds=123),
+            "seq": i + 1,
+        })
+    return {
+        "_id": ObjectId(),
+        "agent": "TAXI",
+        "created_at": start,
+        "metadata": {"country": "Spain", "language": "Spanish"},
+        "messages": messages,
+    }
+
+
+def encode_default(doc: dict) -> bytes:
+    content = jsonable_encoder(conversation_payload(doc), custom_encoder={ObjectId: str})
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_fast(doc: dict) -> bytes:
+    return dumps(conversation_payload(doc))
+
+
+def bench(fn, doc: dict, repeat: int = 5) -> float:
+    number = max(1, 2000 // max(1, len(doc["messages"])))
+    return min(timeit.repeat(lambda: fn(doc), number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[50, 200, 500])
+    args = parser.parse_args()
+
+    print(f"{'messages':>8}  {'default (ms)':>12}  {'orjson (ms)':>11}  {'speedup':>7}")
+    for n in args.messages:
+        doc = make_conversation(n)
+        assert json.loads(encode_default(doc)) == json.loads(encode_fast(doc))
+        slow = bench(encode_default, doc)
+        fast = bench(encode_fast, doc)
+        print(f"{n:>8}  {slow * 1000:>12.3f}  {fast * 1000:>11.3f}  {slow / fast:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
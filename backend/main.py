@@ -2,14 +2,37 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
+import asyncio
+import logging
+from backend.services import startup, providers
+from backend.services.logs import configure_logging, stop_logging
+
+configure_logging()
 # from backend.routes.voice_roleplay import router as voice_roleplay_router
-from backend.services.db import init_db, close_db
-from backend.routes.conversation_routes import router as conv_router
-from backend.routes.agents import router as agents_router
-from backend.routes.audio_routes import router as audio_router
+with startup.stage("import backend.services.db"):
+    from backend.services.db import init_db, close_db
+from backend.services.encoding import BSONJSONResponse
+from backend.services.config import get_service_config
+with startup.stage("import backend.routes.conversation_routes"):
+    from backend.routes.conversation_routes import router as conv_router
+with startup.stage("import backend.routes.agents"):
+    from backend.routes.agents import router as agents_router
+with startup.stage("import backend.routes.audio_routes"):
+    from backend.routes.audio_routes import router as audio_router
+from backend.routes.metrics_routes import router as metrics_router
+from backend.routes.export_routes import router as export_router
+from backend.routes.usage_routes import router as usage_router
+from backend.services.degradation import degradation
+
+# Import provider SDKs in the background after startup instead of on the first request
+PROVIDER_WARMUP = os.getenv("PROVIDER_WARMUP", "true").lower() == "true"
 
 
-app = FastAPI(title="AtlasTalk API", description="Voice Roleplay and Conversation API")
+app = FastAPI(
+    title="AtlasTalk API",
+    description="Voice Roleplay and Conversation API",
+    default_response_class=BSONJSONResponse,
+)
 
 # CORS middleware for frontend communication
 app.add_middleware(
@@ -18,28 +41,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Degradation-Level", "Retry-After"],
 )
 
 # app.include_router(voice_roleplay_router)
 app.include_router(conv_router)
 app.include_router(agents_router)
 app.include_router(audio_router)
+app.include_router(metrics_router)
+app.include_router(export_router)
+app.include_router(usage_router)
+
+
+@app.middleware("http")
+async def degradation_header(request, call_next):
+    # Lets clients skip optional work (audio, goal polling) while upstream is slow
+    response = await call_next(request)
+    response.headers["X-Degradation-Level"] = str(degradation.level)
+    return response
 
 
 @app.on_event("startup")
 async def startup_event():
-    init_db(app)
+    startup.require("db")
+    if PROVIDER_WARMUP:
+        startup.require("providers")
+    with startup.stage("init_db"):
+        init_db(app)
+    get_service_config()
+    startup.complete("db")
+    if PROVIDER_WARMUP:
+        app.state._warmup_task = asyncio.create_task(_warm_up_providers())
+
+
+async def _warm_up_providers():
+    try:
+        with startup.stage("provider warm-up"):
+            await asyncio.to_thread(providers.warm_up)
+    except Exception:
+        logging.exception("Provider warm-up failed; worker stays not ready")
+        return
+    startup.complete("providers")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    close_db(app)
+    await close_db(app)
+    stop_logging()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: DB initialized and provider SDKs loaded. Includes startup timings."""
+    report = startup.report()
+    return BSONJSONResponse(report, status_code=200 if report["ready"] else 503)
 
 @app.get("/")
 async def root():
-    from backend.services.voice_roleplay import VoiceRoleplayService
-    voice_service = VoiceRoleplayService()
-    config = voice_service.get_config()
-    
+    config = get_service_config()
+
     return {
         "message": "AtlasTalk API is running",
         "voice_roleplay": {
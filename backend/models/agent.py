@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 
 class AgentSetupRequest(BaseModel):
@@ -13,3 +13,8 @@ class AgentSetupResponse(BaseModel):
     conversation_id: str
     agent: str
     gemini_conversation_id: Optional[str] = None
+
+
+class AgentSetupBatchRequest(BaseModel):
+    # one entry per learner in the cohort
+    learners: List[AgentSetupRequest] = Field(..., min_length=1, max_length=1000)
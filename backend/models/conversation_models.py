@@ -21,3 +21,16 @@ class ConversationInDB(BaseModel):
 
 	class Config:
 		orm_mode = True
+
+
+class StoredMessage(Message):
+	seq: Optional[int] = None
+	# stored TTS clip: {file_id, format, media_type, length, etag}
+	audio: Optional[dict] = None
+
+
+class ConversationResponse(BaseModel):
+	conversation_id: str
+	messages: List[StoredMessage]
+	created_at: Optional[datetime] = None
+	metadata: Optional[dict] = None
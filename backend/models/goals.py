@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import List
+
+
+class Goal(BaseModel):
+    goal: str
+    completed: bool = False
+
+
+class GoalState(BaseModel):
+    """A goal checker's reply: ``{"goals": [{"goal": ..., "completed": ...}]}``."""
+    goals: List[Goal]
+
+
+class Scenario(BaseModel):
+    """A generated voice roleplay scenario."""
+    scenario_title: str
+    description: str = ""
+    ai_character: str = "AI Assistant"
+    environment: str = "General setting"
+    goals: List[Goal]
+    opening_line: str = ""
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+
+class SimulationScript(BaseModel):
+    agent: str
+    country: str
+    language: str
+    scenario_prompt: Optional[str] = None
+    # learner messages, sent in order
+    turns: List[str] = Field(..., min_length=1, max_length=50)
+    runs: int = Field(1, ge=1, le=100)
+
+
+class SimulationPlan(BaseModel):
+    scripts: List[SimulationScript] = Field(..., min_length=1, max_length=50)
+    concurrency: int = Field(4, ge=1, le=32)
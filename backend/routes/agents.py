@@ -1,13 +1,35 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 import logging
-from bson import ObjectId
 
-from backend.models.agent import AgentSetupRequest, AgentSetupResponse
-from backend.services.conversation import setupAgent
+from backend.models.agent import AgentSetupBatchRequest, AgentSetupRequest, AgentSetupResponse
+from backend.services.admin import require_admin_token
+from backend.services.conversation import setup_cohort, setupAgent
+from backend.services.encoding import dumps
+from backend.services.agent_registry import registry
+from backend.services.logs import bind
+from backend.services.usage import attribute
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
 
+@router.get("")
+async def list_agents():
+    """Registered agents with credential status and the latest probe (health, latency)."""
+    return {"source": registry.source, "loaded_at": registry.loaded_at, "agents": registry.status()}
+
+
+@router.post("/reload", dependencies=[Depends(require_admin_token)])
+async def reload_agents():
+    """Re-read the agent registry now instead of waiting for the next poll."""
+    try:
+        changes = await registry.reload()
+    except Exception as exc:
+        logging.exception("Agent registry reload failed")
+        raise HTTPException(status_code=400, detail=f"Agent registry reload failed: {exc}")
+    return {"changes": changes, "agents": registry.status()}
+
+
 @router.post("/{agent}/setup", response_model=AgentSetupResponse, status_code=201)
 async def route_setup_agent(agent: str, payload: AgentSetupRequest, request: Request):
     """Create a new conversation and send initial system prompt to the agent.
@@ -18,34 +40,48 @@ async def route_setup_agent(agent: str, payload: AgentSetupRequest, request: Req
     language = payload.language
     user_id = payload.user_id
     scenario_prompt = payload.scenario_prompt
+    bind(agent=agent)
+    attribute(agent=agent, user_id=user_id)
 
     try:
-        # Prefer using the already-initialized DB attached to app.state
+        # Prefer using the already-initialized DB attached to app.state; ownership is set on insert
         client, response, conversation_id, g_client, g_response, gemini_conversation_id = await setupAgent(
-            agent, country, language, db=request.app.state._mongo_db, scenario_prompt=scenario_prompt
+            agent, country, language, db=request.app.state._mongo_db, scenario_prompt=scenario_prompt, user_id=user_id
         )
     except Exception as exc:
         logging.exception("Agent setup failed")
         # Return a 502 Bad Gateway to indicate upstream/third-party failure
         raise HTTPException(status_code=502, detail=str(exc))
 
-    # if user_id provided, attach ownership to the conversation
-    if user_id:
-        db = request.app.state._mongo_db
-        try:
-            try:
-                uid = ObjectId(user_id)
-            except Exception:
-                uid = user_id  # store as string if not a valid ObjectId
-            await db.conversations.update_one(
-                {"_id": ObjectId(conversation_id)}, {"$set": {"user_id": uid}}
-            )
-            if gemini_conversation_id:
-                await db.conversations.update_one(
-                    {"_id": ObjectId(gemini_conversation_id)}, {"$set": {"user_id": uid}}
-                )
-        except Exception as exc:
-            logging.exception("Failed to attach user_id to conversation %s", conversation_id)
-            raise HTTPException(status_code=502, detail=f"Failed to attach user_id: {exc}")
-
     return AgentSetupResponse(conversation_id=conversation_id, agent=agent, gemini_conversation_id=gemini_conversation_id)
+
+
+@router.post("/{agent}/setup:batch", status_code=201)
+async def route_setup_cohort(agent: str, payload: AgentSetupBatchRequest, request: Request):
+    """Create sessions for a whole cohort; streams one NDJSON record per learner as it is stored.
+
+    Learners sharing a country, language and scenario are inserted together
+    and share one warm-up. Records are ``{"type": "session", "index", "user_id",
+    "conversation_id", "gemini_conversation_id"}`` or, for a learner that could
+    not be stored, ``{"type": "error", "index", "error"}``, in completion order,
+    then a ``summary``.
+    """
+    bind(agent=agent)
+    attribute(agent=agent)
+    try:
+        registry.client(agent)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=str(exc))
+
+    async def lines():
+        created, errors = 0, 0
+        async for result in setup_cohort(agent, payload.learners, db=request.app.state._mongo_db):
+            if result.get("error"):
+                errors += 1
+                yield dumps({"type": "error", "agent": agent, **result}) + b"\n"
+            else:
+                created += 1
+                yield dumps({"type": "session", "agent": agent, **result}) + b"\n"
+        yield dumps({"type": "summary", "agent": agent, "sessions": created, "errors": errors}) + b"\n"
+
+    return StreamingResponse(lines(), status_code=201, media_type="application/x-ndjson")
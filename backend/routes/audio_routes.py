@@ -1,10 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import tempfile
 import aiofiles
 import os
+import time
+from bson import ObjectId
 
-from backend.services.conversation import (text_to_speech, speech_to_text)  # adjust path if needed
+from backend.services.conversation import (text_to_speech, stream_text_to_speech, speech_to_text)  # adjust path if needed
+from backend.services.audio_formats import AUDIO_FORMATS, negotiate_format
+from backend.services.idempotency import run_idempotent
+from backend.services.cancellation import DeadlineExceededError, run_request
+from backend.services.rate_limit import admission_controller, check_rate_limit, estimate_audio_seconds
+from backend.services.degradation import TEXT_ONLY, degradation
+from backend.services.usage import attribute, record_usage
+from backend.services.farewell import farewells
+from backend.services.audio_store import get_audio_store
+from backend.services.voice_profiles import conversation_profiles, resolve_profile
 
 router = APIRouter(prefix="/audio", tags=["Audio"])
 
@@ -12,30 +23,153 @@ router = APIRouter(prefix="/audio", tags=["Audio"])
 # 🔊 TEXT → SPEECH (TTS)
 # ===============================
 @router.post("/tts")
-async def tts_route(text: str = Form(...)):
+async def tts_route(
+    request: Request,
+    text: str = Form(...),
+    agent: str | None = Form(None),
+    conversation_id: str | None = Form(None),
+    seq: int | None = Form(None),
+    format: str | None = Query(None),
+    idempotency_key: str | None = Header(None),
+):
     """
     Convert text into speech using ElevenLabs TTS.
-    Returns the audio file for playback.
+    Voice and model tier come from the conversation's voice profile. The
+    output format comes from ``?format=`` (mp3, mp3_low, opus, pcm), else
+    the Accept header, else the profile's default. Audio is streamed
+    to the client as ElevenLabs produces it. Retries carrying the same
+    Idempotency-Key are served the already synthesized file instead. The
+    download is abandoned if the client disconnects. The characters are
+    attributed in the usage ledger to the conversation's agent and owner
+    (without ``conversation_id``: the ``agent`` field and X-User-Id). With
+    ``conversation_id`` the audio is also kept in GridFS and linked to message
+    ``seq`` (default: the latest assistant message with this text), to be
+    replayed from ``GET /conversations/{id}/messages/{seq}/audio``.
     """
+    if degradation.level >= TEXT_ONLY:
+        # Upstream is badly degraded; clients fall back to the text reply
+        return JSONResponse(status_code=503, content={"error": "Audio temporarily disabled (text-only mode)"})
+
+    # the conversation's voice profile was resolved at setup; otherwise the agent's
+    if conversation_id and not ObjectId.is_valid(conversation_id):
+        return JSONResponse(status_code=400, content={"error": "Invalid conversation_id"})
+    user_id = request.headers.get("x-user-id")
+    if conversation_id:
+        session = await conversation_profiles.session(conversation_id, request.app.state._mongo_db)
+        profile, agent, user_id = session.profile, session.agent or agent, session.user_id or user_id
+    else:
+        profile = resolve_profile(agent, None)
     try:
-        file_path = await text_to_speech(text)
-        return FileResponse(
-            file_path,
-            media_type="audio/mpeg",
-            filename="speech.mp3"
+        audio_format = negotiate_format(format, request.headers.get("accept"), profile.audio_format)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e), "formats": list(AUDIO_FORMATS)})
+    fmt = AUDIO_FORMATS[audio_format]
+    attribute(agent=agent, user_id=user_id)
+    store = get_audio_store() if conversation_id else None
+
+    # the farewell of a just-ended conversation was synthesized ahead of time
+    prepared = farewells.audio(conversation_id, text, audio_format) if conversation_id else None
+    if prepared is not None:
+        record_usage("replay", conversation_id=conversation_id, cache_hits=1)
+        return Response(prepared, media_type=fmt.media_type)
+
+    if idempotency_key:
+        # Retries must get identical bytes, so synthesize to a file once
+        async def synthesize():
+            await check_rate_limit(request, "tts_chars", len(text))
+            async with admission_controller.slot():
+                start = time.perf_counter()
+                file_path = await text_to_speech(text, audio_format=audio_format, profile=profile)
+            record_usage(
+                "tts", conversation_id=conversation_id, tts_chars=len(text), upstream_calls=1,
+                upstream_ms=round((time.perf_counter() - start) * 1000, 1),
+            )
+            if store is not None:
+                async with aiofiles.open(file_path, "rb") as f:
+                    audio = await f.read()
+                await store.save(audio, conversation_id=conversation_id, audio_format=audio_format, seq=seq, text=text)
+            return file_path
+
+        try:
+            file_path = await run_request(
+                request,
+                lambda: run_idempotent(
+                    idempotency_key, "tts", synthesize, text, audio_format,
+                    on_replay=lambda: record_usage("replay", conversation_id=conversation_id, cache_hits=1),
+                ),
+            )
+            return FileResponse(
+                file_path,
+                media_type=fmt.media_type,
+                filename=f"speech{fmt.suffix}"
+            )
+        except HTTPException:
+            raise
+        except DeadlineExceededError as e:
+            return JSONResponse(status_code=504, content={"error": str(e)})
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"error": str(e)})
+
+    async def stream():
+        async with admission_controller.slot():
+            async for chunk in stream_text_to_speech(text, audio_format=audio_format, profile=profile):
+                yield chunk
+
+    await check_rate_limit(request, "tts_chars", len(text))
+    chunks = stream()
+    if store is not None:
+        # kept in GridFS as it streams; linked to the message once complete
+        chunks = store.tee(chunks, conversation_id=conversation_id, audio_format=audio_format, seq=seq, text=text)
+    start = time.perf_counter()
+    try:
+        # Wait for the first chunk so upstream errors still get a JSON status
+        first = await chunks.__anext__()
+        # for a stream, upstream latency is the time to first audio
+        record_usage(
+            "tts", conversation_id=conversation_id, tts_chars=len(text), upstream_calls=1,
+            upstream_ms=round((time.perf_counter() - start) * 1000, 1),
         )
+    except StopAsyncIteration:
+        return Response(status_code=204)
+    except HTTPException:
+        raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=fmt.media_type)
+
 
 # ===============================
 # 🎙️ SPEECH → TEXT (STT)
 # ===============================
 @router.post("/stt")
-async def stt_route(audio_file: UploadFile = File(...)):
+async def stt_route(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    conversation_id: str | None = Form(None),
+    agent: str | None = Form(None),
+):
     """
     Transcribe a speech audio file to text using ElevenLabs STT.
+    The upstream call is cancelled if the client disconnects.
+    The audio is attributed in the usage ledger to the conversation's agent
+    and owner (without ``conversation_id``: the ``agent`` field and
+    X-User-Id); ``conversation_id`` also supplies the language hint from its
+    voice profile.
     """
+    if conversation_id and not ObjectId.is_valid(conversation_id):
+        return JSONResponse(status_code=400, content={"error": "Invalid conversation_id"})
+    user_id = request.headers.get("x-user-id")
+    language_code = None
+    if conversation_id:
+        session = await conversation_profiles.session(conversation_id, request.app.state._mongo_db)
+        language_code, agent, user_id = session.profile.stt_language, session.agent or agent, session.user_id or user_id
+    attribute(agent=agent, user_id=user_id)
     try:
         # Save uploaded file temporarily
         with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
@@ -43,13 +177,30 @@ async def stt_route(audio_file: UploadFile = File(...)):
             tmp.write(contents)
             tmp_path = tmp.name
 
-        # Convert speech to text
-        text = await speech_to_text(tmp_path)
+        async def transcribe():
+            audio_seconds = estimate_audio_seconds(len(contents))
+            await check_rate_limit(request, "stt_seconds", audio_seconds)
+            async with admission_controller.slot():
+                start = time.perf_counter()
+                text = await speech_to_text(tmp_path, language_code=language_code)
+            record_usage(
+                "stt", conversation_id=conversation_id, stt_seconds=round(audio_seconds, 2), upstream_calls=1,
+                upstream_ms=round((time.perf_counter() - start) * 1000, 1),
+            )
+            return text
 
-        # Clean up
-        os.remove(tmp_path)
+        # Convert speech to text
+        try:
+            text = await run_request(request, transcribe)
+        finally:
+            # Clean up
+            os.remove(tmp_path)
 
         return {"transcription": text}
 
+    except HTTPException:
+        raise
+    except DeadlineExceededError as e:
+        return JSONResponse(status_code=504, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -1,15 +1,46 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import Response, StreamingResponse
+import time
+import asyncio
+import logging
 from datetime import datetime
 from bson import ObjectId
 
-from backend.models.conversation_models import Message, ConversationCreate
+from backend.models.conversation_models import Message, ConversationCreate, ConversationResponse
 from backend.services.conversation import (
+	append_message,
 	messageAgent,
+	generate_farewell,
+	store_farewell,
 	_get_client_for_agent,
 )
+from backend.services.concurrency import ConversationConflictError, conversation_lock
+from backend.services.idempotency import run_idempotent
+from backend.services.cancellation import DeadlineExceededError, run_request
+from backend.services.encoding import BSONJSONResponse, conversation_payload, dumps
+from backend.services.rate_limit import admission_controller, check_rate_limit
+from backend.services.degradation import degradation
+from backend.services.logs import bind
+from backend.services.usage import attribute, record_usage, token_usage
+from backend.services.farewell import farewells
+from backend.services.audio_store import RangeNotSatisfiable, get_audio_store, parse_range
+from backend.services import jobs
+from backend.services.events import EVENTS_HEARTBEAT_SECONDS, EVENTS_RETRY_MS, hub
+from backend.services.simulation import parse_goals
+from backend.services.templates import templates
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
+# Strong references to fire-and-forget tasks so they are not garbage collected
+_background_turns: set = set()
+
+
+def _object_id(value: str, name: str = "conversation_id") -> ObjectId:
+	"""``value`` as an ObjectId; a malformed id is the client's error (400), not a 500."""
+	if not ObjectId.is_valid(value):
+		raise HTTPException(status_code=400, detail=f"Invalid {name}")
+	return ObjectId(value)
+
 
 def conv_collection(request: Request):
 	return request.app.state._mongo_db.get_collection("conversations")
@@ -22,110 +53,423 @@ async def start_conversation(request: Request, payload: ConversationCreate | Non
 		"messages": [],
 		"created_at": datetime.utcnow(),
 		"metadata": payload.metadata if payload else {},
+		"seq": 0,
 	}
 	result = await coll.insert_one(doc)
 	return {"conversation_id": str(result.inserted_id)}
 
 
 @router.post("/{conversation_id}/messages", status_code=200)
-async def add_message(conversation_id: str, message: Message, request: Request):
+async def add_message(
+	conversation_id: str,
+	message: Message,
+	request: Request,
+	idempotency_key: str | None = Header(None),
+):
+	"""Send a message; retries carrying the same Idempotency-Key reuse the first reply.
+
+	The turn is cancelled, upstream call included, if the client disconnects.
+	"""
+	return await run_request(
+		request,
+		lambda: run_idempotent(
+			idempotency_key,
+			f"messages:{conversation_id}",
+			lambda: _add_message(conversation_id, message, request),
+			message.role,
+			message.content,
+			on_replay=lambda: record_usage("replay", conversation_id=conversation_id, cache_hits=1),
+		),
+	)
+
+
+async def _add_message(conversation_id: str, message: Message, request: Request):
 	coll = conv_collection(request)
-	oid = ObjectId(conversation_id)
+	oid = _object_id(conversation_id)
 
 	doc = await coll.find_one({"_id": oid})
 	if not doc:
 		raise HTTPException(status_code=404, detail="Conversation not found")
 
 	agent_name = doc.get("agent")
+	bind(conversation_id=conversation_id, agent=agent_name)
+	attribute(agent=agent_name, user_id=doc.get("user_id"))
 	if not agent_name:
-		# Plain conversation; just append the message
-		msg_doc = {
-			"role": message.role,
-			"content": message.content,
-			"timestamp": message.timestamp or datetime.utcnow(),
-		}
-		await coll.update_one({"_id": oid}, {"$push": {"messages": msg_doc}})
+		# Plain conversation; just append the message (tagged with its seq, and
+		# published to event streams)
+		try:
+			async with conversation_lock(conversation_id):
+				current = await coll.find_one({"_id": oid}, {"seq": 1}) or {}
+				await append_message(
+					conversation_id,
+					message.role,
+					message.content,
+					db=request.app.state._mongo_db,
+					max_messages=None,
+					expected_seq=current.get("seq", 0),
+					timestamp=message.timestamp,
+				)
+		except ConversationConflictError as exc:
+			raise HTTPException(status_code=409, detail=str(exc))
 		return {"ok": True}
 
 	# Agent-backed conversation: delegate to service (supports DO agents and Gemini)
 	client = _get_client_for_agent(agent_name)
-	try:
-		result = await messageAgent(
-			client,
-			conversation_id,
-			message.role,
-			message.content,
-			db=request.app.state._mongo_db,
+	await check_rate_limit(request, "llm_turns")
+
+	if agent_name == "GEMINI" and degradation.defer_goal_checks():
+		# Upstream is slow: check goals after the reply instead of before it.
+		# The result is stored on the conversation and sent as a `goals` event
+		# on the agent conversation's events stream.
+		await jobs.enqueue(
+			"goal_check",
+			{"conversation_id": conversation_id, "role": message.role, "content": message.content},
 		)
-	except Exception as exc:
-		import logging
+		return {"conversation_id": conversation_id, "assistant": None, "pending": True}
 
+	if agent_name != "GEMINI":
+		# the conversation moves on; a farewell prepared for it is stale
+		farewells.invalidate(conversation_id)
+	try:
+		async with admission_controller.slot():
+			result = await messageAgent(
+				client,
+				conversation_id,
+				message.role,
+				message.content,
+				db=request.app.state._mongo_db,
+			)
+	except HTTPException:
+		raise
+	except DeadlineExceededError as exc:
+		raise HTTPException(status_code=504, detail=str(exc))
+	except ConversationConflictError as exc:
+		# Another turn on this conversation is running or won the race
+		raise HTTPException(status_code=409, detail=str(exc))
+	except Exception as exc:
 		logging.exception("Error sending message to agent for conversation %s", conversation_id)
 		raise HTTPException(status_code=502, detail=str(exc))
 
+	if agent_name == "GEMINI":
+		# goals nearly done: prepare the linked conversation's farewell in the background
+		farewells.observe_goals(doc, result.get("assistant_text"), request.app.state._mongo_db)
+	else:
+		farewells.turn_completed(conversation_id)
+
 	return {"conversation_id": conversation_id, "assistant": result.get("assistant_text")}
 
 
-@router.get("/{conversation_id}", status_code=200)
+async def _check_goals(payload: dict, db):
+	"""``goal_check`` job: a goal turn deferred while upstream is degraded."""
+	await messageAgent(
+		_get_client_for_agent("GEMINI"), payload["conversation_id"], payload["role"], payload["content"], db=db
+	)
+
+
+# not retried: a failed attempt may already have stored the user message
+jobs.register("goal_check", _check_goals, concurrency=4, max_attempts=1)
+
+
+def _finish_background_turn(task: asyncio.Task):
+	_background_turns.discard(task)
+	if not task.cancelled() and task.exception() is not None:
+		logging.error("Background task failed", exc_info=task.exception())
+
+
+@router.get("/{conversation_id}", status_code=200, response_model=ConversationResponse)
 async def get_conversation(conversation_id: str, request: Request):
 	coll = conv_collection(request)
-	doc = await coll.find_one({"_id": ObjectId(conversation_id)})
+	doc = await coll.find_one(
+		{"_id": _object_id(conversation_id)}, {"messages": 1, "created_at": 1, "metadata": 1}
+	)
 	if not doc:
 		raise HTTPException(status_code=404, detail="Conversation not found")
-	return {
-		"conversation_id": str(doc["_id"]),
-		"messages": doc.get("messages", []),
-		"created_at": doc.get("created_at"),
-		"metadata": doc.get("metadata", {}),
-	}
+	doc["messages"] = await templates.resolve(doc.get("messages", []), coll.database)
+	# Returning the response directly skips jsonable_encoder and response-model
+	# validation; the messages were validated when they were written.
+	return BSONJSONResponse(conversation_payload(doc))
+
+
+@router.get("/{conversation_id}/events")
+async def conversation_events(conversation_id: str, request: Request, last_event_id: str | None = Header(None)):
+	"""Server-sent events for the conversation: ``message`` for every stored
+	message and ``goals`` for every goal update of its linked goal conversation.
+
+	Event ids are ``<seq>`` or ``<seq>.<goal seq>``. A client reconnecting
+	with ``Last-Event-ID`` (or ``?last_event_id=`` for the first connection)
+	gets what it missed from Mongo before live events resume.
+	"""
+	coll = conv_collection(request)
+	doc = await coll.find_one({"_id": _object_id(conversation_id)}, {"seq": 1, "metadata.goal_conversation_id": 1})
+	if not doc:
+		raise HTTPException(status_code=404, detail="Conversation not found")
+	goal_id = (doc.get("metadata") or {}).get("goal_conversation_id")
+	ids = [conversation_id] + ([goal_id] if goal_id else [])
+	resume = _parse_event_id(last_event_id or request.query_params.get("last_event_id"), len(ids))
+
+	# subscribe before reading positions: anything published in between is
+	# buffered, and skipped below if the positions already cover it
+	sub = hub.subscribe(ids)
+	try:
+		if resume is not None:
+			positions = dict(zip(ids, resume))
+			sub.resync.update(ids)
+		else:
+			positions = {conversation_id: doc.get("seq", 0)}
+			if goal_id:
+				goal_doc = await coll.find_one({"_id": _object_id(goal_id, "goal_conversation_id")}, {"seq": 1})
+				positions[goal_id] = (goal_doc or {}).get("seq", 0)
+	except BaseException:
+		hub.unsubscribe(sub)
+		raise
+
+	async def stream():
+		try:
+			yield f"retry: {EVENTS_RETRY_MS}\n\n"
+			while True:
+				events, resync = sub.drain()
+				for cid in reversed(ids):
+					if cid in resync:
+						events[:0] = await _missed_messages(coll, cid, positions[cid])
+				for cid, message in events:
+					seq = message.get("seq")
+					if seq is None or seq <= positions[cid]:
+						continue
+					if seq > positions[cid] + 1:
+						# written by another worker; fill the gap from Mongo
+						for _, missed in await _missed_messages(coll, cid, positions[cid]):
+							if missed["seq"] < seq:
+								chunk = _event_chunk(cid, missed, positions, ids)
+								if chunk:
+									yield chunk
+					chunk = _event_chunk(cid, message, positions, ids)
+					if chunk:
+						yield chunk
+				if sub.pending or sub.resync:
+					continue
+				try:
+					await asyncio.wait_for(sub.wake.wait(), timeout=EVENTS_HEARTBEAT_SECONDS)
+				except asyncio.TimeoutError:
+					yield ": ping\n\n"
+		finally:
+			hub.unsubscribe(sub)
+
+	return StreamingResponse(
+		stream(),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
+def _parse_event_id(value: str | None, count: int) -> list | None:
+	if not value:
+		return None
+	try:
+		parts = [int(part) for part in value.split(".")]
+	except ValueError:
+		return None
+	# a goal conversation linked after the id was issued starts from the beginning
+	return (parts + [0] * count)[:count]
+
+
+async def _missed_messages(coll, conversation_id: str, after: int) -> list:
+	"""``(conversation_id, message)`` for the stored messages past seq ``after``."""
+	doc = await coll.find_one({"_id": _object_id(conversation_id)}, {"messages": {"$slice": -200}, "seq": 1})
+	if not doc:
+		return []
+	messages = await templates.resolve(doc.get("messages", []), coll.database)
+	last = doc.get("seq", len(messages))
+	missed = []
+	for i, message in enumerate(messages):
+		# every append bumps seq by one, so position gives the seq of older messages stored without one
+		seq = message.get("seq", last - (len(messages) - 1 - i))
+		if seq > after:
+			missed.append((conversation_id, {**message, "seq": seq}))
+	return missed
+
+
+def _event_chunk(conversation_id: str, message: dict, positions: dict, ids: list) -> str | None:
+	"""Advance the stream position past ``message`` and render its SSE event, if it has one."""
+	positions[conversation_id] = message["seq"]
+	event_id = ".".join(str(positions[cid]) for cid in ids)
+	if conversation_id == ids[0]:
+		event = "message"
+		data = {
+			"conversation_id": conversation_id,
+			"seq": message["seq"],
+			"role": message.get("role"),
+			"content": message.get("content"),
+			"timestamp": message.get("timestamp"),
+		}
+	elif message.get("role") == "assistant":
+		event = "goals"
+		data = {"conversation_id": conversation_id, "seq": message["seq"], "goals": parse_goals(message.get("content"))}
+	else:
+		# the goal checker's copy of a user turn
+		return None
+	return f"id: {event_id}\nevent: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+@router.api_route("/{conversation_id}/messages/{seq}/audio", methods=["GET", "HEAD"])
+async def get_message_audio(conversation_id: str, seq: int, request: Request):
+	"""Replay the stored TTS audio of a message.
+
+	Supports a single ``Range`` (206), ``If-Range`` and ``If-None-Match`` (304).
+	The clip is streamed from GridFS, never read into memory whole.
+	"""
+	store = get_audio_store()
+	if store is None:
+		raise HTTPException(status_code=404, detail="Audio storage is disabled")
+	coll = conv_collection(request)
+	doc = await coll.find_one(
+		{"_id": _object_id(conversation_id)}, {"messages": {"$elemMatch": {"seq": seq}}}
+	)
+	if not doc:
+		raise HTTPException(status_code=404, detail="Conversation not found")
+	link = (doc.get("messages") or [{}])[0].get("audio")
+	if not link:
+		raise HTTPException(status_code=404, detail="No stored audio for this message")
+
+	etag = f'"{link["etag"]}"'
+	headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=31536000, immutable"}
+	if etag in (request.headers.get("if-none-match") or ""):
+		return Response(status_code=304, headers=headers)
+
+	size = link["length"]
+	range_header = request.headers.get("range")
+	if_range = request.headers.get("if-range")
+	if if_range and if_range != etag:
+		# the client's copy is outdated; send the whole clip
+		range_header = None
+	try:
+		byte_range = parse_range(range_header, size)
+	except RangeNotSatisfiable:
+		return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+	try:
+		grid_out = await store.open(link)
+	except Exception:
+		# removed by the retention policy since the message was read
+		raise HTTPException(status_code=404, detail="Stored audio has expired")
+	start, end = byte_range or (0, size - 1)
+	headers["Content-Length"] = str(end - start + 1)
+	status_code = 200
+	if byte_range:
+		status_code = 206
+		headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+	if request.method == "HEAD" or size == 0:
+		return Response(status_code=status_code, headers=headers, media_type=link["media_type"])
+	return StreamingResponse(
+		store.read_range(grid_out, start, end),
+		status_code=status_code,
+		headers=headers,
+		media_type=link["media_type"],
+	)
 
 
 @router.post("/{conversation_id}/end", status_code=200)
-async def end_conversation_in_character(conversation_id: str, request: Request):
+async def end_conversation_in_character(
+	conversation_id: str,
+	request: Request,
+	idempotency_key: str | None = Header(None),
+):
 	"""Ask the agent to end the conversation in-character with a short farewell.
 
-	Returns the assistant's closing message.
+	Returns the assistant's closing message. Retries carrying the same
+	Idempotency-Key get the first farewell instead of a new one.
 	"""
+	return await run_request(
+		request,
+		lambda: run_idempotent(
+			idempotency_key,
+			f"end:{conversation_id}",
+			lambda: _end_conversation(conversation_id, request),
+			on_replay=lambda: record_usage("replay", conversation_id=conversation_id, cache_hits=1),
+		),
+	)
+
+
+async def _end_conversation(conversation_id: str, request: Request):
 	coll = conv_collection(request)
-	oid = ObjectId(conversation_id)
+	oid = _object_id(conversation_id)
 
 	doc = await coll.find_one({"_id": oid})
 	if not doc:
 		raise HTTPException(status_code=404, detail="Conversation not found")
 
 	agent_name = doc.get("agent")
+	bind(conversation_id=conversation_id, agent=agent_name)
+	attribute(agent=agent_name, user_id=doc.get("user_id"))
 	if not agent_name:
 		raise HTTPException(status_code=400, detail="Conversation is not agent-backed")
 
-	# Build an in-character closing instruction using conversation metadata
-	metadata = doc.get("metadata", {}) or {}
-	language = metadata.get("language")
-	scenario_prompt = metadata.get("scenario_prompt")
-
-	parts = [
-		"Please end this conversation now in character."
-	]
-	if scenario_prompt:
-		parts.append(f"Stay consistent with this scenario: {scenario_prompt}")
-	# Keep it brief and avoid new topics
-	parts.append("Provide a brief, warm farewell (1-3 sentences). Do not introduce new topics.")
-	if language and isinstance(language, str):
-		parts.append(f"Respond in {language}.")
-
-	closing_instruction = " ".join(parts)
-
-	client = _get_client_for_agent(agent_name)
+	db = request.app.state._mongo_db
 	try:
-		result = await messageAgent(
-			client,
-			conversation_id,
-			"user",
-			closing_instruction,
-			db=request.app.state._mongo_db,
-		)
+		async with conversation_lock(conversation_id):
+			# a farewell prepared while the goals were nearly done: only the write is left
+			farewell = await farewells.take(conversation_id)
+			if farewell is not None:
+				try:
+					await store_farewell(conversation_id, farewell.text, seq=farewell.seq, db=db)
+				except ConversationConflictError:
+					# another worker moved the conversation on; generate it live instead
+					farewell = None
+			if farewell is not None:
+				text = farewell.text
+				_store_farewell_audio(conversation_id, farewell)
+			else:
+				text = await _live_farewell(conversation_id, agent_name, doc.get("metadata"), request)
+	except HTTPException:
+		raise
+	except DeadlineExceededError as exc:
+		raise HTTPException(status_code=504, detail=str(exc))
+	except ConversationConflictError as exc:
+		raise HTTPException(status_code=409, detail=str(exc))
 	except Exception as exc:
-		import logging
 		logging.exception("Error ending conversation %s", conversation_id)
 		raise HTTPException(status_code=502, detail=str(exc))
+	finally:
+		farewells.finish(conversation_id)
 
-	return {"conversation_id": conversation_id, "assistant": result.get("assistant_text")}
+	return {"conversation_id": conversation_id, "assistant": text}
+
+
+def _store_farewell_audio(conversation_id: str, farewell):
+	"""Keep the prepared farewell audio like any synthesized turn, off the response path."""
+	store = get_audio_store()
+	if store is None or farewell.audio is None:
+		return
+	task = asyncio.create_task(
+		store.save(
+			farewell.audio,
+			conversation_id=conversation_id,
+			audio_format=farewell.audio_format,
+			seq=farewell.seq + 1 if farewell.seq is not None else None,
+			text=farewell.text,
+		)
+	)
+	_background_turns.add(task)
+	task.add_done_callback(_finish_background_turn)
+
+
+async def _live_farewell(conversation_id: str, agent_name: str, metadata, request: Request) -> str:
+	"""Generate and store the farewell now; the closing instruction is not stored."""
+	client = _get_client_for_agent(agent_name)
+	await check_rate_limit(request, "llm_turns")
+	db = request.app.state._mongo_db
+	async with admission_controller.slot():
+		start = time.perf_counter()
+		text, seq, response = await generate_farewell(client, conversation_id, metadata, db=db)
+		upstream_ms = (time.perf_counter() - start) * 1000
+	await store_farewell(conversation_id, text, seq=seq, db=db)
+	prompt_tokens, completion_tokens = token_usage(response)
+	record_usage(
+		"turn",
+		conversation_id=conversation_id,
+		turns=1,
+		prompt_tokens=prompt_tokens,
+		completion_tokens=completion_tokens,
+		upstream_calls=1,
+		upstream_ms=round(upstream_ms, 1),
+	)
+	return text
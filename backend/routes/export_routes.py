@@ -0,0 +1,69 @@
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from backend.services.admin import require_admin_token
+from backend.services.export import (
+    EXPORT_BATCH_SIZE,
+    EXPORT_MAX_DOCS_PER_SECOND,
+    build_projection,
+    build_query,
+    export_batches,
+    gzip_stream,
+)
+
+router = APIRouter(prefix="/exports", tags=["exports"])
+
+
+@router.get("/conversations", dependencies=[Depends(require_admin_token)])
+async def export_conversations(
+    request: Request,
+    agent: Optional[str] = None,
+    country: Optional[str] = None,
+    language: Optional[str] = None,
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = Query(None, description="Resume after this conversation_id"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to include"),
+    format: Literal["ndjson", "gzip"] = "ndjson",
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=5000),
+    max_docs_per_second: float = Query(EXPORT_MAX_DOCS_PER_SECOND, gt=0),
+):
+    """Stream matching conversations as NDJSON (or gzip'd NDJSON), oldest first.
+
+    Each line has a ``conversation_id``; pass the last one received as
+    ``after`` to resume an interrupted export. Callers can slow the export
+    down but not past ``EXPORT_MAX_DOCS_PER_SECOND``, and reads always use
+    the server's ``EXPORT_READ_PREFERENCE``.
+    """
+    try:
+        query = build_query(
+            agent=agent, country=country, language=language, user_id=user_id,
+            since=since, until=until, after=after,
+        )
+        projection = build_projection(fields.split(",") if fields else None)
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if EXPORT_MAX_DOCS_PER_SECOND > 0:
+        max_docs_per_second = min(max_docs_per_second, EXPORT_MAX_DOCS_PER_SECOND)
+
+    coll = request.app.state._mongo_db.get_collection("conversations")
+
+    async def chunks():
+        async for chunk, _, _ in export_batches(
+            coll, query, projection,
+            batch_size=batch_size,
+            max_docs_per_second=max_docs_per_second,
+        ):
+            yield chunk
+
+    if format == "gzip":
+        return StreamingResponse(
+            gzip_stream(chunks()),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="conversations.ndjson.gz"'},
+        )
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
@@ -0,0 +1,35 @@
+from fastapi import APIRouter
+
+from backend.services.degradation import degradation
+from backend.services.farewell import farewells
+from backend.services.jobs import get_job_runner
+from backend.services.events import hub
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/degradation")
+async def degradation_status():
+    """Current degradation level and rolling p95 latency per upstream stage."""
+    return degradation.status()
+
+
+@router.get("/farewells")
+async def farewell_status():
+    """Speculative farewells on this worker: armed, prepared and in-flight conversations, hits and misses."""
+    return farewells.status()
+
+
+@router.get("/jobs")
+async def job_status():
+    """Background job queue depth per type (shared) and this worker's job wait and run latency."""
+    runner = get_job_runner()
+    if runner is None:
+        return {"enabled": False}
+    return {"enabled": True, **await runner.status()}
+
+
+@router.get("/events")
+async def event_status():
+    """Conversation event streams open on this worker and events published to them."""
+    return hub.status()
@@ -0,0 +1,64 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from backend.services.admin import require_admin_token
+from backend.services.usage import COUNTERS, get_usage_ledger
+
+# per-learner usage and cost: operators only
+router = APIRouter(prefix="/usage", tags=["usage"], dependencies=[Depends(require_admin_token)])
+
+Scope = Literal["conversation", "user", "agent"]
+
+
+def _ledger():
+    ledger = get_usage_ledger()
+    if ledger is None:
+        raise HTTPException(status_code=503, detail="Usage ledger is disabled")
+    return ledger
+
+
+@router.get("/{scope}")
+async def top_usage(
+    scope: Scope,
+    request: Request,
+    sort: str = Query("prompt_tokens", description="Counter to rank by"),
+    limit: int = Query(20, ge=1, le=500),
+):
+    """Largest consumers in a scope, e.g. which agent burns the most prompt tokens.
+
+    Reads flushed totals, so the last few seconds of usage may be missing.
+    """
+    _ledger()
+    if sort not in COUNTERS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(COUNTERS)}")
+    cursor = (
+        request.app.state._mongo_db.usage.find({"scope": scope}, {"_id": 0})
+        .sort(sort, -1)
+        .limit(limit)
+    )
+    return {"scope": scope, "sort": sort, "items": [doc async for doc in cursor]}
+
+
+@router.get("/{scope}/{key}")
+async def usage_totals(
+    scope: Scope,
+    key: str,
+    request: Request,
+    events: int = Query(0, ge=0, le=1000, description="Also return the latest N per-call records"),
+):
+    """Totals for one conversation, user or agent, including unflushed usage.
+
+    Per-session averages follow from ``<counter> / conversations`` on the agent
+    or user totals.
+    """
+    totals = await _ledger().totals(scope, key)
+    if events:
+        field = {"conversation": "conversation_id", "user": "user_id", "agent": "agent"}[scope]
+        cursor = (
+            request.app.state._mongo_db.usage_events.find({field: key}, {"_id": 0})
+            .sort("at", -1)
+            .limit(events)
+        )
+        totals["events"] = [doc async for doc in cursor]
+    return totals
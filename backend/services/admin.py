@@ -0,0 +1,24 @@
+"""Bearer-token guard for operator endpoints.
+
+Transcript exports, usage reports and agent reloads expose every learner's
+data or change server state. They stay disabled (404) until ``ADMIN_TOKEN`` is
+set; callers send it as ``Authorization: Bearer <token>``.
+"""
+import os
+import hmac
+
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException
+
+load_dotenv()
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin_token(authorization: str | None = Header(None)):
+    """Route dependency: 404 while no token is configured, 401 without the right one."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
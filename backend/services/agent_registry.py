@@ -0,0 +1,398 @@
+"""Registry of DigitalOcean agents, reloadable without a restart.
+
+``AGENT_REGISTRY_SOURCE`` selects where agents come from:
+    builtin  the endpoints below (default)
+    file     a JSON file (``AGENT_REGISTRY_FILE``), re-read when its mtime changes
+    mongo    the ``agents`` collection, one document per agent
+
+A file holds ``{"agents": [{"name": "TAXI", "endpoint": "https://...",
+"key_env": "TAXI_PRIVATE_KEY", "enabled": true}]}``; a Mongo document is the
+same with the name as ``_id``. ``key_env`` defaults to ``<NAME>_PRIVATE_KEY``
+and ``enabled`` to true.
+
+The built-in endpoints and the file are operator config; Mongo documents are
+data. An agent loaded from Mongo only gets its key if its endpoint is a
+built-in one or listed in ``AGENT_TRUSTED_ENDPOINTS``, so a document cannot
+send credentials (to turns or probes) to a URL of its choosing.
+
+Credentials are read once per (re)load, not per call. Each agent gets one
+pooled client that every turn reuses; agents whose endpoint and key did not
+change keep their client across reloads, replaced clients are closed once
+in-flight requests have had ``REQUEST_DEADLINE_SECONDS`` to finish.
+
+A background prober requests every enabled agent's endpoint each
+``AGENT_PROBE_SECONDS`` through that same pool and records health and
+latency. The first probe runs at startup, so the TLS handshake is done before
+the first learner turn, and the keep-alive outlives the probe interval so the
+connection stays open while the worker is idle.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from backend.services import cassette, providers
+from backend.services.cancellation import REQUEST_DEADLINE_SECONDS
+
+load_dotenv()
+
+AGENT_REGISTRY_SOURCE = os.getenv("AGENT_REGISTRY_SOURCE", "builtin").lower()
+AGENT_REGISTRY_FILE = os.getenv("AGENT_REGISTRY_FILE", "agents.json")
+AGENT_REGISTRY_RELOAD_SECONDS = float(os.getenv("AGENT_REGISTRY_RELOAD_SECONDS", "30"))
+AGENT_PROBE_SECONDS = float(os.getenv("AGENT_PROBE_SECONDS", "60"))
+AGENT_PROBE_TIMEOUT_SECONDS = float(os.getenv("AGENT_PROBE_TIMEOUT_SECONDS", "5"))
+AGENT_POOL_MAX_CONNECTIONS = int(os.getenv("AGENT_POOL_MAX_CONNECTIONS", "20"))
+# longer than the probe interval, so probes keep the pooled connection open
+AGENT_KEEPALIVE_SECONDS = float(os.getenv("AGENT_KEEPALIVE_SECONDS", str(AGENT_PROBE_SECONDS * 2)))
+# endpoints (besides the built-in ones) that agents from Mongo may send their key to
+AGENT_TRUSTED_ENDPOINTS = [e.strip().rstrip("/") for e in os.getenv("AGENT_TRUSTED_ENDPOINTS", "").split(",") if e.strip()]
+
+SOURCES = ("builtin", "file", "mongo")
+
+# Map agent names to their DigitalOcean Agent base URLs
+DEFAULT_ENDPOINTS = {
+    "TAXI": "https://t2jd4cy2mk3iestb55rui63l.agents.do-ai.run",
+    "BARISTA": "https://tteuzngpk2lgt6kwe3dk7t5o.agents.do-ai.run",
+    "COLLEGE": "https://xgohdlht5wrandiyv34br32g.agents.do-ai.run",
+    "FAMILY": "https://ua5um6lyt32erqe3dgifxgcq.agents.do-ai.run",
+    "VENDOR": "https://omiuisweqow65d3lzlpsfmba.agents.do-ai.run",
+    "FIESTA": "https://kmlrxute55zz2odzhqrkoeey.agents.do-ai.run",
+    "CAFE": "https://ghki5u64nz4yyiwt4sydrzcb.agents.do-ai.run",
+    "DINNER": "https://eqqycnzxgun67e3cbvvjx3ve.agents.do-ai.run",
+    "WAITER": "https://snef3uch436uamykmgemq54z.agents.do-ai.run",
+    "BEER": "https://sxuzvn27qabb527mnem5ge4i.agents.do-ai.run",
+    "BAKERY": "https://ffk4fpxvhrfqcrpfwwjxzjnn.agents.do-ai.run",
+    "TEA": "https://asxrjdg56qys7xaylsd4ihft.agents.do-ai.run",
+    "OFFICE": "https://nygdebemztf3ozd5mhvsnyfz.agents.do-ai.run",
+    "SAMBA": "https://ntu656jkrtfl42umuhdd4spi.agents.do-ai.run",
+    "BEACH": "https://hkwukoh6cmnk64b4ex7v5drp.agents.do-ai.run",
+}
+
+
+class AgentSpec(NamedTuple):
+    name: str
+    endpoint: str
+    key_env: str
+    enabled: bool = True
+    # the endpoint comes from operator config, so it may receive the key
+    trusted: bool = True
+
+
+def trusted_endpoints() -> set:
+    return {url.rstrip("/") for url in DEFAULT_ENDPOINTS.values()} | set(AGENT_TRUSTED_ENDPOINTS)
+
+
+def parse_specs(items, trusted: Optional[set] = None) -> dict:
+    """Validate agent definitions (dicts) into ``{name: AgentSpec}``; raises ``ValueError``.
+
+    With ``trusted``, only agents whose endpoint is in it are marked trusted.
+    """
+    specs = {}
+    for item in items:
+        name = item.get("name") or item.get("_id")
+        endpoint = (item.get("endpoint") or "").rstrip("/")
+        if not name or not isinstance(name, str):
+            raise ValueError(f"Agent definition without a name: {item!r}")
+        if not endpoint.startswith(("https://", "http://")):
+            raise ValueError(f"Agent {name} has no valid endpoint URL")
+        if name in specs:
+            raise ValueError(f"Agent {name} is defined twice")
+        specs[name] = AgentSpec(
+            name, endpoint, item.get("key_env") or f"{name}_PRIVATE_KEY", bool(item.get("enabled", True)),
+            trusted is None or endpoint in trusted,
+        )
+    return specs
+
+
+def _builtin_specs() -> dict:
+    return parse_specs({"name": name, "endpoint": url} for name, url in DEFAULT_ENDPOINTS.items())
+
+
+def _file_specs(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    return parse_specs(data["agents"] if isinstance(data, dict) else data)
+
+
+def _key(spec: AgentSpec) -> Optional[str]:
+    return cassette.credential(spec.key_env) if spec.trusted else None
+
+
+class _Agent:
+    def __init__(self, spec: AgentSpec):
+        self.spec = spec
+        self.key = _key(spec)
+        if not spec.trusted:
+            self.credential_error = f"Endpoint of agent {spec.name} is not trusted (AGENT_TRUSTED_ENDPOINTS); its key is not sent"
+        elif not self.key:
+            self.credential_error = f"Access key for agent {spec.name} not configured in environment"
+        else:
+            self.credential_error = None
+        self.http = None
+        self.client = None
+        self.health: dict = {"healthy": None}
+
+    @property
+    def base_url(self) -> str:
+        return self.spec.endpoint + "/api/v1/"
+
+    def connect(self):
+        """Create the pooled client on first use."""
+        if self.client is None:
+            openai = providers.openai()
+            http_client_cls = getattr(openai, "DefaultAsyncHttpxClient", None)
+            kwargs = {}
+            if http_client_cls is not None:
+                httpx = providers.load("httpx")
+                self.http = http_client_cls(
+                    limits=httpx.Limits(
+                        max_connections=AGENT_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=AGENT_POOL_MAX_CONNECTIONS,
+                        keepalive_expiry=AGENT_KEEPALIVE_SECONDS,
+                    ),
+                )
+                kwargs["http_client"] = self.http
+            self.client = openai.AsyncOpenAI(base_url=self.base_url, api_key=self.key, **kwargs)
+        return self.client
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+
+
+class AgentRegistry:
+    def __init__(self, source: str = AGENT_REGISTRY_SOURCE, path: str = AGENT_REGISTRY_FILE):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown agent registry source: {source}")
+        self.source = source
+        self.path = path
+        self._agents: Optional[dict] = None
+        self._mtime: Optional[float] = None
+        self.loaded_at: Optional[datetime] = None
+        self._db = None
+        self._tasks: list = []
+
+    # ---- lookups
+
+    def _current(self) -> dict:
+        if self._agents is None:
+            if self.source == "mongo":
+                # only reachable outside the server (CLI tools), where startup never ran
+                logging.warning("Agent registry not loaded from Mongo yet; using built-in agents")
+                self._apply(_builtin_specs())
+            else:
+                self._apply(self._read_specs())
+        return self._agents
+
+    def specs(self) -> list:
+        """Agent definitions, without resolving credentials if nothing is loaded yet."""
+        if self._agents is not None:
+            return [agent.spec for agent in self._agents.values()]
+        specs = _builtin_specs() if self.source == "mongo" else self._read_specs()
+        return list(specs.values())
+
+    def names(self) -> list:
+        return [name for name, agent in self._current().items() if agent.spec.enabled]
+
+    def __contains__(self, name: str) -> bool:
+        agent = self._current().get(name)
+        return agent is not None and agent.spec.enabled
+
+    def client(self, name: str):
+        """The pooled OpenAI-compatible client for ``name``; raises ``RuntimeError``."""
+        agent = self._current().get(name)
+        if agent is None or not agent.spec.enabled:
+            raise RuntimeError(f"Unknown agent: {name}")
+        if agent.credential_error:
+            raise RuntimeError(agent.credential_error)
+        return agent.connect()
+
+    # ---- loading
+
+    def _read_specs(self) -> dict:
+        if self.source == "file":
+            self._mtime = os.stat(self.path).st_mtime
+            return _file_specs(self.path)
+        return _builtin_specs()
+
+    async def _load_specs(self) -> dict:
+        if self.source == "mongo":
+            if self._db is None:
+                raise RuntimeError("Agent registry source is mongo but no database is attached")
+            return parse_specs(await self._db.agents.find({}).to_list(length=None), trusted_endpoints())
+        return await asyncio.to_thread(self._read_specs)
+
+    def _apply(self, specs: dict) -> dict:
+        previous = self._agents or {}
+        agents, retired = {}, []
+        changes = {"added": [], "removed": [], "changed": []}
+        for name, spec in specs.items():
+            old = previous.get(name)
+            # keep the pooled client (and health) while the endpoint and key are unchanged
+            if old is not None and old.spec.endpoint == spec.endpoint and old.spec.trusted == spec.trusted and old.key == _key(spec):
+                old.spec = spec
+                agents[name] = old
+                continue
+            agents[name] = _Agent(spec)
+            if old is None:
+                changes["added"].append(name)
+            else:
+                changes["changed"].append(name)
+                retired.append(old)
+        for name, old in previous.items():
+            if name not in specs:
+                changes["removed"].append(name)
+                retired.append(old)
+        self._agents = agents
+        self.loaded_at = datetime.utcnow()
+        for agent in agents.values():
+            if agent.credential_error and agent.spec.enabled:
+                logging.warning(agent.credential_error)
+        if retired:
+            self._retire(retired)
+        return changes
+
+    def _retire(self, agents: list):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        async def close_later():
+            await asyncio.sleep(REQUEST_DEADLINE_SECONDS)
+            for agent in agents:
+                await agent.close()
+
+        loop.create_task(close_later())
+
+    async def reload(self) -> dict:
+        """Re-read the source and swap in the result; on error the current agents stay."""
+        changes = self._apply(await self._load_specs())
+        if any(changes.values()):
+            logging.info("Agent registry reloaded", extra={"payload": changes})
+            # open pooled connections for new clients right away
+            await self.probe_all(changes["added"] + changes["changed"])
+        return changes
+
+    def invalidate(self):
+        """Forget loaded agents so the next lookup re-reads the source (and credentials)."""
+        self._agents = None
+
+    # ---- health
+
+    async def probe(self, name: str) -> dict:
+        agent = self._current()[name]
+        if agent.credential_error:
+            agent.health = {"healthy": False, "error": agent.credential_error, "checked_at": datetime.utcnow()}
+            return agent.health
+        agent.connect()
+        if agent.http is None or cassette.REPLAYING:
+            # stand-in providers or replayed calls: nothing to reach
+            return agent.health
+        failures = agent.health.get("consecutive_failures", 0)
+        start = time.perf_counter()
+        try:
+            response = await agent.http.get(
+                agent.spec.endpoint,
+                headers={"Authorization": f"Bearer {agent.key}"},
+                timeout=AGENT_PROBE_TIMEOUT_SECONDS,
+            )
+            status, error = response.status_code, None
+            if status in (401, 403):
+                error = "credentials rejected"
+            elif status >= 500:
+                error = f"upstream status {status}"
+        except Exception as e:
+            status, error = None, f"{type(e).__name__}: {e}"
+        agent.health = {
+            "healthy": error is None,
+            "status": status,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "error": error,
+            "checked_at": datetime.utcnow(),
+            "consecutive_failures": 0 if error is None else failures + 1,
+        }
+        return agent.health
+
+    async def probe_all(self, names: Optional[list] = None):
+        names = self.names() if names is None else [n for n in names if n in self]
+        results = await asyncio.gather(*(self.probe(name) for name in names), return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logging.warning("Probe for agent %s failed: %s", name, result)
+
+    def status(self) -> list:
+        return [
+            {
+                "agent": name,
+                "endpoint": agent.spec.endpoint,
+                "enabled": agent.spec.enabled,
+                "credentials": agent.credential_error is None,
+                "health": agent.health,
+            }
+            for name, agent in self._current().items()
+        ]
+
+    # ---- background work
+
+    def start(self, db=None):
+        self._db = db
+        if self.source != "mongo":
+            # a broken file fails startup instead of serving without agents
+            self._current()
+        self._tasks = [asyncio.get_running_loop().create_task(self._run())]
+
+    async def _run(self):
+        if self.source == "mongo":
+            try:
+                self._apply(await self._load_specs())
+            except Exception:
+                logging.exception("Loading agents from Mongo failed; using built-in agents")
+        self._tasks.append(asyncio.get_running_loop().create_task(self._probe_loop()))
+        while True:
+            await asyncio.sleep(AGENT_REGISTRY_RELOAD_SECONDS)
+            if self.source == "mongo" or self._agents is None or self._file_changed():
+                try:
+                    await self.reload()
+                except Exception:
+                    logging.exception("Agent registry reload failed; keeping current agents")
+
+    def _file_changed(self) -> bool:
+        try:
+            return self.source == "file" and os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            return False
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception:
+                logging.exception("Agent probes failed")
+            await asyncio.sleep(AGENT_PROBE_SECONDS)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for agent in (self._agents or {}).values():
+            await agent.close()
+        self._agents = None
+
+
+# Module-level singleton; lookups work before start(), background work needs it
+registry = AgentRegistry()
+
+
+def start_agent_registry(db) -> AgentRegistry:
+    registry.start(db)
+    return registry
+
+
+async def stop_agent_registry():
+    await registry.close()
@@ -0,0 +1,85 @@
+"""TTS output formats and their negotiation.
+
+Clients pick a format with the ``format`` query parameter or the ``Accept``
+header; otherwise the conversation's voice profile decides, then the agent's
+default (``TTS_AGENT_FORMATS``, e.g. ``"TAXI=mp3_low,BEACH=opus"``) and
+finally ``TTS_DEFAULT_FORMAT``.
+"""
+import os
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class AudioFormat(NamedTuple):
+    provider_format: str  # ElevenLabs ``output_format``
+    media_type: str
+    suffix: str
+
+
+AUDIO_FORMATS = {
+    "mp3": AudioFormat("mp3_44100_128", "audio/mpeg", ".mp3"),
+    "mp3_low": AudioFormat("mp3_22050_32", "audio/mpeg", ".mp3"),
+    "opus": AudioFormat("opus_48000_32", "audio/ogg", ".ogg"),
+    # raw 16-bit mono samples, for the waveform visualizer
+    "pcm": AudioFormat("pcm_16000", "audio/L16;rate=16000;channels=1", ".pcm"),
+}
+
+# Low-latency substitutes used while upstream is degraded
+FAST_FORMATS = {"mp3": "mp3_low", "opus": "opus"}
+
+_ACCEPT_TYPES = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/l16": "pcm",
+    "audio/pcm": "pcm",
+}
+
+TTS_DEFAULT_FORMAT = os.getenv("TTS_DEFAULT_FORMAT", "mp3")
+TTS_AGENT_FORMATS = dict(
+    item.split("=", 1) for item in os.getenv("TTS_AGENT_FORMATS", "").split(",") if "=" in item
+)
+
+
+def _from_accept(accept: str) -> Optional[str]:
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        quality = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    quality = float(field[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type in _ACCEPT_TYPES and quality > 0:
+            candidates.append((-quality, position, _ACCEPT_TYPES[media_type]))
+    return min(candidates)[2] if candidates else None
+
+
+def negotiate_format(
+    requested: Optional[str],
+    accept: Optional[str],
+    default: Optional[str] = None,
+) -> str:
+    """Return a key of ``AUDIO_FORMATS``; raises ``ValueError`` for unknown names.
+
+    ``default`` (a voice profile's format, which already reflects
+    ``TTS_AGENT_FORMATS``) applies when the client expressed no preference.
+    """
+    if requested:
+        if requested not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio format: {requested}")
+        return requested
+    if accept:
+        negotiated = _from_accept(accept)
+        if negotiated:
+            return negotiated
+    if default in AUDIO_FORMATS:
+        return default
+    return TTS_DEFAULT_FORMAT if TTS_DEFAULT_FORMAT in AUDIO_FORMATS else "mp3"
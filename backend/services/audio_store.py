@@ -0,0 +1,237 @@
+"""Synthesized turn audio kept in GridFS.
+
+TTS output for an assistant message is written to the ``audio`` GridFS bucket
+while it streams to the client (``tee``), then linked from the message as
+``audio: {file_id, format, media_type, length, etag}``. Replays are served from
+GridFS by ``GET /conversations/{id}/messages/{seq}/audio`` instead of calling
+ElevenLabs again.
+
+The ETag is a digest of the audio computed during the upload, so it is strong
+and stable; stored clips never change. Reads go through ``read_range``, which
+streams one GridFS chunk at a time.
+
+Retention: each owner (the conversation's user, else the conversation itself)
+keeps at most ``AUDIO_RETENTION_BYTES_PER_USER`` of audio. Every upload
+queues an ``audio_retention`` job (one pending per owner) that deletes and
+unlinks the owner's oldest clips until the total fits again.
+"""
+import os
+import hashlib
+import logging
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from backend.services import jobs
+from backend.services.audio_formats import AUDIO_FORMATS
+
+load_dotenv()
+
+AUDIO_STORE_ENABLED = os.getenv("AUDIO_STORE_ENABLED", "true").lower() == "true"
+AUDIO_BUCKET = os.getenv("AUDIO_BUCKET", "audio")
+AUDIO_RETENTION_BYTES_PER_USER = int(os.getenv("AUDIO_RETENTION_BYTES_PER_USER", str(50 * 1024 * 1024)))
+AUDIO_READ_CHUNK_BYTES = int(os.getenv("AUDIO_READ_CHUNK_BYTES", str(255 * 1024)))
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """``(start, end)`` (inclusive) for a single ``bytes=`` range, ``None`` for the whole file.
+
+    Multi-range requests are answered with the whole file. Raises
+    ``RangeNotSatisfiable`` when the range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # suffix range: the last N bytes
+            length = int(last)
+            start, end = max(size - length, 0), size - 1
+        else:
+            length = None
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if length == 0 or start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def _owner(conversation_id: str, user_id) -> str:
+    return f"user:{user_id}" if user_id is not None else f"conversation:{conversation_id}"
+
+
+class AudioStore:
+    def __init__(self, db, bucket_name: str = AUDIO_BUCKET, retention_bytes: int = AUDIO_RETENTION_BYTES_PER_USER):
+        self._db = db
+        self._bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        self._files = db[f"{bucket_name}.files"]
+        self.retention_bytes = retention_bytes
+        self._indexed = False
+
+    async def tee(
+        self,
+        chunks: AsyncIterator[bytes],
+        *,
+        conversation_id: str,
+        audio_format: str,
+        seq: Optional[int] = None,
+        text: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """Yield ``chunks`` unchanged while writing them to GridFS.
+
+        Once the stream completes the clip is linked to message ``seq`` (or to
+        the latest assistant message whose content is ``text``). An incomplete
+        stream or a message that cannot be found leaves nothing behind.
+        """
+        upload = self._bucket.open_upload_stream(
+            f"{conversation_id}-{seq if seq is not None else 'latest'}{AUDIO_FORMATS[audio_format].suffix}",
+            metadata={"conversation_id": conversation_id, "format": audio_format},
+        )
+        digest = hashlib.sha256()
+        complete = False
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                await upload.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if complete:
+                try:
+                    await upload.close()
+                    await self._link(upload._id, conversation_id, audio_format, digest.hexdigest(), seq, text)
+                except Exception:
+                    logging.exception("Storing audio for conversation %s failed", conversation_id)
+            else:
+                await upload.abort()
+
+    async def save(self, audio: bytes, *, conversation_id: str, audio_format: str, seq: Optional[int] = None, text: Optional[str] = None):
+        """Store an already synthesized clip (e.g. a prepared farewell)."""
+        async def once():
+            yield audio
+
+        async for _ in self.tee(once(), conversation_id=conversation_id, audio_format=audio_format, seq=seq, text=text):
+            pass
+
+    async def _resolve_seq(self, conversation_id: str, text: Optional[str]) -> Optional[int]:
+        doc = await self._db.conversations.find_one(
+            {"_id": ObjectId(conversation_id)}, {"messages": {"$slice": -10}}
+        )
+        for message in reversed((doc or {}).get("messages", [])):
+            if message.get("role") == "assistant" and message.get("content") == text and message.get("seq") is not None:
+                return message["seq"]
+        return None
+
+    async def _link(self, file_id, conversation_id: str, audio_format: str, sha256: str, seq: Optional[int], text: Optional[str]):
+        if seq is None:
+            seq = await self._resolve_seq(conversation_id, text)
+        oid = ObjectId(conversation_id)
+        stored = await self._files.find_one({"_id": file_id}, {"length": 1})
+        link = {
+            "file_id": file_id,
+            "format": audio_format,
+            "media_type": AUDIO_FORMATS[audio_format].media_type,
+            "length": stored["length"],
+            "etag": sha256[:32],
+        }
+        result = None
+        if seq is not None:
+            result = await self._db.conversations.find_one_and_update(
+                {"_id": oid, "messages.seq": seq},
+                {"$set": {"messages.$.audio": link}},
+                projection={"user_id": 1, "messages": {"$elemMatch": {"seq": seq}}},
+            )
+        if result is None:
+            # nothing to attach it to (message trimmed, conversation gone)
+            await self._bucket.delete(file_id)
+            return
+        previous = (result.get("messages") or [{}])[0].get("audio")
+        if previous and previous.get("file_id") != file_id:
+            await self._delete(previous["file_id"])
+        owner = _owner(conversation_id, result.get("user_id"))
+        await self._files.update_one(
+            {"_id": file_id},
+            {"$set": {"metadata.owner": owner, "metadata.seq": seq, "metadata.sha256": sha256}},
+        )
+        await jobs.enqueue("audio_retention", {"owner": owner}, dedup_key=owner)
+
+    async def _delete(self, file_id):
+        try:
+            await self._bucket.delete(file_id)
+        except Exception:
+            # already gone (e.g. removed by a concurrent sweep)
+            pass
+
+    async def enforce_retention(self, owner: str) -> int:
+        """Delete ``owner``'s oldest clips until their total fits the cap; returns bytes freed."""
+        if not self._indexed:
+            await self._files.create_index([("metadata.owner", 1), ("uploadDate", -1)])
+            self._indexed = True
+        cursor = self._files.find(
+            {"metadata.owner": owner},
+            {"length": 1, "metadata.conversation_id": 1},
+        ).sort("uploadDate", -1)
+        total, freed = 0, 0
+        async for f in cursor:
+            total += f["length"]
+            if total <= self.retention_bytes:
+                continue
+            await self._delete(f["_id"])
+            await self._db.conversations.update_one(
+                {"_id": ObjectId(f["metadata"]["conversation_id"]), "messages.audio.file_id": f["_id"]},
+                {"$unset": {"messages.$.audio": ""}},
+            )
+            freed += f["length"]
+        return freed
+
+    async def open(self, link: dict):
+        """Open a linked clip for reading; raises ``gridfs.errors.NoFile`` if it was deleted."""
+        return await self._bucket.open_download_stream(link["file_id"])
+
+    async def read_range(self, grid_out, start: int, end: int) -> AsyncIterator[bytes]:
+        """Stream bytes ``start..end`` (inclusive), one read at a time."""
+        grid_out.seek(start)
+        left = end - start + 1
+        while left > 0:
+            data = await grid_out.read(min(left, AUDIO_READ_CHUNK_BYTES))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+
+
+# Module-level singleton, created by init_db
+_store: Optional[AudioStore] = None
+
+
+def start_audio_store(db) -> Optional[AudioStore]:
+    global _store
+    if AUDIO_STORE_ENABLED and _store is None:
+        _store = AudioStore(db)
+    return _store
+
+
+def get_audio_store() -> Optional[AudioStore]:
+    return _store
+
+
+def stop_audio_store():
+    global _store
+    _store = None
+
+
+async def _enforce_retention(payload: dict, db):
+    """``audio_retention`` job, queued after each upload."""
+    if _store is not None:
+        await _store.enforce_retention(payload["owner"])
+
+
+jobs.register("audio_retention", _enforce_retention, concurrency=2)
@@ -0,0 +1,87 @@
+"""Request deadlines and client-disconnect cancellation.
+
+``run_request`` runs a route's work in its own task, polls the client
+connection while it runs, and cancels the task if the client goes away or the
+request deadline passes. Provider calls read the remaining budget with
+``remaining()`` and pass it on as their HTTP timeout, so an abandoned turn
+stops consuming upstream concurrency instead of running to completion.
+"""
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+load_dotenv()
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
+
+# Absolute time.monotonic() deadline for the current request, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """The request ran past its deadline."""
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current request's deadline.
+
+    Returns ``default`` outside a request with a deadline, and raises
+    ``DeadlineExceededError`` once the deadline has passed.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceededError("Request deadline exceeded")
+    return left if default is None else min(left, default)
+
+
+async def run_request(
+    request: Request,
+    fn: Callable[[], Awaitable],
+    *,
+    deadline: float = REQUEST_DEADLINE_SECONDS,
+):
+    """Await ``fn()``, cancelling it on client disconnect or deadline.
+
+    Raises ``HTTPException`` 499 when the client went away (the response is
+    never read) and 504 when the deadline passed.
+    """
+    token = _deadline.set(time.monotonic() + deadline)
+    try:
+        # the task copies the current context, deadline included
+        task = asyncio.ensure_future(fn())
+    finally:
+        _deadline.reset(token)
+
+    expires_at = time.monotonic() + deadline
+    try:
+        while True:
+            left = expires_at - time.monotonic()
+            if left <= 0:
+                await _cancel(task)
+                raise HTTPException(status_code=504, detail="Request deadline exceeded")
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, left))
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                await _cancel(task)
+                raise HTTPException(status_code=499, detail="Client closed request")
+    except asyncio.CancelledError:
+        await _cancel(task)
+        raise
+
+
+async def _cancel(task: asyncio.Task):
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
@@ -0,0 +1,286 @@
+"""Record-and-replay of provider calls for deterministic offline runs.
+
+``PROVIDER_CASSETTE_MODE`` selects the mode:
+    off     calls go to the providers (default)
+    record  calls go to the providers and every response is appended to the
+            cassette together with its latency (per chunk for streams)
+    replay  nothing leaves the process; responses come from the cassette,
+            delayed by the recorded latency divided by ``PROVIDER_REPLAY_SPEED``
+            (1 keeps the original timing, 0 answers immediately)
+
+A cassette (``PROVIDER_CASSETTE``) is a gzip'd JSON-lines file with one record
+per call, keyed by a fingerprint of the request: model, messages or prompt,
+voice and format, or a digest of the uploaded audio. Credentials and timeouts
+are never part of the fingerprint. A request recorded several times is
+replayed in recorded order; a request that was never recorded raises
+``CassetteMissError``.
+
+Covered calls: DigitalOcean chat completions, Gemini ``generate_content``,
+ElevenLabs STT and TTS (buffered and streamed).
+"""
+import os
+import json
+import time
+import gzip
+import base64
+import asyncio
+import hashlib
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CASSETTE_MODE = os.getenv("PROVIDER_CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("PROVIDER_CASSETTE", "cassettes/providers.jsonl.gz")
+REPLAY_SPEED = float(os.getenv("PROVIDER_REPLAY_SPEED", "1"))
+
+RECORDING = CASSETTE_MODE == "record"
+REPLAYING = CASSETTE_MODE == "replay"
+
+# never part of a fingerprint: they do not change what the provider answers
+_VOLATILE_KEYS = ("timeout", "request_options")
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+def credential(name: str) -> Optional[str]:
+    """``os.getenv(name)``, with a placeholder while replaying so no real keys are needed."""
+    value = os.getenv(name)
+    if not value and REPLAYING:
+        return "replay"
+    return value
+
+
+def fingerprint(kind: str, request: dict) -> str:
+    canonical = json.dumps(
+        {k: v for k, v in request.items() if k not in _VOLATILE_KEYS},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(f"{kind}\n{canonical}".encode("utf-8")).hexdigest()[:32]
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[dict] = None
+        self._cursors: dict = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    entries: dict = {}
+                    if os.path.exists(self.path):
+                        # concatenated gzip members read back as one stream
+                        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                            for line in f:
+                                if line.strip():
+                                    record = json.loads(line)
+                                    entries.setdefault((record["kind"], record["fp"]), []).append(record)
+                    self._entries = entries
+        return self._entries
+
+    def next(self, kind: str, fp: str) -> dict:
+        records = self._load().get((kind, fp))
+        if not records:
+            raise CassetteMissError(f"No recorded {kind} call with fingerprint {fp} in {self.path}")
+        with self._lock:
+            i = self._cursors.get((kind, fp), 0)
+            self._cursors[(kind, fp)] = i + 1
+        # past the end, keep answering with the last recording
+        return records[min(i, len(records) - 1)]
+
+    def append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # one gzip member per record keeps appends cheap and crash-safe
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            if self._entries is not None:
+                self._entries.setdefault((record["kind"], record["fp"]), []).append(record)
+
+
+_cassette = Cassette(CASSETTE_PATH)
+
+
+def _delay(seconds: float) -> float:
+    return seconds / REPLAY_SPEED if REPLAY_SPEED > 0 else 0.0
+
+
+# ---- codecs: (dump live response -> JSON, load JSON -> response-like object)
+
+class _Namespace:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _dump_chat(response) -> dict:
+    choice = response.choices[0]
+    usage = getattr(response, "usage", None)
+    return {
+        "content": choice.message.content,
+        "finish_reason": getattr(choice, "finish_reason", None),
+        "usage": [usage.prompt_tokens, usage.completion_tokens] if usage is not None else None,
+    }
+
+
+def _load_chat(data: dict):
+    message = _Namespace(role="assistant", content=data["content"])
+    usage = None
+    if data.get("usage"):
+        usage = _Namespace(prompt_tokens=data["usage"][0], completion_tokens=data["usage"][1])
+    return _Namespace(choices=[_Namespace(message=message, finish_reason=data.get("finish_reason"))], usage=usage)
+
+
+class _ReplayedGeminiResponse:
+    def __init__(self, text: Optional[str], error: Optional[str] = None, usage: Optional[list] = None):
+        self._text = text
+        self._error = error
+        self.usage_metadata = None
+        if usage:
+            self.usage_metadata = _Namespace(prompt_token_count=usage[0], candidates_token_count=usage[1])
+
+    @property
+    def text(self) -> str:
+        # mirrors the SDK raising when a response carries no text (e.g. blocked)
+        if self._text is None:
+            raise ValueError(self._error or "Recorded response has no text")
+        return self._text
+
+
+def _dump_gemini(response) -> dict:
+    metadata = getattr(response, "usage_metadata", None)
+    usage = [metadata.prompt_token_count, metadata.candidates_token_count] if metadata is not None else None
+    try:
+        return {"text": response.text, "usage": usage}
+    except ValueError as e:
+        return {"text": None, "error": str(e), "usage": usage}
+
+
+def _load_gemini(data: dict):
+    return _ReplayedGeminiResponse(data["text"], data.get("error"), data.get("usage"))
+
+
+class _ReplayedHTTPResponse:
+    """Enough of ``requests.Response`` for the sync ElevenLabs calls."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _dump_http(response) -> dict:
+    return {"status": response.status_code, "body": base64.b64encode(response.content).decode("ascii")}
+
+
+def _load_http(data: dict):
+    return _ReplayedHTTPResponse(data["status"], base64.b64decode(data["body"]))
+
+
+CHAT = (_dump_chat, _load_chat)
+GEMINI = (_dump_gemini, _load_gemini)
+HTTP = (_dump_http, _load_http)
+BYTES = (lambda b: base64.b64encode(b).decode("ascii"), base64.b64decode)
+JSON = (lambda v: v, lambda v: v)
+
+
+# ---- recording / replaying wrappers
+
+async def call(kind: str, request, fn, codec=JSON):
+    """Await ``fn()`` through the cassette. ``request`` may be a callable, so
+    costly fingerprints (audio digests) are only computed when recording or
+    replaying."""
+    if not (RECORDING or REPLAYING):
+        return await fn()
+    dump, load = codec
+    fp = fingerprint(kind, request() if callable(request) else request)
+    if REPLAYING:
+        record = _cassette.next(kind, fp)
+        await asyncio.sleep(_delay(record["latency"]))
+        return load(record["response"])
+    start = time.perf_counter()
+    result = await fn()
+    _cassette.append({"kind": kind, "fp": fp, "latency": round(time.perf_counter() - start, 4), "response": dump(result)})
+    return result
+
+
+def call_sync(kind: str, request, fn, codec=JSON):
+    """Blocking counterpart of ``call`` for the synchronous SDK paths."""
+    if not (RECORDING or REPLAYING):
+        return fn()
+    dump, load = codec
+    fp = fingerprint(kind, request() if callable(request) else request)
+    if REPLAYING:
+        record = _cassette.next(kind, fp)
+        time.sleep(_delay(record["latency"]))
+        return load(record["response"])
+    start = time.perf_counter()
+    result = fn()
+    _cassette.append({"kind": kind, "fp": fp, "latency": round(time.perf_counter() - start, 4), "response": dump(result)})
+    return result
+
+
+async def stream(kind: str, request, fn):
+    """Iterate the byte chunks of ``fn()`` through the cassette, keeping each
+    chunk's offset from the start of the call."""
+    if not (RECORDING or REPLAYING):
+        async for chunk in fn():
+            yield chunk
+        return
+    fp = fingerprint(kind, request() if callable(request) else request)
+    start = time.perf_counter()
+    if REPLAYING:
+        record = _cassette.next(kind, fp)
+        for offset, data in record["chunks"]:
+            wait = _delay(offset) - (time.perf_counter() - start)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield base64.b64decode(data)
+        return
+    chunks = []
+    async for chunk in fn():
+        chunks.append([round(time.perf_counter() - start, 4), base64.b64encode(chunk).decode("ascii")])
+        yield chunk
+    # only complete streams are worth replaying
+    _cassette.append({"kind": kind, "fp": fp, "latency": chunks[-1][0] if chunks else 0.0, "chunks": chunks})
+
+
+async def chat_completion(client, **kwargs):
+    """``client.chat.completions.create(**kwargs)`` through the cassette."""
+    request = {"base_url": str(client.base_url), **kwargs}
+    return await call("chat", request, lambda: client.chat.completions.create(**kwargs), CHAT)
+
+
+async def gemini_generate(model, contents, **kwargs):
+    """``model.generate_content_async(contents, **kwargs)`` through the cassette."""
+    request = {"model": model.model_name, "contents": contents, **kwargs}
+    return await call("gemini", request, lambda: model.generate_content_async(contents, **kwargs), GEMINI)
+
+
+def gemini_generate_sync(model, contents, **kwargs):
+    """``model.generate_content(contents, **kwargs)`` through the cassette."""
+    request = {"model": model.model_name, "contents": contents, **kwargs}
+    return call_sync("gemini", request, lambda: model.generate_content(contents, **kwargs), GEMINI)
@@ -0,0 +1,81 @@
+"""Per-conversation concurrency control.
+
+Turns for the same conversation are serialized in process with an asyncio
+lock, while different conversations run fully in parallel. Across workers the
+conversation's ``seq`` field acts as an optimistic version: appends are
+conditional on the sequence number the writer last saw, and a mismatch raises
+``ConversationConflictError`` instead of interleaving histories.
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seconds a turn waits for another turn on the same conversation; 0 rejects immediately
+CONVERSATION_LOCK_TIMEOUT = float(os.getenv("CONVERSATION_LOCK_TIMEOUT", "30"))
+
+
+class ConversationConflictError(RuntimeError):
+    """The conversation changed underneath a conditional append."""
+
+
+class ConversationBusyError(ConversationConflictError):
+    """Another turn for the conversation is still running in this worker."""
+
+
+# conversation_id -> [lock, holders + waiters]; entries are dropped when unused
+_locks: dict = {}
+
+
+def seq_filter(seq: int):
+    """Match a conversation whose ``seq`` equals ``seq`` (missing counts as 0)."""
+    return {"$in": [0, None]} if seq == 0 else seq
+
+
+async def acquire_within(lock, timeout: float) -> bool:
+    """Acquire ``lock`` (a lock or semaphore) within ``timeout`` seconds; False if it stayed busy.
+
+    ``wait_for(lock.acquire())`` can take the lock and still time out (before
+    Python 3.12), leaving it held forever. The acquire runs as its own task
+    instead, and is released if it completed just as the wait gave up.
+    """
+    acquire = asyncio.ensure_future(lock.acquire())
+    try:
+        await asyncio.wait_for(asyncio.shield(acquire), timeout=timeout)
+    except BaseException as exc:
+        # timed out or cancelled: stop a pending acquire, undo a finished one
+        if not acquire.cancel() and not acquire.cancelled() and acquire.exception() is None:
+            lock.release()
+        if isinstance(exc, asyncio.TimeoutError):
+            return False
+        raise
+    return True
+
+
+@asynccontextmanager
+async def conversation_lock(conversation_id: str, timeout: Optional[float] = None):
+    timeout = CONVERSATION_LOCK_TIMEOUT if timeout is None else timeout
+    entry = _locks.get(conversation_id)
+    if entry is None:
+        entry = _locks[conversation_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        lock = entry[0]
+        if timeout <= 0:
+            if lock.locked():
+                raise ConversationBusyError(f"Conversation {conversation_id} already has a turn in progress")
+            await lock.acquire()
+        elif not await acquire_within(lock, timeout):
+            raise ConversationBusyError(f"Timed out waiting for conversation {conversation_id}")
+        try:
+            yield
+        finally:
+            lock.release()
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _locks.pop(conversation_id, None)
@@ -0,0 +1,20 @@
+"""Service configuration snapshot, computed once per process."""
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_service_config() -> dict:
+    """Same shape as ``VoiceRoleplayService.get_config`` without building the service."""
+    elevenlabs_key = os.getenv("ELEVENLABS_API_KEY", "")
+    text_only_mode = os.getenv("TEXT_ONLY_MODE", "true").lower() == "true"
+    return {
+        "text_only_mode": text_only_mode,
+        "audio_enabled": bool(not text_only_mode and elevenlabs_key),
+        "elevenlabs_configured": bool(elevenlabs_key),
+        "gemini_configured": bool(os.getenv("GEMINI_API_KEY", "")),
+    }
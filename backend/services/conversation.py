@@ -1,93 +1,139 @@
 import os
+import time
 import asyncio
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Optional
 
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
-from openai import OpenAI
-import google.generativeai as genai
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 
-import aiohttp
 import tempfile
 
-load_dotenv()
+from backend.services.write_behind import get_write_queue
+from backend.services.concurrency import ConversationConflictError, conversation_lock, seq_filter
+from backend.services.cancellation import REQUEST_DEADLINE_SECONDS, remaining
+from backend.services.audio_formats import AUDIO_FORMATS, FAST_FORMATS
+from backend.services import cassette, jobs, providers
+from backend.services.goal_batcher import GOAL_BATCHING_ENABLED, get_goal_batcher
+from backend.services.degradation import FAST_TTS, degradation, timed_stage
+from backend.services.usage import record_usage, token_usage
+from backend.services.agent_registry import registry
+from backend.services.voice_profiles import VoiceProfile, conversation_profiles, resolve_profile
+from backend.services.events import hub
+from backend.services.templates import templates
+
+if TYPE_CHECKING:
+	from openai import AsyncOpenAI
 
-# Map agent names to their DigitalOcean Agent base URLs
-endpoints = {
-	"TAXI": "https://t2jd4cy2mk3iestb55rui63l.agents.do-ai.run",
-	"BARISTA" : "https://tteuzngpk2lgt6kwe3dk7t5o.agents.do-ai.run",
-	"COLLEGE" : "https://xgohdlht5wrandiyv34br32g.agents.do-ai.run",
-	"FAMILY" : "https://ua5um6lyt32erqe3dgifxgcq.agents.do-ai.run",
-	"VENDOR" : "https://omiuisweqow65d3lzlpsfmba.agents.do-ai.run",
-	"FIESTA" : "https://kmlrxute55zz2odzhqrkoeey.agents.do-ai.run",
-	"CAFE" : "https://ghki5u64nz4yyiwt4sydrzcb.agents.do-ai.run",
-	"DINNER" : "https://eqqycnzxgun67e3cbvvjx3ve.agents.do-ai.run",
-	"WAITER" : "https://snef3uch436uamykmgemq54z.agents.do-ai.run",
-	"BEER" : "https://sxuzvn27qabb527mnem5ge4i.agents.do-ai.run",
-	"BAKERY" : "https://ffk4fpxvhrfqcrpfwwjxzjnn.agents.do-ai.run",
-	"TEA" : "https://asxrjdg56qys7xaylsd4ihft.agents.do-ai.run",
-	"OFFICE" : "https://nygdebemztf3ozd5mhvsnyfz.agents.do-ai.run",
-	"SAMBA" : "https://ntu656jkrtfl42umuhdd4spi.agents.do-ai.run",
-	"BEACH" : "https://hkwukoh6cmnk64b4ex7v5drp.agents.do-ai.run"
-}
+load_dotenv()
 
 # Mongo configuration
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 MONGODB_DB = os.getenv("MONGODB_DB", "altastalk")
 
+# Cohort setup (POST /agents/{agent}/setup:batch): chunks inserted at once, learners per insert_many
+SETUP_BATCH_CONCURRENCY = int(os.getenv("SETUP_BATCH_CONCURRENCY", "4"))
+SETUP_BATCH_INSERT_SIZE = int(os.getenv("SETUP_BATCH_INSERT_SIZE", "100"))
+
 # Cached Motor client (module-level singleton)
 _motor_client: Optional[AsyncIOMotorClient] = None
 
 # ================================
 # 🔊 Text-to-Speech (TTS)
 # ================================
-async def text_to_speech(text: str, voice: str = "UgBBYS2sOqTuMpoF3BR0") -> str:
-    """
-    Convert text into speech using ElevenLabs API.
-    Returns the path to a temporary .mp3 file.
-    """
-    api_key = os.getenv("ELEVENLABS_API_KEY")
+def _tts_request(text: str, voice: Optional[str], audio_format: str, profile: Optional[VoiceProfile] = None):
+    """Build the ElevenLabs TTS request; returns (url, headers, payload, params, format)."""
+    api_key = cassette.credential("ELEVENLABS_API_KEY")
     if not api_key:
         raise RuntimeError("ELEVENLABS_API_KEY not configured in .env")
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice}"
+    profile = profile or resolve_profile(None, None)
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice or profile.voice}"
+    # short replies go to the low-latency model
+    fast = degradation.level >= FAST_TTS
+    model_id = profile.tts_model(text, fast=fast)
+    if fast:
+        # Upstream is slow: trade voice quality for latency and bytes
+        audio_format = FAST_FORMATS.get(audio_format, audio_format)
+    fmt = AUDIO_FORMATS[audio_format]
 
     headers = {
-        "Accept": "audio/mpeg",
+        "Accept": fmt.media_type,
         "Content-Type": "application/json",
         "xi-api-key": api_key,
     }
+    payload = {"text": text, "model_id": model_id, "voice_settings": dict(profile.voice_settings)}
+    return url, headers, payload, {"output_format": fmt.provider_format}, fmt
+
+
+async def text_to_speech(
+    text: str,
+    voice: Optional[str] = None,
+    audio_format: str = "mp3",
+    profile: Optional[VoiceProfile] = None,
+) -> str:
+    """
+    Convert text into speech using ElevenLabs API.
+    Returns the path to a temporary audio file in ``audio_format``
+    (a key of ``AUDIO_FORMATS``; the suffix matches the format).
+    Voice, model tier and voice settings come from ``profile``
+    (default profile if omitted); ``voice`` overrides the profile's voice.
+    """
+    url, headers, payload, params, fmt = _tts_request(text, voice, audio_format, profile)
+
+    # Bounded by the request deadline; cancelling the caller aborts the download
+    async def fetch():
+        aiohttp = providers.aiohttp()
+        timeout = aiohttp.ClientTimeout(total=remaining())
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(url, headers=headers, json=payload, params=params) as resp:
+                if resp.status != 200:
+                    err = await resp.text()
+                    raise RuntimeError(f"TTS failed ({resp.status}): {err}")
+                return await resp.read()
+
+    with timed_stage("tts"):
+        request = {"url": url, "payload": payload, "params": params}
+        audio_data = await cassette.call("tts", request, fetch, cassette.BYTES)
 
-    payload = {
-    "text": text,
-    "model_id": "eleven_multilingual_v2",
-    "voice_settings": {
-        # Lower for more emotional and dramatic delivery.
-        "stability": 0.45,
-        # Higher for better clarity and consistency, especially with a high-quality voice.
-        "similarity_boost": 1.0,
-        # Recommended to keep at 0 for most realistic results and lower latency.
-        "style": 0,
-        # Default speed is 1.0. Adjust in small increments (0.9–1.1) for nuance.
-        "speed": 1.0,
-		
-    },
-}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as resp:
-            if resp.status != 200:
-                err = await resp.text()
-                raise RuntimeError(f"TTS failed ({resp.status}): {err}")
-
-            # Save audio to a temp file
-            audio_data = await resp.read()
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as f:
-                f.write(audio_data)
-                return f.name
+    # Save audio to a temp file
+    with tempfile.NamedTemporaryFile(delete=False, suffix=fmt.suffix) as f:
+        f.write(audio_data)
+        return f.name
+
+
+async def stream_text_to_speech(
+    text: str,
+    voice: Optional[str] = None,
+    audio_format: str = "mp3",
+    profile: Optional[VoiceProfile] = None,
+):
+    """
+    Stream synthesized speech from ElevenLabs' streaming endpoint.
+    Yields audio chunks as they arrive, so playback can start before the
+    clip is complete and nothing is buffered in full.
+    """
+    url, headers, payload, params, _ = _tts_request(text, voice, audio_format, profile)
+
+    async def fetch():
+        aiohttp = providers.aiohttp()
+        timeout = aiohttp.ClientTimeout(total=remaining(REQUEST_DEADLINE_SECONDS))
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(f"{url}/stream", headers=headers, json=payload, params=params) as resp:
+                if resp.status != 200:
+                    err = await resp.text()
+                    raise RuntimeError(f"TTS failed ({resp.status}): {err}")
+                async for chunk in resp.content.iter_chunked(16 * 1024):
+                    yield chunk
+
+    with timed_stage("tts"):
+        request = {"url": f"{url}/stream", "payload": payload, "params": params}
+        async for chunk in cassette.stream("tts_stream", request, fetch):
+            yield chunk
 
 # ================================
 # 🔊 Text-to-Speech (TTS)
@@ -144,29 +190,43 @@ async def text_to_speech(text: str, voice: str = "UgBBYS2sOqTuMpoF3BR0") -> str:
 # ================================
 # 🎙️ Speech-to-Text (STT)
 # ================================
-async def speech_to_text(audio_path: str) -> str:
+async def speech_to_text(audio_path: str, language_code: Optional[str] = None) -> str:
     """
     Transcribe speech from an audio file to text using ElevenLabs STT API.
+    A known ``language_code`` (ISO 639-1) skips language auto-detection.
     """
-    api_key = os.getenv("ELEVENLABS_API_KEY")
+    api_key = cassette.credential("ELEVENLABS_API_KEY")
     if not api_key:
         raise RuntimeError("ELEVENLABS_API_KEY not configured in .env")
 
     url = "https://api.elevenlabs.io/v1/speech-to-text"
     headers = {"xi-api-key": api_key}
 
-    async with aiohttp.ClientSession() as session:
-        with open(audio_path, "rb") as f:
-            data = aiohttp.FormData()
-            data.add_field("file", f, filename=os.path.basename(audio_path))
-            data.add_field("model_id", "scribe_v1")
-
-            async with session.post(url, headers=headers, data=data) as resp:
-                if resp.status != 200:
-                    err = await resp.text()
-                    raise RuntimeError(f"STT failed ({resp.status}): {err}")
-                result = await resp.json()
-                return result.get("text", "")
+    async def fetch():
+        aiohttp = providers.aiohttp()
+        timeout = aiohttp.ClientTimeout(total=remaining())
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            with open(audio_path, "rb") as f:
+                data = aiohttp.FormData()
+                data.add_field("file", f, filename=os.path.basename(audio_path))
+                data.add_field("model_id", "scribe_v1")
+                if language_code:
+                    data.add_field("language_code", language_code)
+
+                async with session.post(url, headers=headers, data=data) as resp:
+                    if resp.status != 200:
+                        err = await resp.text()
+                        raise RuntimeError(f"STT failed ({resp.status}): {err}")
+                    result = await resp.json()
+                    return result.get("text", "")
+
+    def request():
+        fields = {"url": url, "model_id": "scribe_v1", "audio": cassette.file_digest(audio_path)}
+        if language_code:
+            fields["language_code"] = language_code
+        return fields
+
+    return await cassette.call("stt", request, fetch)
 
 
 def _get_motor_client() -> AsyncIOMotorClient:
@@ -176,128 +236,343 @@ def _get_motor_client() -> AsyncIOMotorClient:
 	return _motor_client
 
 
-async def setupAgent(AGENT: str, country: str, language: str, db=None, scenario_prompt: Optional[str] = None):
-	"""
-	Prepare an OpenAI-compatible client for a DigitalOcean agent and create
-	a conversation document with an initial system message describing
-	the country and language.
-
-	Returns: (client, response, conversation_id)
-	"""
-	# Validate the input DigitalOcean agent
-	if AGENT not in endpoints:
-		raise RuntimeError(f"Unknown agent: {AGENT}")
-
-	# Prepare DigitalOcean agent client config
-	agent_endpoint = endpoints[AGENT].rstrip("/") + "/api/v1/"
-	agent_access_key = os.getenv(f"{AGENT}_PRIVATE_KEY")
-	if not agent_access_key:
-		raise RuntimeError(f"Access key for agent {AGENT} not configured in environment")
-
-	# Prepare Gemini config as well
-	gemini_key = os.getenv("GEMINI_API_KEY")
-	gemini_model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-	if not gemini_key:
-		logging.warning("GEMINI_API_KEY not set; Gemini instance will be skipped")
-
-	# initial system message and conversation document (for both agents)
-	system_content = f"Your country is set to {country}, and your language is {language}."
-	# Separate system prompt for Gemini-specific behavior
-	gemini_prompt = f"""
-You are a goal checker for conversation practice.
-
-User's requested scenario: "{scenario_prompt}"
-
-Facilitate this conversational roleplay scenario. You will recieve input from the user.
-The user is trying to achieve goals in a conversation. The user is talking to an AI Agent playing the role of a foreign local.
-Help keep track of the goals for the user in the conversation. If anything the user says could count towards a goal, mark it as complete.
+def owner_id(user_id: Optional[str]):
+	"""Stored form of a learner id: an ObjectId when it is one, else the string."""
+	if not user_id:
+		return None
+	try:
+		return ObjectId(user_id)
+	except Exception:
+		return user_id
 
-ALL your responses must be ONLY with valid JSON in this exact format:
 
-{{
-  "goals": [
-    {{ "goal": "First goal to accomplish", "completed": false }},
-    {{ "goal": "Second goal to accomplish", "completed": false }},
-    {{ "goal": "Third goal to accomplish", "completed": false }}
-  ],
-}}
+def session_docs(
+	AGENT: str,
+	country: str,
+	language: str,
+	scenario_prompt: Optional[str] = None,
+	*,
+	gemini_model: Optional[str] = None,
+	user_id=None,
+) -> tuple:
+	"""New agent conversation document and, with ``gemini_model``, its linked goal conversation.
 
-Make it realistic and interactive. Keep goals simple and achievable through conversation. If a goal ever is completed, NEVER make it false.
-"""
+	System prompts are stored as template references (see ``templates``), not text.
+	Returns ``(conversation_doc, goal_doc or None, profile)``.
+	"""
+	now = datetime.utcnow()
+	# ids are assigned up front so each conversation can point at the other
+	conversation_oid = ObjectId()
+	gemini_oid = ObjectId() if gemini_model else None
+	# voice, TTS model tiers and STT language are fixed for the conversation's lifetime
+	profile = resolve_profile(AGENT, language)
+	metadata = {"country": country, "language": language, "voice_profile": profile._asdict()}
+	if scenario_prompt:
+		metadata["scenario_prompt"] = scenario_prompt
+	if gemini_oid:
+		metadata["goal_conversation_id"] = str(gemini_oid)
 	conversation_doc = {
+		"_id": conversation_oid,
 		"agent": AGENT,
-		"created_at": datetime.utcnow(),
-		"updated_at": datetime.utcnow(),
-		"metadata": {"country": country, "language": language},
+		"created_at": now,
+		"updated_at": now,
+		"metadata": metadata,
 		"messages": [
-			{"role": "system", "content": system_content, "timestamp": datetime.utcnow()}
+			{
+				"role": "system",
+				"template": templates.ref("agent_system", country=country, language=language),
+				"timestamp": now,
+				"seq": 1,
+			}
 		],
+		"seq": 1,
 	}
-
-	# Use provided DB (preferred) else fall back to module client
-	_db = db if db is not None else _get_motor_client()[MONGODB_DB]
-	res = await _db.conversations.insert_one(conversation_doc)
-	conversation_id = str(res.inserted_id)
-
-	# Create a separate conversation document for Gemini if configured
-	gemini_conversation_id = None
-	if gemini_key:
-		conversation_doc_g = {
+	goal_doc = None
+	if gemini_oid:
+		goal_doc = {
+			"_id": gemini_oid,
 			"agent": "GEMINI",
-			"created_at": datetime.utcnow(),
-			"updated_at": datetime.utcnow(),
-			"metadata": {"country": country, "language": language, "model": gemini_model_name},
+			"created_at": now,
+			"updated_at": now,
+			"metadata": {
+				"country": country,
+				"language": language,
+				"model": gemini_model,
+				"agent_conversation_id": str(conversation_oid),
+			},
 			"messages": [
-				{"role": "system", "content": gemini_prompt, "timestamp": datetime.utcnow()}
+				{
+					"role": "system",
+					"template": templates.ref("goal_checker", scenario_prompt=scenario_prompt),
+					"timestamp": now,
+					"seq": 1,
+				}
 			],
+			"seq": 1,
 		}
-		res_g = await _db.conversations.insert_one(conversation_doc_g)
-		gemini_conversation_id = str(res_g.inserted_id)
+	if user_id is not None:
+		conversation_doc["user_id"] = user_id
+		if goal_doc is not None:
+			goal_doc["user_id"] = user_id
+	return conversation_doc, goal_doc, profile
 
-	client = None
-	response = None
-	client_g = None
-	response_g = None
+
+def _gemini_model() -> Optional[str]:
+	"""The goal checker's model, or None (no goal conversation) without a Gemini key."""
+	if not cassette.credential("GEMINI_API_KEY"):
+		logging.warning("GEMINI_API_KEY not set; Gemini instance will be skipped")
+		return None
+	return os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+
+async def queue_warmup(AGENT: str, conversation_doc: dict, goal_doc: Optional[dict], dedup_key: Optional[str] = None):
+	"""Queue the ``agent_warmup`` job for a new session; never raises."""
 	try:
-		# DO agent warm-up
-		client = OpenAI(base_url=agent_endpoint, api_key=agent_access_key)
-		response = await asyncio.to_thread(
-			client.chat.completions.create,
-			model="n/a",
-			messages=[{"role": "system", "content": system_content}],
-			extra_body={"include_retrieval_info": True},
+		await jobs.enqueue(
+			"agent_warmup",
+			{
+				"agent": AGENT,
+				"conversation_id": str(conversation_doc["_id"]),
+				"system_content": templates.render(conversation_doc["messages"][0]["template"]),
+				"gemini_model": goal_doc["metadata"]["model"] if goal_doc else None,
+				"gemini_prompt": templates.render(goal_doc["messages"][0]["template"]) if goal_doc else None,
+			},
+			dedup_key=dedup_key or str(conversation_doc["_id"]),
 		)
-		# Gemini warm-up (if configured)
-		if gemini_key and gemini_conversation_id:
-			genai.configure(api_key=gemini_key)
-			client_g = genai.GenerativeModel(gemini_model_name)
-			response_g = await asyncio.to_thread(client_g.generate_content, gemini_prompt)
 	except Exception:
-		logging.exception("Initial agent warmup call failed; continuing")
+		logging.exception("Queueing agent warm-up failed; continuing")
+
+
+async def setupAgent(
+	AGENT: str,
+	country: str,
+	language: str,
+	db=None,
+	scenario_prompt: Optional[str] = None,
+	user_id: Optional[str] = None,
+):
+	"""
+	Prepare an OpenAI-compatible client for a DigitalOcean agent and create
+	a conversation document with an initial system message describing
+	the country and language, plus its linked Gemini goal conversation when
+	Gemini is configured. Both are owned by ``user_id`` when given.
 
-	return client, response, conversation_id, client_g, response_g, gemini_conversation_id
+	Returns: (client, response, conversation_id, client_g, response_g,
+	gemini_conversation_id). The warm-up calls run as an ``agent_warmup`` job,
+	so ``response``, ``client_g`` and ``response_g`` are always None.
+	"""
+	# Validate the input DigitalOcean agent and its credentials; the client is pooled per agent
+	client = registry.client(AGENT)
 
+	conversation_doc, goal_doc, profile = session_docs(
+		AGENT, country, language, scenario_prompt, gemini_model=_gemini_model(), user_id=owner_id(user_id)
+	)
 
-async def append_message(conversation_id: str, role: str, content: str, *, db=None, max_messages: int = 200):
+	# Use provided DB (preferred) else fall back to module client
+	_db = db if db is not None else _get_motor_client()[MONGODB_DB]
+	await templates.register(_db)
+	await _db.conversations.insert_many([doc for doc in (conversation_doc, goal_doc) if doc is not None])
+	conversation_id = str(conversation_doc["_id"])
+	gemini_conversation_id = str(goal_doc["_id"]) if goal_doc else None
+	conversation_profiles.remember(conversation_id, profile, AGENT, conversation_doc.get("user_id"))
+
+	# Warm-up calls run as a background job; the conversation is usable without them
+	record_usage("setup", conversation_id=conversation_id, agent=AGENT, conversations=1)
+	await queue_warmup(AGENT, conversation_doc, goal_doc)
+
+	# the warm-up responses are not waited for; callers get None for both
+	return client, None, conversation_id, None, None, gemini_conversation_id
+
+
+async def setup_cohort(
+	AGENT: str,
+	learners: list,
+	*,
+	db=None,
+	concurrency: int = SETUP_BATCH_CONCURRENCY,
+	chunk_size: int = SETUP_BATCH_INSERT_SIZE,
+) -> AsyncIterator[dict]:
+	"""Create sessions for a cohort of learners; yields one result per learner as it is stored.
+
+	``learners`` are ``AgentSetupRequest``-shaped objects. Learners sharing a
+	(country, language, scenario) are inserted together with ``insert_many``,
+	``chunk_size`` at a time, up to ``concurrency`` chunks at once, and share
+	one warm-up job. Results carry the learner's ``index`` in ``learners``.
+	"""
+	registry.client(AGENT)
+	gemini_model = _gemini_model()
+	_db = db if db is not None else _get_motor_client()[MONGODB_DB]
+	await templates.register(_db)
+
+	groups: dict = {}
+	for index, learner in enumerate(learners):
+		groups.setdefault((learner.country, learner.language, learner.scenario_prompt), []).append(index)
+	semaphore = asyncio.Semaphore(concurrency)
+	# groups whose warm-up is queued: by the first chunk that stores a session
+	warmed: set = set()
+
+	async def insert_chunk(key, indexes) -> list:
+		country, language, scenario_prompt = key
+		async with semaphore:
+			sessions = []
+			for index in indexes:
+				user_id = owner_id(learners[index].user_id)
+				sessions.append((index, user_id, *session_docs(
+					AGENT, country, language, scenario_prompt, gemini_model=gemini_model, user_id=user_id
+				)))
+			docs = [doc for _, _, doc, goal_doc, _ in sessions for doc in (doc, goal_doc) if doc is not None]
+			failed: dict = {}
+			try:
+				await _db.conversations.insert_many(docs, ordered=False)
+			except BulkWriteError as exc:
+				# unordered: the other documents were still inserted
+				for error in exc.details.get("writeErrors", []):
+					failed[docs[error["index"]]["_id"]] = error.get("errmsg", "insert failed")
+			except Exception as exc:
+				logging.exception("Cohort setup insert of %d sessions failed", len(sessions))
+				failed = {doc["_id"]: str(exc) for doc in docs}
+			if failed:
+				results = [
+					{"index": index, "error": failed.get(doc["_id"]) or failed.get(goal_doc["_id"] if goal_doc else None)}
+					for index, _, doc, goal_doc, _ in sessions
+				]
+				errors = [result for result in results if result["error"]]
+				sessions = [session for session, result in zip(sessions, results) if not result["error"]]
+				if not sessions:
+					return errors
+			else:
+				errors = []
+			if key not in warmed:
+				warmed.add(key)
+				_, _, doc, goal_doc, _ = sessions[0]
+				await queue_warmup(AGENT, doc, goal_doc, dedup_key="|".join([AGENT, country, language, scenario_prompt or ""]))
+		results = errors
+		for index, user_id, doc, goal_doc, profile in sessions:
+			conversation_id = str(doc["_id"])
+			conversation_profiles.remember(conversation_id, profile, AGENT, user_id)
+			record_usage("setup", conversation_id=conversation_id, agent=AGENT, user_id=user_id, conversations=1)
+			results.append({
+				"index": index,
+				"user_id": learners[index].user_id,
+				"conversation_id": conversation_id,
+				"gemini_conversation_id": str(goal_doc["_id"]) if goal_doc else None,
+			})
+		return results
+
+	tasks = [
+		insert_chunk(key, indexes[i:i + chunk_size])
+		for key, indexes in groups.items()
+		for i in range(0, len(indexes), chunk_size)
+	]
+	for finished in asyncio.as_completed(tasks):
+		for result in await finished:
+			yield result
+
+
+async def _warm_up_agent(payload: dict, db):
+	"""``agent_warmup`` job: the initial system-message calls queued by setupAgent."""
+	agent = payload["agent"]
+	conversation_id = payload["conversation_id"]
+	start = time.perf_counter()
+	response = await cassette.chat_completion(
+		registry.client(agent),
+		model="n/a",
+		messages=[{"role": "system", "content": payload["system_content"]}],
+		extra_body={"include_retrieval_info": True},
+	)
+	response_g = None
+	if payload.get("gemini_prompt"):
+		client_g = providers.genai().GenerativeModel(payload["gemini_model"])
+		response_g = await cassette.gemini_generate(client_g, payload["gemini_prompt"])
+
+	prompt_tokens, completion_tokens = token_usage(response)
+	g_prompt_tokens, g_completion_tokens = token_usage(response_g)
+	record_usage(
+		"setup",
+		conversation_id=conversation_id,
+		agent=agent,
+		prompt_tokens=prompt_tokens + g_prompt_tokens,
+		completion_tokens=completion_tokens + g_completion_tokens,
+		upstream_calls=1 + (response_g is not None),
+		upstream_ms=round((time.perf_counter() - start) * 1000, 1),
+	)
+
+
+# Warm-ups only help while the conversation is new; one retry is enough
+jobs.register("agent_warmup", _warm_up_agent, concurrency=8, max_attempts=2)
+
+
+async def append_message(
+	conversation_id: str,
+	role: str,
+	content: str,
+	*,
+	db=None,
+	max_messages: Optional[int] = 200,
+	expected_seq: Optional[int] = None,
+	timestamp: Optional[datetime] = None,
+):
+	"""Append a message and bump the conversation's ``seq``.
+
+	With ``expected_seq`` the append only applies if the stored ``seq`` still
+	matches, and raises ``ConversationConflictError`` otherwise. Only the last
+	``max_messages`` messages are kept (all of them with None). Returns the
+	stored message document.
+	"""
 	_db = db if db is not None else _get_motor_client()[MONGODB_DB]
 	oid = ObjectId(conversation_id)
-	msg_doc = {"role": role, "content": content, "timestamp": datetime.utcnow()}
-	await _db.conversations.update_one(
-		{"_id": oid},
+	msg_doc = {"role": role, "content": content, "timestamp": timestamp or datetime.utcnow()}
+	query = {"_id": oid}
+	if expected_seq is not None:
+		msg_doc["seq"] = expected_seq + 1
+		query["seq"] = seq_filter(expected_seq)
+	push = {"$each": [msg_doc]}
+	if max_messages:
+		push["$slice"] = -max_messages
+	updated = await _db.conversations.find_one_and_update(
+		query,
 		{
-			"$push": {"messages": {"$each": [msg_doc], "$slice": -max_messages}},
+			"$push": {"messages": push},
 			"$set": {"updated_at": datetime.utcnow()},
+			"$inc": {"seq": 1},
 		},
+		projection={"seq": 1},
+		return_document=ReturnDocument.AFTER,
 	)
+	if updated is None:
+		if expected_seq is None:
+			return msg_doc
+		if await _db.conversations.count_documents({"_id": oid}, limit=1) == 0:
+			raise RuntimeError(f"Conversation {conversation_id} not found")
+		raise ConversationConflictError(
+			f"Conversation {conversation_id} moved past seq {expected_seq}"
+		)
+	hub.publish(conversation_id, {**msg_doc, "seq": updated.get("seq")})
+	return msg_doc
 
 
-async def get_last_messages(conversation_id: str, n: int = 50, db=None):
+async def get_conversation_state(conversation_id: str, n: int = 50, db=None):
+	"""Return ``(last n messages, seq)`` for a conversation in one read."""
 	_db = db if db is not None else _get_motor_client()[MONGODB_DB]
 	oid = ObjectId(conversation_id)
-	doc = await _db.conversations.find_one({"_id": oid}, {"messages": {"$slice": -n}})
+	doc = await _db.conversations.find_one({"_id": oid}, {"messages": {"$slice": -n}, "seq": 1})
 	if not doc:
-		return []
-	return doc.get("messages", [])
+		return [], 0
+	return await templates.resolve(doc.get("messages", []), _db), doc.get("seq", 0)
+
+
+async def get_last_messages(conversation_id: str, n: int = 50, db=None):
+	messages, _ = await get_conversation_state(conversation_id, n=n, db=db)
+	return messages
+
+
+def trim_history(db_messages: list, n: int) -> list:
+	"""The last ``n`` messages, keeping a leading system prompt (country/language, goal instructions)."""
+	if len(db_messages) <= n:
+		return db_messages
+	if n > 1 and db_messages[0].get("role") == "system":
+		return db_messages[:1] + db_messages[len(db_messages) - n + 1:]
+	return db_messages[-n:]
 
 
 def to_agent_messages(db_messages, system_prompt: Optional[str] = None):
@@ -309,33 +584,34 @@ def to_agent_messages(db_messages, system_prompt: Optional[str] = None):
 	return msgs
 
 
-def _get_openai_client_for_agent(agent: str) -> OpenAI:
-	if agent not in endpoints:
-		raise RuntimeError(f"Unknown agent: {agent}")
-	base = endpoints[agent].rstrip("/") + "/api/v1/"
-	key = os.getenv(f"{agent}_PRIVATE_KEY")
-	if not key:
-		raise RuntimeError(f"Private key for agent {agent} not found in environment")
-	return OpenAI(base_url=base, api_key=key)
+def to_gemini_prompt(db_messages, content: str) -> str:
+	"""Flatten history and the new user message into a Gemini text prompt."""
+	history_text = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in db_messages)
+	if history_text:
+		return f"{history_text}\n\nUser: {content}\nAssistant:"
+	return f"User: {content}\nAssistant:"
+
+
+def _get_openai_client_for_agent(agent: str) -> "AsyncOpenAI":
+	return registry.client(agent)
 
 
 def _get_client_for_agent(agent: str):
 	"""Return a provider client by agent name.
 	- 'GEMINI' => GenerativeModel
-	- other => OpenAI-compatible client
+	- other => OpenAI-compatible async client
 	"""
 	if agent == "GEMINI":
-		gemini_key = os.getenv("GEMINI_API_KEY")
+		gemini_key = cassette.credential("GEMINI_API_KEY")
 		if not gemini_key:
 			raise RuntimeError("GEMINI_API_KEY not configured in environment")
-		genai.configure(api_key=gemini_key)
 		model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-		return genai.GenerativeModel(model_name)
+		return providers.genai().GenerativeModel(model_name)
 	return _get_openai_client_for_agent(agent)
 
 
 async def messageAgent(
-	client: OpenAI,
+	client: "AsyncOpenAI",
 	conversation_id: str,
 	role: str,
 	content: str,
@@ -345,37 +621,201 @@ async def messageAgent(
 	history_size: int = 50,
 	include_retrieval_info: bool = True,
 ):
-	# store user message
-	await append_message(conversation_id, role, content, db=db, max_messages=max_messages)
+	"""Run one turn: store the message, call the agent, store the reply.
+
+	Turns on the same conversation are serialized by a per-conversation lock;
+	appends are conditional on the conversation's ``seq`` so a concurrent
+	writer in another worker surfaces as ``ConversationConflictError``.
+	"""
+	async with conversation_lock(conversation_id):
+		return await _run_turn(
+			client,
+			conversation_id,
+			role,
+			content,
+			db=db,
+			max_messages=max_messages,
+			history_size=history_size,
+			include_retrieval_info=include_retrieval_info,
+		)
+
 
-	# get recent history
-	db_messages = await get_last_messages(conversation_id, n=history_size, db=db)
+async def _run_turn(
+	client: "AsyncOpenAI",
+	conversation_id: str,
+	role: str,
+	content: str,
+	*,
+	db,
+	max_messages: int,
+	history_size: int,
+	include_retrieval_info: bool,
+):
+	# Under upstream slowness, send less history to the conversational agent.
+	# Goal-checker (Gemini) conversations keep theirs.
+	prompt_size = degradation.history_size(history_size) if hasattr(client, "chat") else history_size
+
+	# In write-behind mode both appends are queued and history comes from the
+	# in-process window, keeping Mongo off the critical path.
+	write_queue = get_write_queue()
+
+	# store user message and get recent history
+	if write_queue is not None:
+		user_write = await write_queue.append(conversation_id, role, content, max_messages=max_messages)
+		db_messages = await write_queue.history(conversation_id, n=history_size)
+	else:
+		db_messages, seq = await get_conversation_state(conversation_id, n=history_size, db=db)
+		user_msg = await append_message(
+			conversation_id, role, content, db=db, max_messages=max_messages, expected_seq=seq
+		)
+		seq += 1
+		db_messages = db_messages + [user_msg]
+	db_messages = trim_history(db_messages, prompt_size)
 	agent_messages = to_agent_messages(db_messages)
 
-	# call agent (OpenAI-compatible vs Gemini)
+	# call agent (OpenAI-compatible vs Gemini). Both calls are native async so
+	# cancelling the turn (client disconnect) aborts the upstream request, and
+	# both are bounded by what is left of the request deadline.
+	upstream_start = time.perf_counter()
 	if hasattr(client, "chat"):
-		response = await asyncio.to_thread(
-			client.chat.completions.create,
-			model="n/a",
-			messages=agent_messages,
-			extra_body={"include_retrieval_info": include_retrieval_info},
-		)
+		with timed_stage("llm"):
+			response = await cassette.chat_completion(
+				client,
+				model="n/a",
+				messages=agent_messages,
+				extra_body={"include_retrieval_info": include_retrieval_info},
+				timeout=remaining(),
+			)
 		try:
 			assistant_text = response.choices[0].message.content
 		except Exception:
 			assistant_text = str(response)
 	else:
 		# Gemini GenerativeModel path
-		history_text = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in db_messages)
-		prompt = (
-			f"{history_text}\n\nUser: {content}\nAssistant:"
-			if history_text
-			else f"User: {content}\nAssistant:"
-		)
-		response = await asyncio.to_thread(client.generate_content, prompt)
-		assistant_text = getattr(response, "text", str(response))
+		prompt = to_gemini_prompt(db_messages, content)
+		with timed_stage("goal"):
+			if GOAL_BATCHING_ENABLED:
+				# goal checks from concurrent sessions share one upstream request;
+				# the batched call has no single raw response to hand back
+				response = None
+				assistant_text, usage = await get_goal_batcher(client.model_name).submit(prompt)
+			else:
+				timeout = remaining()
+				response = await cassette.gemini_generate(
+					client, prompt, request_options={"timeout": timeout} if timeout else None
+				)
+				assistant_text = getattr(response, "text", str(response))
+				usage = token_usage(response)
+	upstream_ms = (time.perf_counter() - upstream_start) * 1000
 
 	# persist assistant reply
-	await append_message(conversation_id, "assistant", assistant_text, db=db, max_messages=max_messages)
+	if write_queue is not None:
+		assistant_write = await write_queue.append(
+			conversation_id, "assistant", assistant_text, max_messages=max_messages
+		)
+		await write_queue.wait_durable(user_write, assistant_write)
+	else:
+		await append_message(
+			conversation_id, "assistant", assistant_text, db=db, max_messages=max_messages, expected_seq=seq
+		)
+
+	# a batched goal check reports its share of the batch's tokens
+	prompt_tokens, completion_tokens = token_usage(response) if hasattr(client, "chat") else usage
+	record_usage(
+		"turn",
+		conversation_id=conversation_id,
+		turns=1,
+		prompt_tokens=prompt_tokens,
+		completion_tokens=completion_tokens,
+		upstream_calls=1,
+		upstream_ms=round(upstream_ms, 1),
+	)
 
 	return {"conversation_id": conversation_id, "assistant_text": assistant_text, "raw_response": response}
+
+
+def farewell_instruction(metadata: Optional[dict]) -> str:
+	"""In-character closing instruction for a conversation's metadata."""
+	metadata = metadata or {}
+	language = metadata.get("language")
+	scenario_prompt = metadata.get("scenario_prompt")
+
+	parts = [
+		"Please end this conversation now in character."
+	]
+	if scenario_prompt:
+		parts.append(f"Stay consistent with this scenario: {scenario_prompt}")
+	# Keep it brief and avoid new topics
+	parts.append("Provide a brief, warm farewell (1-3 sentences). Do not introduce new topics.")
+	if language and isinstance(language, str):
+		parts.append(f"Respond in {language}.")
+	return " ".join(parts)
+
+
+async def generate_farewell(
+	client,
+	conversation_id: str,
+	metadata: Optional[dict],
+	*,
+	db=None,
+	history_size: int = 50,
+):
+	"""Ask the agent for an in-character farewell without storing anything.
+
+	The closing instruction is sent as the final turn but never written to the
+	transcript. Returns ``(farewell_text, seq, raw_response)``, where ``seq`` is
+	the conversation seq the farewell was written for (``None`` in write-behind
+	mode, where history comes from the in-process window).
+	"""
+	write_queue = get_write_queue()
+	if write_queue is not None:
+		db_messages, seq = await write_queue.history(conversation_id, n=history_size), None
+	else:
+		db_messages, seq = await get_conversation_state(conversation_id, n=history_size, db=db)
+	instruction = farewell_instruction(metadata)
+
+	if hasattr(client, "chat"):
+		with timed_stage("llm"):
+			response = await cassette.chat_completion(
+				client,
+				model="n/a",
+				messages=to_agent_messages(db_messages) + [{"role": "user", "content": instruction}],
+				extra_body={"include_retrieval_info": True},
+				timeout=remaining(),
+			)
+		try:
+			text = response.choices[0].message.content
+		except Exception:
+			text = str(response)
+	else:
+		prompt = to_gemini_prompt(db_messages, instruction)
+		timeout = remaining()
+		with timed_stage("goal"):
+			response = await cassette.gemini_generate(
+				client, prompt, request_options={"timeout": timeout} if timeout else None
+			)
+		text = getattr(response, "text", str(response))
+	return text, seq, response
+
+
+async def store_farewell(
+	conversation_id: str,
+	text: str,
+	*,
+	seq: Optional[int] = None,
+	db=None,
+	max_messages: int = 200,
+):
+	"""Append a farewell as the assistant's last message.
+
+	With ``seq`` the append only applies if the conversation has not moved
+	since the farewell was generated (``ConversationConflictError`` otherwise).
+	"""
+	write_queue = get_write_queue()
+	if write_queue is not None:
+		write = await write_queue.append(conversation_id, "assistant", text, max_messages=max_messages)
+		await write_queue.wait_durable(write)
+		return
+	await append_message(
+		conversation_id, "assistant", text, db=db, max_messages=max_messages, expected_seq=seq
+	)
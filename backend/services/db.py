@@ -3,6 +3,13 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi import FastAPI, Depends
 from dotenv import load_dotenv
 
+from backend.services.write_behind import start_write_behind, stop_write_behind
+from backend.services.usage import start_usage_ledger, stop_usage_ledger
+from backend.services.agent_registry import start_agent_registry, stop_agent_registry
+from backend.services.audio_store import start_audio_store, stop_audio_store
+from backend.services.jobs import start_job_runner, stop_job_runner
+from backend.services.events import start_event_hub, stop_event_hub
+
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
@@ -18,9 +25,25 @@ def init_db(app: FastAPI):
     client = AsyncIOMotorClient(MONGO_URI)
     app.state._mongo_client = client
     app.state._mongo_db = client[MONGO_DB]
+    app.state._write_queue = start_write_behind(app.state._mongo_db)
+    app.state._usage_ledger = start_usage_ledger(app.state._mongo_db)
+    app.state._agent_registry = start_agent_registry(app.state._mongo_db)
+    app.state._audio_store = start_audio_store(app.state._mongo_db)
+    app.state._job_runner = start_job_runner(app.state._mongo_db)
+    app.state._event_hub = start_event_hub(app.state._mongo_db)
 
-def close_db(app: FastAPI):
+async def close_db(app: FastAPI):
+    """
+    Call this during FastAPI shutdown. Drains queued message writes and
+    usage records before closing the client.
+    """
     global client
+    await stop_job_runner()
+    await stop_write_behind()
+    await stop_usage_ledger()
+    await stop_agent_registry()
+    stop_audio_store()
+    await stop_event_hub()
     if client:
         client.close()
 
@@ -0,0 +1,144 @@
+"""Adaptive degradation driven by live upstream latency.
+
+Every upstream stage (``llm`` agent replies, ``goal`` checks, ``tts``) reports
+its latency here. The controller keeps a rolling window per stage and compares
+each stage's p95 with its SLO. The worst ratio picks a target level, and the
+current level steps towards it one level at a time: up at most once per
+``DEGRADE_STEP_SECONDS``, down only after ``DEGRADE_COOLDOWN_SECONDS`` without
+a change, so a single slow call does not make the service flap.
+
+Levels (each includes the ones before it):
+    0 normal
+    1 reduced_history  messageAgent sends at most DEGRADED_HISTORY_SIZE messages
+                       (plus the conversation's system prompt)
+    2 async_goals      speculative farewells pause; with DEGRADE_ASYNC_GOALS, goal
+                       checks also run in the background after the reply
+    3 fast_tts         TTS switches to a low-latency model and low-bitrate format
+    4 text_only        TTS is skipped; clients continue with text replies
+"""
+import os
+import time
+import asyncio
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEGRADATION_ENABLED = os.getenv("DEGRADATION_ENABLED", "true").lower() == "true"
+DEGRADE_WINDOW_SECONDS = float(os.getenv("DEGRADE_WINDOW_SECONDS", "60"))
+DEGRADE_MIN_SAMPLES = int(os.getenv("DEGRADE_MIN_SAMPLES", "5"))
+DEGRADE_STEP_SECONDS = float(os.getenv("DEGRADE_STEP_SECONDS", "2"))
+DEGRADE_COOLDOWN_SECONDS = float(os.getenv("DEGRADE_COOLDOWN_SECONDS", "30"))
+STAGE_SLO_MS = {
+    "llm": float(os.getenv("DEGRADE_LLM_P95_MS", "4000")),
+    "goal": float(os.getenv("DEGRADE_GOAL_P95_MS", "2500")),
+    "tts": float(os.getenv("DEGRADE_TTS_P95_MS", "3000")),
+}
+# p95 / SLO ratio at which each level becomes the target
+LEVEL_THRESHOLDS = (1.0, 1.5, 2.0, 3.0)
+DEGRADED_HISTORY_SIZE = int(os.getenv("DEGRADED_HISTORY_SIZE", "12"))
+# Deferred goal checks answer {"pending": true}; only for clients that read goals from the events stream
+DEGRADE_ASYNC_GOALS = os.getenv("DEGRADE_ASYNC_GOALS", "false").lower() == "true"
+
+NORMAL, REDUCED_HISTORY, ASYNC_GOALS, FAST_TTS, TEXT_ONLY = range(5)
+LEVEL_NAMES = ("normal", "reduced_history", "async_goals", "fast_tts", "text_only")
+
+
+class _StageWindow:
+    __slots__ = ("samples",)
+
+    def __init__(self):
+        # (monotonic timestamp, latency seconds)
+        self.samples = deque(maxlen=500)
+
+    def add(self, now: float, seconds: float):
+        self.samples.append((now, seconds))
+
+    def p95(self, now: float):
+        cutoff = now - DEGRADE_WINDOW_SECONDS
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        if len(self.samples) < DEGRADE_MIN_SAMPLES:
+            return None
+        values = sorted(s for _, s in self.samples)
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+class DegradationController:
+    def __init__(self):
+        self._stages = {stage: _StageWindow() for stage in STAGE_SLO_MS}
+        self._level = NORMAL
+        self._changed_at = 0.0
+        self._evaluated_at = 0.0
+
+    def record(self, stage: str, seconds: float):
+        window = self._stages.get(stage)
+        if window is not None:
+            window.add(time.monotonic(), seconds)
+
+    def _target_level(self, now: float) -> int:
+        worst = 0.0
+        for stage, window in self._stages.items():
+            p95 = window.p95(now)
+            if p95 is not None:
+                worst = max(worst, p95 * 1000 / STAGE_SLO_MS[stage])
+        return sum(1 for threshold in LEVEL_THRESHOLDS if worst >= threshold)
+
+    @property
+    def level(self) -> int:
+        if not DEGRADATION_ENABLED:
+            return NORMAL
+        now = time.monotonic()
+        if now - self._evaluated_at >= DEGRADE_STEP_SECONDS:
+            self._evaluated_at = now
+            target = self._target_level(now)
+            if target > self._level:
+                self._level += 1
+                self._changed_at = now
+            elif target < self._level and now - self._changed_at >= DEGRADE_COOLDOWN_SECONDS:
+                self._level -= 1
+                self._changed_at = now
+        return self._level
+
+    def history_size(self, requested: int) -> int:
+        if self.level >= REDUCED_HISTORY:
+            return min(requested, DEGRADED_HISTORY_SIZE)
+        return requested
+
+    def defer_goal_checks(self) -> bool:
+        return DEGRADE_ASYNC_GOALS and self.level >= ASYNC_GOALS
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        level = self.level
+        stages = {}
+        for stage, window in self._stages.items():
+            p95 = window.p95(now)
+            stages[stage] = {
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "slo_ms": STAGE_SLO_MS[stage],
+                "samples": len(window.samples),
+            }
+        return {"level": level, "name": LEVEL_NAMES[level], "stages": stages}
+
+
+class timed_stage:
+    """Context manager recording a stage's latency, including failed calls."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # a cancelled call (client went away) says nothing about upstream latency
+        if exc_type is not asyncio.CancelledError:
+            degradation.record(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+# Module-level singleton fed by the service layer
+degradation = DegradationController()
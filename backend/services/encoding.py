@@ -0,0 +1,55 @@
+"""Fast JSON encoding for API responses.
+
+``BSONJSONResponse`` renders with orjson and understands the BSON types that
+come back from Motor (``ObjectId``, ``Decimal128``, ``bytes``), so raw Mongo
+documents can be returned without a ``jsonable_encoder`` pass. It is the app's
+default response class; routes that return trusted database documents should
+return it directly, which also skips FastAPI's response-model validation.
+"""
+import base64
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from fastapi.responses import JSONResponse
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def bson_default(obj: Any):
+    """orjson ``default`` hook for types orjson does not handle natively."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode("ascii")
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=bson_default, option=ORJSON_OPTIONS)
+
+
+class BSONJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def conversation_payload(doc: dict) -> dict:
+    """Shape a stored conversation document for ``ConversationResponse``.
+
+    Stored messages were validated on the way in, so they are passed through
+    as-is rather than rebuilt as models.
+    """
+    return {
+        "conversation_id": str(doc["_id"]),
+        "messages": doc.get("messages", []),
+        "created_at": doc.get("created_at"),
+        "metadata": doc.get("metadata", {}),
+    }
@@ -0,0 +1,146 @@
+"""In-process pub/sub for conversation updates, behind ``GET /conversations/{id}/events``.
+
+The write paths publish every stored message here: ``append_message`` once
+its update applies, the write-behind queue once a flush reaches Mongo. Goal
+updates are the goal checker's replies, stored on the linked goal
+conversation, so a stream subscribes to both conversations.
+
+A subscription is a bounded buffer and an ``asyncio.Event``; an idle stream
+costs one waiting task and no polling. A subscriber that falls more than
+``EVENTS_BUFFER_SIZE`` events behind is marked for a resync, and the stream
+reads what it missed back from Mongo, as it does when a client reconnects
+with ``Last-Event-ID``. Event ids are the conversation's message ``seq``, so
+resuming never depends on which worker served the previous connection.
+
+Publishing only reaches subscribers on the same worker. With
+``EVENTS_CHANGE_STREAMS=true`` (requires a replica set) every worker also
+watches the ``conversations`` collection and wakes the affected local
+subscribers, which then catch up from Mongo; messages seen both ways are
+delivered once, by seq.
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "64"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_CHANGE_STREAMS = os.getenv("EVENTS_CHANGE_STREAMS", "false").lower() == "true"
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+
+
+class Subscription:
+    """Pending ``(conversation_id, message)`` pairs for one stream."""
+
+    __slots__ = ("ids", "pending", "wake", "resync")
+
+    def __init__(self, ids: Iterable[str]):
+        self.ids = tuple(ids)
+        self.pending: deque = deque()
+        self.wake = asyncio.Event()
+        # conversation ids the stream must read back from Mongo
+        self.resync: set = set()
+
+    def push(self, conversation_id: str, message: Optional[dict]):
+        if message is None or len(self.pending) >= EVENTS_BUFFER_SIZE:
+            self.resync.add(conversation_id)
+        else:
+            self.pending.append((conversation_id, message))
+        self.wake.set()
+
+    def drain(self) -> tuple:
+        """``(buffered events, conversation ids to resync)``; clears both."""
+        events, resync = list(self.pending), self.resync
+        self.pending.clear()
+        self.resync = set()
+        self.wake.clear()
+        return events, resync
+
+
+class EventHub:
+    def __init__(self):
+        self._subs: dict = {}  # conversation id -> set of Subscription
+        self.published = 0
+        self._watch: Optional[asyncio.Task] = None
+
+    def subscribe(self, conversation_ids: Iterable[str]) -> Subscription:
+        sub = Subscription(conversation_ids)
+        for conversation_id in sub.ids:
+            self._subs.setdefault(conversation_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        for conversation_id in sub.ids:
+            subs = self._subs.get(conversation_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[conversation_id]
+
+    def publish(self, conversation_id: str, message: dict):
+        """Deliver a stored message (with its ``seq``) to this worker's subscribers."""
+        subs = self._subs.get(conversation_id)
+        if not subs:
+            return
+        self.published += 1
+        for sub in subs:
+            sub.push(conversation_id, message)
+
+    def poke(self, conversation_id: str):
+        """The conversation changed elsewhere; subscribers catch up from Mongo."""
+        for sub in self._subs.get(conversation_id, ()):
+            sub.push(conversation_id, None)
+
+    # ---- change streams (multi-worker)
+
+    def start(self, db):
+        if EVENTS_CHANGE_STREAMS and self._watch is None:
+            self._watch = asyncio.get_running_loop().create_task(self._watch_changes(db))
+
+    async def _watch_changes(self, db):
+        pipeline = [{"$match": {"operationType": "update"}}, {"$project": {"documentKey": 1}}]
+        while True:
+            try:
+                async with db.conversations.watch(pipeline) as stream:
+                    async for change in stream:
+                        conversation_id = str(change["documentKey"]["_id"])
+                        if conversation_id in self._subs:
+                            self.poke(conversation_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Conversation change stream failed; retrying")
+                await asyncio.sleep(5)
+
+    async def close(self):
+        if self._watch is not None:
+            self._watch.cancel()
+            await asyncio.gather(self._watch, return_exceptions=True)
+            self._watch = None
+
+    def status(self) -> dict:
+        subscriptions = {id(sub) for subs in self._subs.values() for sub in subs}
+        return {
+            "subscriptions": len(subscriptions),
+            "conversations": len(self._subs),
+            "published": self.published,
+            "change_streams": self._watch is not None,
+        }
+
+
+# Module-level singleton used by the write paths and the events route
+hub = EventHub()
+
+
+def start_event_hub(db) -> EventHub:
+    hub.start(db)
+    return hub
+
+
+async def stop_event_hub():
+    await hub.close()
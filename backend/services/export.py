@@ -0,0 +1,229 @@
+"""Streaming export of conversation transcripts for analytics.
+
+Conversations matching the filters are read with one server-side cursor in
+``_id`` order and written as NDJSON, one conversation per line, optionally
+gzip'd. The cursor fetches ``batch_size`` documents per round trip and each
+batch is encoded and handed off before the next is read, so memory stays at
+one batch whatever the export size.
+
+Exports are resumable: every line carries ``conversation_id`` and passing the
+last one as ``after`` continues from there. The CLI keeps that checkpoint
+(plus the output size) in ``<out>.checkpoint`` after every batch and, with
+``--resume``, truncates any partially written batch before continuing.
+
+To stay off the live path, reads go to a secondary when one is available
+(``EXPORT_READ_PREFERENCE``) and are paced to ``EXPORT_MAX_DOCS_PER_SECOND``.
+
+CLI::
+
+    python -m backend.services.export --out transcripts.ndjson.gz --agent TAXI --since 2025-01-01
+    python -m backend.services.export --out transcripts.ndjson.gz --agent TAXI --since 2025-01-01 --resume
+"""
+import os
+import json
+import zlib
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import AsyncIterator, Iterable, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ReadPreference
+
+from backend.services.encoding import dumps
+from backend.services.templates import templates
+
+load_dotenv()
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "200"))
+EXPORT_MAX_DOCS_PER_SECOND = float(os.getenv("EXPORT_MAX_DOCS_PER_SECOND", "500"))
+EXPORT_READ_PREFERENCE = os.getenv("EXPORT_READ_PREFERENCE", "secondaryPreferred")
+
+EXPORT_FIELDS = ("agent", "user_id", "created_at", "updated_at", "metadata", "messages")
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+def build_query(
+    *,
+    agent: Optional[str] = None,
+    country: Optional[str] = None,
+    language: Optional[str] = None,
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+) -> dict:
+    query: dict = {}
+    if agent:
+        query["agent"] = agent
+    if country:
+        query["metadata.country"] = country
+    if language:
+        query["metadata.language"] = language
+    if user_id:
+        # ownership is stored as an ObjectId when the id parses as one
+        query["user_id"] = {"$in": [ObjectId(user_id), user_id]} if ObjectId.is_valid(user_id) else user_id
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    if after:
+        query["_id"] = {"$gt": ObjectId(after)}
+    return query
+
+
+def build_projection(fields: Optional[Iterable[str]] = None) -> dict:
+    """Projection for ``fields`` (default: all export fields); raises ``ValueError`` on unknown names."""
+    fields = list(fields) if fields else list(EXPORT_FIELDS)
+    unknown = [f for f in fields if f not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    return {f: 1 for f in fields}
+
+
+def _encode(doc: dict) -> bytes:
+    doc["conversation_id"] = str(doc.pop("_id"))
+    return dumps(doc) + b"\n"
+
+
+async def export_batches(
+    coll,
+    query: dict,
+    projection: dict,
+    *,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    max_docs_per_second: float = EXPORT_MAX_DOCS_PER_SECOND,
+    read_preference: str = EXPORT_READ_PREFERENCE,
+) -> AsyncIterator[tuple]:
+    """Yield ``(ndjson_bytes, last_conversation_id, count)`` per cursor batch."""
+    if read_preference not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {read_preference}")
+    coll = coll.with_options(read_preference=READ_PREFERENCES[read_preference])
+    cursor = coll.find(query, projection).sort("_id", 1).batch_size(batch_size)
+    started = time.monotonic()
+    exported = 0
+    chunk = bytearray()
+    count = 0
+    last_id = None
+    try:
+        async for doc in cursor:
+            last_id = str(doc["_id"])
+            if "messages" in doc:
+                doc["messages"] = await templates.resolve(doc["messages"], coll.database)
+            chunk += _encode(doc)
+            count += 1
+            if count >= batch_size:
+                yield bytes(chunk), last_id, count
+                exported += count
+                chunk.clear()
+                count = 0
+                if max_docs_per_second > 0:
+                    ahead = exported / max_docs_per_second - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        if count:
+            yield bytes(chunk), last_id, count
+    finally:
+        await cursor.close()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def _read_checkpoint(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path: str, checkpoint: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+async def _main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from backend.services.db import MONGO_DB, MONGO_URI
+
+    checkpoint_path = f"{args.out}.checkpoint"
+    checkpoint = _read_checkpoint(checkpoint_path) if args.resume else None
+    after = checkpoint["after"] if checkpoint else None
+    exported = checkpoint["exported"] if checkpoint else 0
+    compress = args.out.endswith(".gz")
+
+    query = build_query(
+        agent=args.agent, country=args.country, language=args.language, user_id=args.user_id,
+        since=args.since, until=args.until, after=after,
+    )
+    projection = build_projection(args.fields.split(",") if args.fields else None)
+
+    if checkpoint is None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    client = AsyncIOMotorClient(MONGO_URI)
+    mode = "r+b" if checkpoint else "wb"
+    try:
+        with open(args.out, mode) as out:
+            if checkpoint:
+                # drop anything written after the last completed batch
+                out.truncate(checkpoint["size"])
+                out.seek(checkpoint["size"])
+            batches = export_batches(
+                client[MONGO_DB].conversations, query, projection,
+                batch_size=args.batch_size,
+                max_docs_per_second=args.max_docs_per_second,
+                read_preference=args.read_preference,
+            )
+            async for chunk, last_id, count in batches:
+                # one complete gzip member per batch, so a resumed file stays readable
+                out.write(zlib.compress(chunk, 6, 31) if compress else chunk)
+                out.flush()
+                exported += count
+                _write_checkpoint(checkpoint_path, {"after": last_id, "exported": exported, "size": out.tell()})
+    finally:
+        client.close()
+    print(json.dumps({"exported": exported, "out": args.out}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", required=True, help="output file; a .gz suffix gzips it")
+    parser.add_argument("--agent")
+    parser.add_argument("--country")
+    parser.add_argument("--language")
+    parser.add_argument("--user-id")
+    parser.add_argument("--since", type=_parse_date, help="ISO date, inclusive")
+    parser.add_argument("--until", type=_parse_date, help="ISO date, exclusive")
+    parser.add_argument("--fields", help=f"comma-separated subset of {','.join(EXPORT_FIELDS)}")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--max-docs-per-second", type=float, default=EXPORT_MAX_DOCS_PER_SECOND)
+    parser.add_argument("--read-preference", default=EXPORT_READ_PREFERENCE, choices=sorted(READ_PREFERENCES))
+    parser.add_argument("--resume", action="store_true", help="continue from <out>.checkpoint")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
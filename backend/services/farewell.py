@@ -0,0 +1,260 @@
+"""Speculative farewells for ``POST /conversations/{id}/end``.
+
+The chat page ends a conversation as soon as the goal checker reports every
+goal complete, so the farewell is predictable a turn ahead. Once a goal update
+leaves at most ``FAREWELL_SPECULATE_REMAINING`` goals open, the linked agent
+conversation is armed: its farewell (and the farewell's TTS audio) is
+generated in the background and kept here.
+
+A prepared farewell belongs to one state of its conversation. Every agent
+turn bumps the conversation's generation, which drops the prepared farewell
+and cancels one still being generated; when the turn completes on an armed
+conversation a fresh one is started. ``/end`` takes the farewell only if its
+generation is current, and stores it with the seq it was written for, so a
+turn from another worker still makes it fall back to generating one live.
+
+The cache is per worker and bounded (``FAREWELL_CACHE_SIZE`` conversations,
+``FAREWELL_TTL_SECONDS`` each). Speculation is skipped while upstream is
+degraded; the TTS part is skipped in text-only mode.
+"""
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+from typing import Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from backend.services.conversation import (
+    _get_client_for_agent,
+    generate_farewell,
+    stream_text_to_speech,
+)
+from backend.services.degradation import ASYNC_GOALS, TEXT_ONLY, degradation
+from backend.services.logs import bind
+from backend.services.rate_limit import admission_controller
+from backend.services.simulation import parse_goals
+from backend.services.usage import record_usage, token_usage
+from backend.services.voice_profiles import conversation_profiles
+
+load_dotenv()
+
+FAREWELL_SPECULATION_ENABLED = os.getenv("FAREWELL_SPECULATION_ENABLED", "true").lower() == "true"
+FAREWELL_SPECULATE_REMAINING = int(os.getenv("FAREWELL_SPECULATE_REMAINING", "1"))
+FAREWELL_TTS_ENABLED = os.getenv("FAREWELL_TTS_ENABLED", "true").lower() == "true"
+FAREWELL_CACHE_SIZE = int(os.getenv("FAREWELL_CACHE_SIZE", "1000"))
+FAREWELL_TTL_SECONDS = float(os.getenv("FAREWELL_TTL_SECONDS", "900"))
+
+
+class Farewell:
+    __slots__ = ("text", "seq", "generation", "audio", "audio_format", "created")
+
+    def __init__(self, text: str, seq: Optional[int], generation: int, audio: Optional[bytes], audio_format: Optional[str]):
+        self.text = text
+        self.seq = seq
+        self.generation = generation
+        self.audio = audio
+        self.audio_format = audio_format
+        self.created = time.monotonic()
+
+
+class _State:
+    __slots__ = ("generation", "armed", "farewell", "task", "db")
+
+    def __init__(self):
+        self.generation = 0
+        self.armed = False
+        self.farewell: Optional[Farewell] = None
+        self.task: Optional[asyncio.Task] = None
+        self.db = None
+
+
+def goals_near_completion(goal_reply: Optional[str]) -> bool:
+    goals = parse_goals(goal_reply)
+    if not goals:
+        return False
+    open_goals = sum(1 for g in goals if not (isinstance(g, dict) and g.get("completed")))
+    return open_goals <= FAREWELL_SPECULATE_REMAINING
+
+
+class FarewellCache:
+    def __init__(self, max_size: int = FAREWELL_CACHE_SIZE, ttl: float = FAREWELL_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        # agent conversation id -> _State, least recently touched first
+        self._states: "OrderedDict[str, _State]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _state(self, conversation_id: str) -> _State:
+        state = self._states.get(conversation_id)
+        if state is None:
+            state = self._states[conversation_id] = _State()
+            while len(self._states) > self.max_size:
+                _, evicted = self._states.popitem(last=False)
+                self._drop(evicted)
+        else:
+            self._states.move_to_end(conversation_id)
+        return state
+
+    def _drop(self, state: _State):
+        if state.task is not None and not state.task.done():
+            state.task.cancel()
+        state.task = None
+        state.farewell = None
+
+    def _fresh(self, farewell: Optional[Farewell]) -> bool:
+        return farewell is not None and time.monotonic() - farewell.created < self.ttl
+
+    # ---- lifecycle hooks (called by the conversation routes)
+
+    def observe_goals(self, goal_doc: dict, goal_reply: Optional[str], db):
+        """Arm the linked agent conversation when a goal update nears completion."""
+        if not FAREWELL_SPECULATION_ENABLED:
+            return
+        agent_conversation_id = (goal_doc.get("metadata") or {}).get("agent_conversation_id")
+        if agent_conversation_id and goals_near_completion(goal_reply):
+            self.arm(agent_conversation_id, db)
+
+    def arm(self, conversation_id: str, db):
+        state = self._state(conversation_id)
+        state.armed = True
+        state.db = db
+        self._speculate(conversation_id, state)
+
+    def invalidate(self, conversation_id: str):
+        """The conversation is moving on: drop its farewell and start a new generation."""
+        state = self._states.get(conversation_id)
+        if state is not None:
+            self._drop(state)
+            state.generation += 1
+
+    def turn_completed(self, conversation_id: str):
+        state = self._states.get(conversation_id)
+        if state is not None and state.armed:
+            self._speculate(conversation_id, state)
+
+    def finish(self, conversation_id: str):
+        """The conversation ended; keep its farewell only for the TTS request that follows."""
+        state = self._states.get(conversation_id)
+        if state is not None:
+            state.armed = False
+            state.generation += 1
+
+    # ---- speculation
+
+    def _speculate(self, conversation_id: str, state: _State):
+        if degradation.level >= ASYNC_GOALS:
+            # optional upstream work; not while upstream is slow
+            return
+        if state.task is not None and not state.task.done():
+            return
+        if self._fresh(state.farewell) and state.farewell.generation == state.generation:
+            return
+        # a fresh context: no request deadline, log binding or usage attribution carried over
+        state.task = asyncio.get_running_loop().create_task(
+            self._prepare(conversation_id, state.generation, state.db),
+            context=contextvars.Context(),
+        )
+        state.task.add_done_callback(lambda task: self._store(conversation_id, task))
+
+    async def _prepare(self, conversation_id: str, generation: int, db) -> Farewell:
+        doc = await db.conversations.find_one({"_id": ObjectId(conversation_id)}, {"agent": 1, "metadata": 1})
+        if not doc or not doc.get("agent"):
+            raise LookupError(f"Conversation {conversation_id} is not agent-backed")
+        agent = doc["agent"]
+        bind(conversation_id=conversation_id, agent=agent)
+        client = _get_client_for_agent(agent)
+        audio, audio_format = None, None
+        async with admission_controller.slot():
+            start = time.perf_counter()
+            text, seq, response = await generate_farewell(client, conversation_id, doc.get("metadata"), db=db)
+            calls = 1
+            if FAREWELL_TTS_ENABLED and text and degradation.level < TEXT_ONLY:
+                profile = await conversation_profiles.get(conversation_id, db)
+                audio_format = profile.audio_format
+                chunks = [
+                    chunk async for chunk in stream_text_to_speech(text, audio_format=audio_format, profile=profile)
+                ]
+                audio = b"".join(chunks)
+                calls += 1
+        prompt_tokens, completion_tokens = token_usage(response)
+        record_usage(
+            "farewell",
+            conversation_id=conversation_id,
+            agent=agent,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            tts_chars=len(text) if audio is not None else 0,
+            upstream_calls=calls,
+            upstream_ms=round((time.perf_counter() - start) * 1000, 1),
+        )
+        return Farewell(text, seq, generation, audio, audio_format)
+
+    def _store(self, conversation_id: str, task: asyncio.Task):
+        state = self._states.get(conversation_id)
+        if state is not None and state.task is task:
+            state.task = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.warning("Speculative farewell failed for %s: %s", conversation_id, task.exception())
+            return
+        farewell = task.result()
+        if state is None or farewell.generation != state.generation:
+            return
+        state.farewell = farewell
+
+    # ---- lookups
+
+    async def take(self, conversation_id: str) -> Optional[Farewell]:
+        """The prepared farewell for the conversation's current generation, if any.
+
+        A farewell still being generated for this generation is awaited; that
+        is still sooner than starting a new one.
+        """
+        state = self._states.get(conversation_id)
+        if state is None:
+            self.misses += 1
+            return None
+        farewell = state.farewell
+        if farewell is None and state.task is not None:
+            try:
+                farewell = await asyncio.shield(state.task)
+            except Exception:
+                farewell = None
+        if not self._fresh(farewell) or farewell.generation != state.generation:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return farewell
+
+    def audio(self, conversation_id: str, text: str, audio_format: str) -> Optional[bytes]:
+        """Prepared audio of the conversation's farewell, if it is ``text`` in ``audio_format``."""
+        state = self._states.get(conversation_id)
+        farewell = state.farewell if state is not None else None
+        if (
+            farewell is None
+            or not self._fresh(farewell)
+            or farewell.text != text
+            or farewell.audio_format != audio_format
+        ):
+            return None
+        return farewell.audio
+
+    def status(self) -> dict:
+        return {
+            "conversations": len(self._states),
+            "armed": sum(1 for s in self._states.values() if s.armed),
+            "prepared": sum(1 for s in self._states.values() if s.farewell is not None),
+            "in_flight": sum(1 for s in self._states.values() if s.task is not None and not s.task.done()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Module-level singleton used by the conversation and audio routes
+farewells = FarewellCache()
@@ -0,0 +1,203 @@
+"""Cross-session micro-batching of Gemini goal-evaluation prompts.
+
+Goal checks are small prompts that many sessions send at the same moment.
+``GoalBatcher.submit`` queues a prompt and returns that prompt's answer; the
+batcher collects prompts for up to the current batch window (or until
+``GOAL_BATCH_MAX_ITEMS`` are waiting) and sends them to Gemini as one
+structured multi-item request, then fans the answers back out.
+
+The window adapts to load: it widens while batches keep filling with more
+than one item and shrinks back towards ``GOAL_BATCH_MIN_WINDOW_MS`` when
+prompts arrive alone, so an idle worker adds no latency. A prompt that is
+alone in its batch is sent unchanged, and any item missing from a batched
+answer is retried on its own.
+
+A batched request is bounded by the latest deadline among its callers, and
+its token usage is split across the items by prompt and answer length.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from backend.services import cassette, providers
+from backend.services.cancellation import remaining
+from backend.services.json_stream import JSONExtractError, extract_json
+from backend.services.usage import token_usage
+
+load_dotenv()
+
+GOAL_BATCHING_ENABLED = os.getenv("GOAL_BATCHING_ENABLED", "false").lower() == "true"
+GOAL_BATCH_MAX_ITEMS = int(os.getenv("GOAL_BATCH_MAX_ITEMS", "16"))
+GOAL_BATCH_MIN_WINDOW_MS = float(os.getenv("GOAL_BATCH_MIN_WINDOW_MS", "0"))
+GOAL_BATCH_MAX_WINDOW_MS = float(os.getenv("GOAL_BATCH_MAX_WINDOW_MS", "25"))
+
+BATCH_PROMPT_HEADER = """You will receive {count} independent tasks, each inside <task id="..."> tags.
+Answer every task exactly as its own instructions ask. Tasks are unrelated; never let one influence another.
+Return ONLY a JSON object mapping each task id (as a string) to that task's answer, where the answer is the JSON value the task asks for.
+"""
+
+
+def build_batch_prompt(prompts: list) -> str:
+    parts = [BATCH_PROMPT_HEADER.format(count=len(prompts))]
+    for i, prompt in enumerate(prompts):
+        parts.append(f'<task id="{i}">\n{prompt.strip()}\n</task>')
+    return "\n\n".join(parts)
+
+
+def split_usage(usage: tuple, prompts: list, answers: list) -> list:
+    """Share a batched call's ``(prompt_tokens, completion_tokens)`` across its items."""
+    prompt_tokens, completion_tokens = usage
+    prompt_chars = sum(len(p) for p in prompts) or 1
+    answer_chars = sum(len(a) for a in answers) or 1
+    return [
+        (round(prompt_tokens * len(p) / prompt_chars), round(completion_tokens * len(a) / answer_chars))
+        for p, a in zip(prompts, answers)
+    ]
+
+
+def split_batch_answer(text: str, count: int) -> dict:
+    """Map task index -> answer text; unparseable or missing items are left out."""
+    try:
+        data = extract_json(text, dict)
+    except JSONExtractError:
+        return {}
+    answers = {}
+    for i in range(count):
+        if str(i) in data:
+            value = data[str(i)]
+            answers[i] = value if isinstance(value, str) else json.dumps(value)
+    return answers
+
+
+class GoalBatcher:
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        max_items: int = GOAL_BATCH_MAX_ITEMS,
+        min_window_ms: float = GOAL_BATCH_MIN_WINDOW_MS,
+        max_window_ms: float = GOAL_BATCH_MAX_WINDOW_MS,
+    ):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.min_window = min_window_ms / 1000
+        self.max_window = max_window_ms / 1000
+        self.window = self.min_window
+        self._model = None
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # in-flight batch requests, referenced until they finish
+        self._sending: set = set()
+
+    def _get_model(self):
+        if self._model is None:
+            self._model = providers.genai().GenerativeModel(self.model_name)
+        return self._model
+
+    async def submit(self, prompt: str) -> tuple:
+        """Queue a goal-evaluation prompt; returns ``(answer text, (prompt_tokens, completion_tokens))``."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # batches are sent outside the caller's request, so its deadline travels with the prompt
+        left = remaining()
+        deadline = time.monotonic() + left if left is not None else None
+        self._pending.append((prompt, future, deadline))
+        if len(self._pending) >= self.max_items:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[: self.max_items], self._pending[self.max_items:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._dispatch)
+        if batch:
+            self._adapt(len(batch))
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    def _adapt(self, batch_size: int):
+        if batch_size > 1:
+            self.window = min(self.max_window, max(self.window * 2, 0.002))
+        else:
+            self.window = self.window / 2
+            if self.window < 0.001:
+                self.window = self.min_window
+
+    async def _generate(self, prompt: str, deadlines: list, *, json_mode: bool = False):
+        generation_config = {"response_mime_type": "application/json"} if json_mode else None
+        timeout = None
+        if deadlines and None not in deadlines:
+            # callers with earlier deadlines stop waiting on their own
+            timeout = max(deadlines) - time.monotonic()
+            if timeout <= 0:
+                raise asyncio.TimeoutError("Goal check deadline passed before it was sent")
+        return await cassette.gemini_generate(
+            self._get_model(),
+            prompt,
+            generation_config=generation_config,
+            request_options={"timeout": timeout} if timeout else None,
+        )
+
+    async def _send(self, batch: list):
+        # callers that went away (disconnect, deadline) no longer need an answer
+        live = [item for item in batch if not item[1].done()]
+        if not live:
+            return
+        if len(live) == 1:
+            await self._send_single(*live[0])
+            return
+
+        prompts = [prompt for prompt, _, _ in live]
+        answers = {}
+        try:
+            response = await self._generate(
+                build_batch_prompt(prompts), [deadline for _, _, deadline in live], json_mode=True
+            )
+            answers = split_batch_answer(response.text, len(live))
+        except Exception:
+            logging.exception("Batched goal evaluation of %d items failed; retrying individually", len(live))
+        if answers:
+            answered = sorted(answers)
+            shares = dict(zip(answered, split_usage(
+                token_usage(response), [prompts[i] for i in answered], [answers[i] for i in answered]
+            )))
+        retries = []
+        for i, (prompt, future, deadline) in enumerate(live):
+            if i in answers:
+                if not future.done():
+                    future.set_result((answers[i], shares[i]))
+            else:
+                retries.append(self._send_single(prompt, future, deadline))
+        if retries:
+            await asyncio.gather(*retries)
+
+    async def _send_single(self, prompt: str, future: asyncio.Future, deadline: Optional[float]):
+        try:
+            response = await self._generate(prompt, [deadline])
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result((response.text, token_usage(response)))
+
+
+_batchers: dict = {}
+
+
+def get_goal_batcher(model_name: str) -> GoalBatcher:
+    batcher = _batchers.get(model_name)
+    if batcher is None:
+        batcher = _batchers[model_name] = GoalBatcher(model_name)
+    return batcher
@@ -0,0 +1,135 @@
+"""Short-lived store backing the ``Idempotency-Key`` request header.
+
+The first request for a key runs normally and its result is kept for
+``IDEMPOTENCY_TTL_SECONDS``. Repeats within that window get the stored result,
+and a repeat that arrives while the first is still running awaits the same
+in-flight task instead of calling the upstream provider again. Failures are
+not cached, so a client can retry a request that errored.
+
+The store is per process; retries routed to a different worker are not
+deduplicated.
+"""
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+class IdempotencyKeyReuseError(ValueError):
+    """The key was already used for a request with a different payload."""
+
+
+def fingerprint(*parts) -> str:
+    """Hash the request fields that must match for a key to be reused."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("expires_at", "fingerprint", "task", "waiters")
+
+    def __init__(self, expires_at: float, fingerprint: Optional[str], task: asyncio.Task):
+        self.expires_at = expires_at
+        self.fingerprint = fingerprint
+        self.task = task
+        self.waiters = 0
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # insertion order == expiry order
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            if not entry.task.done() and entry.expires_at > now:
+                # never drop an in-flight entry just to make room
+                break
+            del self._entries[key]
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable],
+        request_fingerprint: Optional[str] = None,
+        *,
+        on_replay: Optional[Callable[[], None]] = None,
+    ):
+        """Return the stored result for ``key`` or compute it with ``fn``.
+
+        The work runs in its own task shared by every caller with the same
+        key. It is cancelled only once all attached callers have gone away,
+        so a retry that attached to an abandoned request still gets a result.
+        """
+        self._purge()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if request_fingerprint is not None and entry.fingerprint != request_fingerprint:
+                raise IdempotencyKeyReuseError("Idempotency-Key was already used with a different request")
+            if on_replay is not None:
+                on_replay()
+        else:
+            entry = _Entry(time.monotonic() + self.ttl, request_fingerprint, asyncio.ensure_future(fn()))
+            self._entries[key] = entry
+            entry.task.add_done_callback(lambda task: self._on_done(key, task))
+
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if entry.waiters == 1 and not entry.task.done():
+                entry.task.cancel()
+            raise
+        finally:
+            entry.waiters -= 1
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        # failures are not cached, so the client can retry
+        if task.cancelled() or task.exception() is not None:
+            entry = self._entries.get(key)
+            if entry is not None and entry.task is task:
+                del self._entries[key]
+
+
+# Module-level singleton shared by the routes
+idempotency_store = IdempotencyStore()
+
+
+async def run_idempotent(
+    key: Optional[str],
+    scope: str,
+    fn: Callable[[], Awaitable],
+    *fingerprint_parts,
+    on_replay: Optional[Callable[[], None]] = None,
+):
+    """Route helper: run ``fn`` directly when no key was sent, else dedupe on it.
+
+    ``on_replay`` is called when the result comes from an earlier request.
+    """
+    if not key:
+        return await fn()
+    try:
+        return await idempotency_store.run(
+            f"{scope}:{key}", fn, fingerprint(*fingerprint_parts), on_replay=on_replay
+        )
+    except IdempotencyKeyReuseError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
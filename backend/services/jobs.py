@@ -0,0 +1,385 @@
+"""Durable background jobs in the ``jobs`` collection.
+
+Work that must not block a response but should not die with the worker
+(agent warm-up calls, deferred goal checks, audio retention sweeps) is
+enqueued here instead of run in a fire-and-forget task.
+
+Job types are registered with ``register(name, handler, concurrency=...,
+max_attempts=..., backoff_seconds=...)``; a handler is ``async def
+handler(payload: dict, db)``. ``enqueue`` inserts a job; with a ``dedup_key`` at
+most one queued or running job per (type, key) exists, later enqueues return
+the existing one.
+
+Every worker runs one claim loop per registered type, holding at most
+``concurrency`` jobs of that type at a time. A job is claimed with a lease
+(``JOBS_LEASE_SECONDS``) that is renewed while its handler runs; a job whose
+worker died is claimed again once its lease expires, so several uvicorn
+workers share the queue safely. Failed jobs are retried with exponential
+backoff (plus jitter) until ``max_attempts``, then kept as ``failed``; a job
+whose lease expired after its last attempt is failed rather than run again,
+so handlers that are not idempotent can set ``max_attempts=1``.
+Finished jobs expire after ``JOBS_RETENTION_SECONDS``.
+
+With ``JOBS_ENABLED=false`` ``enqueue`` runs the handler in a local task,
+passing the database given to ``start_job_runner``; enqueueing before
+``start_job_runner`` raises ``RuntimeError``.
+"""
+import os
+import socket
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+load_dotenv()
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "60"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", "86400"))
+JOBS_DRAIN_TIMEOUT = float(os.getenv("JOBS_DRAIN_TIMEOUT", "10"))
+JOBS_LATENCY_WINDOW = int(os.getenv("JOBS_LATENCY_WINDOW", "500"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobType(NamedTuple):
+    name: str
+    handler: Callable[[dict, object], Awaitable]
+    concurrency: int = 4
+    max_attempts: int = 5
+    backoff_seconds: float = 2.0
+    max_backoff_seconds: float = 300.0
+
+
+_types: dict = {}
+# Strong references to local fallback runs
+_local: set = set()
+
+
+def register(
+    name: str,
+    handler: Callable[[dict, object], Awaitable],
+    *,
+    concurrency: int = 4,
+    max_attempts: int = 5,
+    backoff_seconds: float = 2.0,
+    max_backoff_seconds: float = 300.0,
+) -> JobType:
+    job_type = JobType(name, handler, concurrency, max_attempts, backoff_seconds, max_backoff_seconds)
+    _types[name] = job_type
+    return job_type
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 1)
+
+
+class JobRunner:
+    def __init__(self, db, worker_id: Optional[str] = None):
+        self._db = db
+        self._coll = db.jobs
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._loops: list = []
+        self._running: dict = {}  # job _id -> (type, task)
+        self._wake: dict = {}  # type -> asyncio.Event
+        self._slots: dict = {}  # type -> asyncio.Semaphore
+        # per type: recent (queue wait ms, run ms)
+        self._latency: dict = {}
+        self.completed: dict = {}
+        self.failed: dict = {}
+        self.retried: dict = {}
+
+    async def _ensure_indexes(self):
+        await self._coll.create_index([("type", 1), ("status", 1), ("run_at", 1)])
+        await self._coll.create_index([("status", 1), ("lease_until", 1)])
+        # present only while a job is queued or running
+        await self._coll.create_index("active_key", unique=True, sparse=True)
+        await self._coll.create_index("expire_at", expireAfterSeconds=0)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._loops.append(loop.create_task(self._start()))
+
+    async def _start(self):
+        try:
+            await self._ensure_indexes()
+        except Exception:
+            logging.exception("Creating job indexes failed")
+        loop = asyncio.get_running_loop()
+        for job_type in list(_types.values()):
+            self._wake[job_type.name] = asyncio.Event()
+            self._slots[job_type.name] = asyncio.Semaphore(job_type.concurrency)
+            self._loops.append(loop.create_task(self._claim_loop(job_type)))
+
+    # ---- producing
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Optional[dict] = None,
+        *,
+        dedup_key: Optional[str] = None,
+        delay: float = 0.0,
+    ) -> str:
+        """Queue a job; returns its id (the existing job's id when deduplicated)."""
+        if job_type not in _types:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = datetime.utcnow()
+        doc = {
+            "type": job_type,
+            "payload": payload or {},
+            "status": QUEUED,
+            "attempts": 0,
+            "created_at": now,
+            "run_at": now + timedelta(seconds=delay),
+        }
+        if dedup_key is None:
+            result = await self._coll.insert_one(doc)
+            job_id = result.inserted_id
+        else:
+            active_key = f"{job_type}:{dedup_key}"
+            doc["dedup_key"] = dedup_key
+            try:
+                existing = await self._coll.find_one_and_update(
+                    {"active_key": active_key},
+                    {"$setOnInsert": {**doc, "active_key": active_key}},
+                    upsert=True,
+                    projection={"_id": 1},
+                    return_document=ReturnDocument.AFTER,
+                )
+                job_id = existing["_id"]
+            except DuplicateKeyError:
+                # a concurrent enqueue with the same key won
+                existing = await self._coll.find_one({"active_key": active_key}, {"_id": 1})
+                job_id = existing["_id"] if existing else None
+        wake = self._wake.get(job_type)
+        if wake is not None and delay <= 0:
+            wake.set()
+        return str(job_id)
+
+    # ---- consuming
+
+    async def _claim(self, job_type: JobType) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self._coll.find_one_and_update(
+            {
+                "type": job_type.name,
+                "$or": [
+                    {"status": QUEUED, "run_at": {"$lte": now}},
+                    # the worker holding it died
+                    {"status": RUNNING, "lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "lease_owner": self.worker_id,
+                    "lease_until": now + timedelta(seconds=JOBS_LEASE_SECONDS),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _claim_loop(self, job_type: JobType):
+        slots = self._slots[job_type.name]
+        wake = self._wake[job_type.name]
+        while True:
+            await slots.acquire()
+            try:
+                job = await self._claim(job_type)
+            except Exception:
+                logging.exception("Claiming %s job failed", job_type.name)
+                job = None
+            if job is None:
+                slots.release()
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=JOBS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.get_running_loop().create_task(self._run(job_type, job))
+            self._running[job["_id"]] = (job_type.name, task)
+            task.add_done_callback(lambda _, job_id=job["_id"]: self._finished(job_id, slots))
+
+    def _finished(self, job_id, slots: asyncio.Semaphore):
+        self._running.pop(job_id, None)
+        slots.release()
+
+    async def _renew(self, job_id):
+        while True:
+            await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+            await self._coll.update_one(
+                {"_id": job_id, "lease_owner": self.worker_id},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=JOBS_LEASE_SECONDS)}},
+            )
+
+    async def _run(self, job_type: JobType, job: dict):
+        if job["attempts"] > job_type.max_attempts:
+            # its last attempt died with its worker
+            await self._settle(job_type, job, "lease expired")
+            return
+        wait_ms = max((job["started_at"] - job["run_at"]).total_seconds() * 1000, 0.0)
+        renew = asyncio.get_running_loop().create_task(self._renew(job["_id"]))
+        start = time.perf_counter()
+        error = None
+        try:
+            await job_type.handler(job.get("payload") or {}, self._db)
+        except asyncio.CancelledError:
+            # shutting down: hand the job back instead of counting an attempt
+            renew.cancel()
+            await self._coll.update_one(
+                {"_id": job["_id"], "lease_owner": self.worker_id},
+                {"$set": {"status": QUEUED, "run_at": datetime.utcnow()}, "$inc": {"attempts": -1},
+                 "$unset": {"lease_owner": "", "lease_until": ""}},
+            )
+            raise
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            logging.warning("Job %s (%s) failed: %s", job["_id"], job_type.name, error)
+        finally:
+            renew.cancel()
+        run_ms = (time.perf_counter() - start) * 1000
+        self._latency.setdefault(job_type.name, deque(maxlen=JOBS_LATENCY_WINDOW)).append((wait_ms, run_ms))
+        await self._settle(job_type, job, error)
+
+    async def _settle(self, job_type: JobType, job: dict, error: Optional[str]):
+        now = datetime.utcnow()
+        owned = {"_id": job["_id"], "lease_owner": self.worker_id}
+        if error is None:
+            self.completed[job_type.name] = self.completed.get(job_type.name, 0) + 1
+            await self._coll.update_one(owned, {
+                "$set": {"status": DONE, "finished_at": now, "expire_at": now + timedelta(seconds=JOBS_RETENTION_SECONDS)},
+                "$unset": {"active_key": "", "lease_owner": "", "lease_until": "", "last_error": ""},
+            })
+        elif job["attempts"] < job_type.max_attempts:
+            self.retried[job_type.name] = self.retried.get(job_type.name, 0) + 1
+            backoff = min(job_type.backoff_seconds * 2 ** (job["attempts"] - 1), job_type.max_backoff_seconds)
+            backoff *= random.uniform(0.8, 1.2)
+            await self._coll.update_one(owned, {
+                "$set": {"status": QUEUED, "run_at": now + timedelta(seconds=backoff), "last_error": error},
+                "$unset": {"lease_owner": "", "lease_until": ""},
+            })
+        else:
+            self.failed[job_type.name] = self.failed.get(job_type.name, 0) + 1
+            await self._coll.update_one(owned, {
+                "$set": {"status": FAILED, "finished_at": now, "last_error": error,
+                         "expire_at": now + timedelta(seconds=JOBS_RETENTION_SECONDS)},
+                "$unset": {"active_key": "", "lease_owner": "", "lease_until": ""},
+            })
+
+    # ---- monitoring
+
+    async def status(self) -> dict:
+        """Queue depth per type and status (shared), plus this worker's latency and outcomes."""
+        now = datetime.utcnow()
+        pipeline = [
+            {"$match": {"status": {"$in": [QUEUED, RUNNING, FAILED]}}},
+            {"$group": {
+                "_id": {"type": "$type", "status": "$status"},
+                "count": {"$sum": 1},
+                "ready": {"$sum": {"$cond": [{"$lte": ["$run_at", now]}, 1, 0]}},
+                "oldest_run_at": {"$min": "$run_at"},
+            }},
+        ]
+        types: dict = {name: {"queued": 0, "ready": 0, "running": 0, "failed": 0} for name in _types}
+        async for row in self._coll.aggregate(pipeline):
+            entry = types.setdefault(row["_id"]["type"], {"queued": 0, "ready": 0, "running": 0, "failed": 0})
+            entry[row["_id"]["status"]] = row["count"]
+            if row["_id"]["status"] == QUEUED:
+                entry["ready"] = row["ready"]
+                if row["ready"]:
+                    entry["oldest_ready_age_s"] = round(max((now - row["oldest_run_at"]).total_seconds(), 0), 1)
+        for name, entry in types.items():
+            samples = self._latency.get(name) or ()
+            waits = [w for w, _ in samples]
+            runs = [r for _, r in samples]
+            job_type = _types.get(name)
+            entry["worker"] = {
+                "concurrency": job_type.concurrency if job_type else 0,
+                "in_flight": sum(1 for type_name, _ in self._running.values() if type_name == name),
+                "completed": self.completed.get(name, 0),
+                "retried": self.retried.get(name, 0),
+                "failed": self.failed.get(name, 0),
+                "wait_ms": {"p50": _percentile(waits, 0.5), "p95": _percentile(waits, 0.95)},
+                "run_ms": {"p50": _percentile(runs, 0.5), "p95": _percentile(runs, 0.95)},
+            }
+        return {"worker_id": self.worker_id, "types": types}
+
+    async def close(self, timeout: float = JOBS_DRAIN_TIMEOUT):
+        for loop_task in self._loops:
+            loop_task.cancel()
+        self._loops = []
+        running = [task for _, task in self._running.values()]
+        if running:
+            # give handlers a moment to finish, then hand the rest back to the queue
+            _, pending = await asyncio.wait(running, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Module-level singleton, created by init_db
+_runner: Optional[JobRunner] = None
+# The database handlers get, also without a runner
+_db = None
+
+
+def start_job_runner(db) -> Optional[JobRunner]:
+    global _runner, _db
+    _db = db
+    if JOBS_ENABLED and _runner is None:
+        _runner = JobRunner(db)
+        _runner.start()
+    return _runner
+
+
+def get_job_runner() -> Optional[JobRunner]:
+    return _runner
+
+
+async def enqueue(job_type: str, payload: Optional[dict] = None, *, dedup_key: Optional[str] = None, delay: float = 0.0):
+    """Queue a job with the running runner, or run it in a local task without one."""
+    if _runner is not None:
+        return await _runner.enqueue(job_type, payload, dedup_key=dedup_key, delay=delay)
+    if job_type not in _types:
+        raise ValueError(f"Unknown job type: {job_type}")
+    if _db is None:
+        raise RuntimeError("start_job_runner(db) must be called before jobs are enqueued")
+    db = _db
+
+    async def run_local():
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await _types[job_type].handler(payload or {}, db)
+        except Exception:
+            logging.exception("Local %s job failed", job_type)
+
+    task = asyncio.get_running_loop().create_task(run_local())
+    _local.add(task)
+    task.add_done_callback(_local.discard)
+    return None
+
+
+async def stop_job_runner():
+    global _runner, _db
+    if _runner is not None:
+        await _runner.close()
+        _runner = None
+    _db = None
@@ -0,0 +1,249 @@
+"""Incremental JSON extraction from model output.
+
+Model replies wrap their JSON in prose or Markdown code fences, and sometimes
+leave a trailing comma before a closing bracket. ``JSONExtractor`` consumes a
+reply chunk by chunk: it skips everything before the first ``{`` or ``[``,
+parses that value (tolerating trailing and doubled commas), and ignores
+everything after it closes, fences included. Nested values are kept whole,
+unlike a regex match. A bracket that turns out not to start JSON before any
+of its content is parsed (``"the goals [updated]: {...}"``) is skipped, and
+the search resumes right after it.
+
+Every value completed at a depth up to ``emit_depth`` is returned by ``feed``
+as ``(path, value)``, so a caller reading a streamed reply sees e.g. each goal
+(``("goals", 0)``) as soon as its closing brace arrives. ``close`` returns
+the whole value, validated against ``schema`` (any type pydantic's
+``TypeAdapter`` accepts) when one is given.
+
+    extractor = JSONExtractor(GoalState)
+    for chunk in chunks:
+        for path, value in extractor.feed(chunk):
+            ...
+    state = extractor.close()
+
+``extract_json(text, schema)`` is the one-shot form.
+"""
+import re
+import json
+from typing import Any, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+_MISSING = object()
+_WHITESPACE = " \t\r\n"
+_START = re.compile(r"[\[{]")
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_SCALAR_PREFIX = re.compile(r"-?[\d.eE+-]*|t(?:r(?:ue?)?)?|f(?:a(?:l(?:se?)?)?)?|n(?:u(?:ll?)?)?")
+
+# expecting a key / a colon / a value / a comma or the closing bracket
+KEY, COLON, VALUE, NEXT = range(4)
+
+
+class JSONExtractError(ValueError):
+    pass
+
+
+class _Frame:
+    __slots__ = ("container", "path", "key", "state")
+
+    def __init__(self, container, path: tuple):
+        self.container = container
+        self.path = path
+        self.key = None
+        self.state = KEY if isinstance(container, dict) else VALUE
+
+
+class JSONExtractor:
+    def __init__(self, schema: Any = None, emit_depth: int = 2):
+        self._adapter = TypeAdapter(schema) if schema is not None else None
+        self.emit_depth = emit_depth
+        self._buf = ""
+        self._stack: list = []
+        self._root = _MISSING
+        self._error: Optional[str] = None
+        # text after the open top-level bracket, kept until the value has content
+        self._content = False
+        self._retry = ""
+
+    @property
+    def done(self) -> bool:
+        """The top-level value has closed (or the input is not JSON); further input is ignored."""
+        return self._root is not _MISSING or self._error is not None
+
+    @property
+    def partial(self):
+        """The top-level value as parsed so far (open containers included), or None."""
+        if self._root is not _MISSING:
+            return self._root
+        return self._stack[0].container if self._stack else None
+
+    def feed(self, chunk: str) -> list:
+        """Consume ``chunk``; returns the ``(path, value)`` pairs it completed."""
+        if self.done:
+            return []
+        self._buf += chunk
+        events: list = []
+        self._consume(events, final=False)
+        return events
+
+    def close(self):
+        """End of input: the complete value, validated against the schema.
+
+        Raises ``JSONExtractError`` when no complete JSON value was found or it
+        does not match the schema.
+        """
+        if not self.done:
+            self._consume([], final=True)
+        if self._error is not None:
+            raise JSONExtractError(self._error)
+        if self._root is _MISSING:
+            raise JSONExtractError("No JSON value found" if not self._stack else "Incomplete JSON value")
+        if self._adapter is None:
+            return self._root
+        try:
+            return self._adapter.validate_python(self._root)
+        except ValidationError as exc:
+            raise JSONExtractError(f"JSON does not match the schema: {exc}") from exc
+
+    # ---- parsing
+
+    def _consume(self, events: list, final: bool):
+        buf = self._buf
+        while True:
+            i, start = self._scan(buf, events, final)
+            if self._error is None or self._root is not _MISSING or self._content:
+                break
+            # the bracket opened nothing but prose ("goals [updated]: {...}"):
+            # drop it and look for the next one right after it
+            buf = self._retry + buf[start:]
+            self._stack, self._error, self._retry = [], None, ""
+        if self.done:
+            self._buf = ""
+            return
+        if self._stack and not self._content:
+            self._retry += buf[start:i]
+        self._buf = buf[i:]
+
+    def _scan(self, buf: str, events: list, final: bool) -> tuple:
+        """Parse ``buf`` until it runs out or the root closes.
+
+        Returns the offset reached and the offset in ``buf`` where the text
+        after the top-level bracket begins.
+        """
+        i, n, start = 0, len(buf), 0
+        while i < n and not self.done:
+            if not self._stack:
+                match = _START.search(buf, i)
+                if match is None:
+                    i = n
+                    break
+                self._open({} if match.group() == "{" else [], ())
+                self._content, self._retry = False, ""
+                i = start = match.end()
+                continue
+
+            c = buf[i]
+            if c in _WHITESPACE:
+                i += 1
+                continue
+            frame = self._stack[-1]
+            if c == "}" or c == "]":
+                if (c == "}") != isinstance(frame.container, dict):
+                    self._error = f"Mismatched {c!r} at offset {i}"
+                    break
+                # closing after a comma (a trailing comma) is accepted
+                if frame.state == COLON or (frame.state == VALUE and frame.key is not None):
+                    self._error = f"Missing value before {c!r}"
+                    break
+                self._stack.pop()
+                self._complete(frame.container, frame.path, events)
+                i += 1
+            elif c == ",":
+                # repeated commas are skipped like a trailing one
+                if frame.state == NEXT:
+                    frame.state = KEY if isinstance(frame.container, dict) else VALUE
+                i += 1
+            elif c == ":":
+                if frame.state != COLON:
+                    self._error = f"Unexpected ':' at offset {i}"
+                    break
+                frame.state = VALUE
+                i += 1
+            elif c == '"':
+                match = _STRING.match(buf, i)
+                if match is None:
+                    break  # the string continues in the next chunk
+                value = json.loads(match.group())
+                i = match.end()
+                if frame.state == KEY:
+                    frame.key = value
+                    frame.state = COLON
+                    self._content = True
+                elif frame.state == VALUE:
+                    self._complete(value, self._child_path(frame), events)
+                else:
+                    self._error = f"Unexpected string at offset {match.start()}"
+            elif frame.state != VALUE:
+                self._error = f"Unexpected {c!r} at offset {i}"
+            elif c == "{" or c == "[":
+                self._open({} if c == "{" else [], self._child_path(frame))
+                i += 1
+            else:
+                match = _SCALAR.match(buf, i)
+                if match is not None and (match.end() < n or final):
+                    self._complete(json.loads(match.group()), self._child_path(frame), events)
+                    i = match.end()
+                elif not final and _SCALAR_PREFIX.fullmatch(buf, i):
+                    break  # a number or literal cut off by the chunk boundary
+                else:
+                    self._error = f"Unexpected {c!r} at offset {i}"
+        return i, start
+
+    def _child_path(self, frame: _Frame) -> tuple:
+        if isinstance(frame.container, dict):
+            return frame.path + (frame.key,)
+        return frame.path + (len(frame.container),)
+
+    def _open(self, container, path: tuple):
+        if self._stack:
+            self._attach(self._stack[-1], container)
+        self._stack.append(_Frame(container, path))
+
+    def _attach(self, frame: _Frame, value):
+        if isinstance(frame.container, dict):
+            frame.container[frame.key] = value
+            frame.key = None
+        else:
+            frame.container.append(value)
+        frame.state = NEXT
+
+    def _complete(self, value, path: tuple, events: list):
+        """``value`` at ``path`` is whole: attach scalars to their parent and report it."""
+        self._content = True
+        if not isinstance(value, (dict, list)) and self._stack:
+            self._attach(self._stack[-1], value)
+        if not self._stack and isinstance(value, (dict, list)) and path == ():
+            self._root = value
+        if len(path) <= self.emit_depth:
+            events.append((path, value))
+
+
+_decoder = json.JSONDecoder()
+
+
+def extract_json(text: Optional[str], schema: Any = None):
+    """The first JSON value in ``text``, validated against ``schema``; raises ``JSONExtractError``."""
+    extractor = JSONExtractor(schema, emit_depth=-1)
+    match = _START.search(text or "")
+    if match is not None:
+        # well-formed replies are decoded in one pass by the C scanner
+        try:
+            value, _ = _decoder.raw_decode(text, match.start())
+        except ValueError:
+            pass
+        else:
+            extractor._root = value
+            return extractor.close()
+    extractor.feed(text or "")
+    return extractor.close()
@@ -0,0 +1,199 @@
+"""Structured, non-blocking, sampled logging.
+
+``configure_logging`` routes the root logger through a bounded in-memory
+queue; a ``QueueListener`` thread formats and writes the records, so a log
+call on the request path never waits on stdout. When the queue is full new
+records are dropped (and counted) rather than blocking.
+
+Records are JSON lines (``LOG_FORMAT=text`` for local reading) and carry the
+fields bound for the current task with ``log_context`` / ``bind``:
+``conversation_id``, ``agent`` and ``stage``. Large values go in the
+``payload`` extra, e.g. ``logging.debug("Gemini reply", extra={"payload":
+{"reply": text}})``; they are redacted to their length
+(``LOG_REDACT_PAYLOADS=true``, the default) or truncated to
+``LOG_PAYLOAD_CHARS`` before they enter the queue. Credential-like keys are
+always masked.
+
+``LOG_SAMPLE_RATES`` keeps a fraction of records per level, e.g.
+``"DEBUG=0.01,INFO=0.2"``; levels not listed are always kept.
+"""
+import os
+import re
+import sys
+import functools
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "200"))
+LOG_MESSAGE_CHARS = int(os.getenv("LOG_MESSAGE_CHARS", "2000"))
+LOG_REDACT_PAYLOADS = os.getenv("LOG_REDACT_PAYLOADS", "true").lower() == "true"
+LOG_SAMPLE_RATES = {
+    level.strip().upper(): float(rate)
+    for level, rate in (
+        item.split("=", 1) for item in os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.1").split(",") if "=" in item
+    )
+}
+
+CONTEXT_FIELDS = ("conversation_id", "agent", "stage")
+_SECRET_KEY = re.compile(r"(api[-_]?key|authorization|token|secret|password)", re.IGNORECASE)
+
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+_listener: Optional[logging.handlers.QueueListener] = None
+dropped_records = 0
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach ``fields`` to every record logged inside the block."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**fields):
+    """Attach ``fields`` for the rest of the current task."""
+    _context.set({**_context.get(), **fields})
+
+
+def logged_stage(stage: str):
+    """Decorator running an async function inside ``log_context(stage=stage)``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with log_context(stage=stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+def scrub(value, key: str = ""):
+    """Redacted or truncated copy of a payload value."""
+    if key and _SECRET_KEY.search(key):
+        return "<masked>"
+    if isinstance(value, dict):
+        return {k: scrub(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if LOG_REDACT_PAYLOADS:
+            return f"<redacted {len(value)} items>"
+        return [scrub(v) for v in value[:10]] + ([f"... ({len(value)} items)"] if len(value) > 10 else [])
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        return f"<redacted {len(value)} chars>" if LOG_REDACT_PAYLOADS else _truncate(value, LOG_PAYLOAD_CHARS)
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = LOG_SAMPLE_RATES.get(record.levelname)
+        return rate is None or rate >= 1 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Captures task context and shrinks the record before it is queued."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        for field, value in _context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        record.msg = _truncate(record.getMessage(), LOG_MESSAGE_CHARS)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            record.payload = scrub(payload)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.msg,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            entry["payload"] = payload
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        context = " ".join(
+            f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None) is not None
+        )
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.msg}"
+        if context:
+            line += f" [{context}]"
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            line += f" {payload}"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def configure_logging():
+    """Install the queue handler on the root logger (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JSONFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records; called on shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
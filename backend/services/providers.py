@@ -0,0 +1,72 @@
+"""Lazy access to provider SDKs.
+
+``openai``, ``google.generativeai`` (grpc + protobuf) and ``aiohttp`` together
+take seconds to import, so they are loaded on first use or by ``warm_up`` after
+the worker has started, instead of at module import. Import cost is recorded
+in the startup timing report.
+"""
+import os
+import time
+import importlib
+import threading
+
+from dotenv import load_dotenv
+
+from backend.services import startup
+
+load_dotenv()
+
+PROVIDER_MODULES = ("aiohttp", "openai", "google.generativeai")
+
+_modules: dict = {}
+_lock = threading.Lock()
+_gemini_key = None
+
+
+def load(name: str):
+    module = _modules.get(name)
+    if module is None:
+        # warm_up may be importing from a worker thread at the same time
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(name)
+                startup.record(f"import {name}", time.perf_counter() - start)
+                _modules[name] = module
+    return module
+
+
+def install(name: str, module):
+    """Serve ``name`` from ``module`` instead of importing it.
+
+    Used by the simulation runner to put local stand-ins behind the real
+    service code; not meant for a serving worker.
+    """
+    with _lock:
+        _modules[name] = module
+
+
+def openai():
+    return load("openai")
+
+
+def aiohttp():
+    return load("aiohttp")
+
+
+def genai():
+    """Return ``google.generativeai`` configured with ``GEMINI_API_KEY``."""
+    global _gemini_key
+    module = load("google.generativeai")
+    key = os.getenv("GEMINI_API_KEY")
+    if key and key != _gemini_key:
+        module.configure(api_key=key)
+        _gemini_key = key
+    return module
+
+
+def warm_up():
+    """Import every provider SDK; run off the event loop during startup."""
+    for name in PROVIDER_MODULES:
+        load(name)
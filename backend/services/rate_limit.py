@@ -0,0 +1,195 @@
+"""Per-client rate limiting and global admission control for upstream-heavy routes.
+
+Each client (an authenticated user, else the client IP) gets token buckets with
+separate budgets for LLM turns, TTS characters and STT audio seconds. Budgets
+are configured as ``"<capacity>/<seconds>"``: the bucket holds ``capacity``
+tokens and refills fully over ``seconds``. An exhausted bucket answers 429
+with ``Retry-After`` set to when enough tokens will be back.
+
+Buckets live in process memory by default. ``RATE_LIMIT_BACKEND=mongo`` keeps
+them in the ``rate_limits`` collection, updated with a single atomic pipeline
+update per check, so every uvicorn worker shares the same budget.
+
+Independently, ``AdmissionController`` caps the number of in-flight upstream
+calls per worker. Requests beyond the cap wait in a bounded queue and are shed
+with 429 once the queue is full or they have waited too long.
+"""
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+from backend.services.concurrency import acquire_within
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_BUDGETS = {
+    "llm_turns": os.getenv("RATE_LIMIT_LLM_TURNS", "30/60"),
+    "tts_chars": os.getenv("RATE_LIMIT_TTS_CHARS", "20000/60"),
+    "stt_seconds": os.getenv("RATE_LIMIT_STT_SECONDS", "300/60"),
+}
+# Used to estimate STT seconds from upload size without decoding the audio
+STT_ASSUMED_BITRATE = int(os.getenv("STT_ASSUMED_BITRATE", "32000"))
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "128"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+
+def parse_budget(spec: str) -> tuple:
+    """``"30/60"`` -> ``(capacity=30.0, refill_per_second=0.5)``."""
+    capacity, seconds = spec.split("/")
+    capacity = float(capacity)
+    return capacity, capacity / float(seconds)
+
+
+def client_key(request: Request) -> str:
+    """The bucket owner: a user verified by an authentication middleware, else the client IP.
+
+    ``X-User-Id`` is not used: the client sets it, and a new value on every
+    request would get a fresh budget every time.
+    """
+    user = request.scope.get("user")
+    if user is not None and getattr(user, "is_authenticated", False):
+        return f"user:{user.identity}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def _too_many(detail: str, retry_after: float):
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class MemoryBucketBackend:
+    SWEEP_EVERY = 1024
+
+    def __init__(self):
+        # key -> [tokens, last_refill_monotonic, capacity, rate]
+        self._buckets: dict = {}
+        self._ops = 0
+
+    async def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        """Take ``cost`` tokens; returns 0 on success else seconds until possible."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now, capacity, rate]
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        self._ops += 1
+        if self._ops % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            return 0.0
+        bucket[0] = tokens
+        return (cost - tokens) / rate
+
+    def _sweep(self, now: float):
+        # a bucket that would be full again carries no state worth keeping
+        for key, (tokens, ts, capacity, rate) in list(self._buckets.items()):
+            if tokens + (now - ts) * rate >= capacity:
+                del self._buckets[key]
+
+
+class MongoBucketBackend:
+    """Buckets in the ``rate_limits`` collection, shared across workers.
+
+    Refill and take happen in one ``find_one_and_update`` pipeline, so
+    concurrent checks from different workers cannot overspend a bucket.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    async def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        doc = await self._db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (cost - doc["tokens"]) / rate
+
+
+_memory_backend = MemoryBucketBackend()
+
+
+def _backend(request: Request):
+    if RATE_LIMIT_BACKEND == "mongo":
+        return MongoBucketBackend(request.app.state._mongo_db)
+    return _memory_backend
+
+
+async def check_rate_limit(request: Request, budget: str, cost: float = 1):
+    """Charge ``cost`` against the caller's ``budget``; raise 429 if exhausted."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    capacity, rate = parse_budget(RATE_LIMIT_BUDGETS[budget])
+    # a single request larger than the whole bucket would otherwise never pass
+    cost = min(cost, capacity)
+    retry_after = await _backend(request).take(f"{budget}:{client_key(request)}", cost, capacity, rate)
+    if retry_after > 0:
+        raise _too_many(f"Rate limit exceeded for {budget}", retry_after)
+
+
+def estimate_audio_seconds(num_bytes: int) -> float:
+    return num_bytes * 8 / STT_ASSUMED_BITRATE
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        max_queued: int = ADMISSION_MAX_QUEUED,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one upstream-concurrency slot, queueing or shedding with 429."""
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            raise _too_many("Server is at capacity, retry shortly", ADMISSION_RETRY_AFTER)
+        self.queued += 1
+        try:
+            acquired = await acquire_within(self._semaphore, self.queue_timeout)
+        finally:
+            self.queued -= 1
+        if not acquired:
+            raise _too_many("Server is at capacity, retry shortly", ADMISSION_RETRY_AFTER)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+# Module-level singleton shared by the upstream-heavy routes
+admission_controller = AdmissionController()
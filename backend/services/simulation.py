@@ -0,0 +1,230 @@
+"""Bulk conversation simulation for persona regression and throughput testing.
+
+Each script in a ``SimulationPlan`` names an agent, a scenario and a list of
+scripted learner turns; it is run ``runs`` times. Every simulated conversation
+goes through the same calls the chat page makes: ``setupAgent``, a
+``gen goals`` prime of the goal tracker, then per learner turn a goal update
+followed by the agent reply, both via ``messageAgent``. Up to
+``concurrency`` conversations run at once.
+
+``simulate`` yields one record per event as it happens:
+    setup         conversation ids and setup latency
+    turn          per-turn agent and goal latency, goals completed so far
+    conversation  totals for one simulated conversation
+    summary       counts and latency percentiles for the whole run
+
+CLI (NDJSON to stdout or ``--out``)::
+
+    python -m backend.services.simulation plan.json --concurrency 8
+    python -m backend.services.simulation plan.json --stand-ins --latency-ms 300
+
+``--stand-ins`` swaps the provider SDKs for ``stand_ins``; otherwise the
+providers configured in the environment are used, including cassette replay
+(``PROVIDER_CASSETTE_MODE=replay``).
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import AsyncIterator, Optional
+
+from backend.models.goals import GoalState
+from backend.models.simulation import SimulationPlan, SimulationScript
+from backend.services.conversation import _get_client_for_agent, messageAgent, setupAgent
+from backend.services.json_stream import JSONExtractError, extract_json
+
+GOAL_PRIME = "gen goals"
+
+
+def parse_goals(text: Optional[str]) -> Optional[list]:
+    """Goals from a goal-tracker reply, tolerating prose, code fences and trailing commas."""
+    if not text:
+        return None
+    try:
+        return extract_json(text, GoalState).model_dump()["goals"]
+    except JSONExtractError:
+        return None
+
+
+def _completed(goals: Optional[list]) -> Optional[int]:
+    if goals is None:
+        return None
+    return sum(1 for g in goals if isinstance(g, dict) and g.get("completed"))
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _percentile(values: list, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def _run_conversation(script: SimulationScript, run: int, db, emit):
+    base = {"agent": script.agent, "scenario": script.scenario_prompt, "run": run}
+    started = time.perf_counter()
+
+    start = time.perf_counter()
+    try:
+        client, _, conversation_id, goal_client, _, goal_conversation_id = await setupAgent(
+            script.agent, script.country, script.language, db=db, scenario_prompt=script.scenario_prompt
+        )
+    except Exception as exc:
+        await emit({"type": "setup", **base, "error": str(exc), "latency_ms": _ms(start)})
+        await emit({"type": "conversation", **base, "turns": 0, "errors": 1, "total_ms": _ms(started)})
+        return
+    if goal_client is None and goal_conversation_id:
+        goal_client = _get_client_for_agent("GEMINI")
+    base["conversation_id"] = conversation_id
+    await emit({
+        "type": "setup", **base,
+        "gemini_conversation_id": goal_conversation_id,
+        "latency_ms": _ms(start),
+    })
+
+    goals = None
+    errors = 0
+    turns_done = 0
+    if goal_conversation_id:
+        start = time.perf_counter()
+        try:
+            result = await messageAgent(goal_client, goal_conversation_id, "user", GOAL_PRIME, db=db)
+            goals = parse_goals(result["assistant_text"])
+            await emit({
+                "type": "turn", **base, "turn": 0, "goal_prime": True,
+                "goal_latency_ms": _ms(start),
+                "goals_total": len(goals) if goals is not None else None,
+                "goals_completed": _completed(goals),
+            })
+        except Exception as exc:
+            errors += 1
+            await emit({"type": "turn", **base, "turn": 0, "goal_prime": True, "error": str(exc)})
+
+    for i, text in enumerate(script.turns, start=1):
+        record = {"type": "turn", **base, "turn": i}
+        try:
+            if goal_conversation_id:
+                start = time.perf_counter()
+                result = await messageAgent(goal_client, goal_conversation_id, "user", text, db=db)
+                record["goal_latency_ms"] = _ms(start)
+                goals = parse_goals(result["assistant_text"]) or goals
+            start = time.perf_counter()
+            result = await messageAgent(client, conversation_id, "user", text, db=db)
+            record["agent_latency_ms"] = _ms(start)
+            record["reply_chars"] = len(result["assistant_text"] or "")
+        except Exception as exc:
+            # the transcript is now out of script; stop this conversation
+            errors += 1
+            record["error"] = str(exc)
+            await emit(record)
+            break
+        record["goals_total"] = len(goals) if goals is not None else None
+        record["goals_completed"] = _completed(goals)
+        turns_done += 1
+        await emit(record)
+
+    await emit({
+        "type": "conversation", **base,
+        "turns": turns_done,
+        "errors": errors,
+        "goals_total": len(goals) if goals is not None else None,
+        "goals_completed": _completed(goals),
+        "all_goals_completed": bool(goals) and _completed(goals) == len(goals),
+        "total_ms": _ms(started),
+    })
+
+
+async def simulate(plan: SimulationPlan, db, concurrency: Optional[int] = None) -> AsyncIterator[dict]:
+    """Run every script of ``plan`` and yield records as they are produced."""
+    limit = asyncio.Semaphore(concurrency or plan.concurrency)
+    records: asyncio.Queue = asyncio.Queue(maxsize=1000)
+    started = time.perf_counter()
+
+    async def worker(script: SimulationScript, run: int):
+        async with limit:
+            await _run_conversation(script, run, db, records.put)
+
+    async def run_all():
+        try:
+            await asyncio.gather(*(
+                worker(script, run) for script in plan.scripts for run in range(1, script.runs + 1)
+            ))
+        finally:
+            await records.put(None)
+
+    runner = asyncio.ensure_future(run_all())
+    agent_latencies, goal_latencies = [], []
+    conversations = errors = goals_met = 0
+    try:
+        while True:
+            record = await records.get()
+            if record is None:
+                break
+            if record["type"] == "turn":
+                if "agent_latency_ms" in record:
+                    agent_latencies.append(record["agent_latency_ms"])
+                if "goal_latency_ms" in record:
+                    goal_latencies.append(record["goal_latency_ms"])
+            elif record["type"] == "conversation":
+                conversations += 1
+                errors += record["errors"]
+                goals_met += record.get("all_goals_completed", False)
+            yield record
+        await runner
+    finally:
+        # consumer went away (client disconnected, CLI interrupted)
+        runner.cancel()
+
+    yield {
+        "type": "summary",
+        "conversations": conversations,
+        "errors": errors,
+        "all_goals_completed": goals_met,
+        "turns": len(agent_latencies),
+        "agent_latency_ms": {"p50": _percentile(agent_latencies, 0.5), "p95": _percentile(agent_latencies, 0.95)},
+        "goal_latency_ms": {"p50": _percentile(goal_latencies, 0.5), "p95": _percentile(goal_latencies, 0.95)},
+        "total_ms": _ms(started),
+    }
+
+
+async def _main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from backend.services.conversation import MONGODB_DB, MONGODB_URI
+
+    if args.stand_ins:
+        from backend.services import stand_ins
+
+        stand_ins.install(args.latency_ms)
+    with open(args.plan) as f:
+        plan = SimulationPlan.model_validate_json(f.read())
+
+    client = AsyncIOMotorClient(MONGODB_URI)
+    db = client[args.db or f"{MONGODB_DB}_simulation"]
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        async for record in simulate(plan, db, args.concurrency):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("plan", help="JSON file shaped like SimulationPlan")
+    parser.add_argument("--concurrency", type=int, help="overrides the plan's concurrency")
+    parser.add_argument("--out", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--db", help="Mongo database (default: <MONGODB_DB>_simulation)")
+    parser.add_argument("--stand-ins", action="store_true", help="use local provider stand-ins")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="stand-in latency per call")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
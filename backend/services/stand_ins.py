@@ -0,0 +1,94 @@
+"""Local stand-ins for the provider SDKs.
+
+``install(latency_ms)`` registers fake ``openai`` and ``google.generativeai``
+modules with ``providers``, so ``setupAgent``, ``messageAgent`` and the goal
+batcher run unchanged without network access or credentials. Replies are
+deterministic: agents answer with a short canned line, and the goal checker
+returns three goals and marks one more complete for every learner message it
+has seen. Each call sleeps ``latency_ms`` to approximate upstream time.
+"""
+import os
+import re
+import json
+import asyncio
+from types import SimpleNamespace
+
+from backend.services import providers
+from backend.services.goal_batcher import BATCH_PROMPT_HEADER
+
+_TASK = re.compile(r'<task id="(\d+)">\n(.*?)\n</task>', re.DOTALL)
+_BATCH_PREFIX = BATCH_PROMPT_HEADER.split("{count}")[0]
+
+GOALS = ("Greet the other person", "Ask for what you need", "Say goodbye politely")
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    async def create(self, *, model, messages, extra_body=None, timeout=None):
+        await asyncio.sleep(self._client.latency)
+        last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        content = f"(stand-in) Entendido: {last[:80]}" if last else "(stand-in) Hola, ¿en qué puedo ayudarte?"
+        message = SimpleNamespace(role="assistant", content=content)
+        # rough token counts, so the usage ledger has numbers to aggregate
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"].split()) for m in messages),
+            completion_tokens=len(content.split()),
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+class StandInAsyncOpenAI:
+    latency = 0.0
+
+    def __init__(self, base_url=None, api_key=None, **kwargs):
+        self.base_url = base_url
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+
+def goal_answer(prompt: str) -> str:
+    # "gen goals" primes the checker; every other learner line completes a goal
+    # (the latest message appears both in the history and as the final turn)
+    learner_lines = {
+        line.strip() for line in prompt.splitlines()
+        if line.startswith("User: ") and line.strip() != "User: gen goals"
+    }
+    done = min(len(learner_lines), len(GOALS))
+    return json.dumps({"goals": [{"goal": g, "completed": i < done} for i, g in enumerate(GOALS)]})
+
+
+class StandInGenerativeModel:
+    latency = 0.0
+
+    def __init__(self, model_name="stand-in", **kwargs):
+        self.model_name = model_name
+
+    def _answer(self, prompt: str) -> str:
+        if prompt.startswith(_BATCH_PREFIX):
+            return json.dumps({task_id: goal_answer(task) for task_id, task in _TASK.findall(prompt)})
+        return goal_answer(prompt)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(text=self._answer(prompt))
+
+    def generate_content(self, prompt, **kwargs):
+        return SimpleNamespace(text=self._answer(prompt))
+
+
+def install(latency_ms: float = 0.0):
+    """Swap the provider SDKs for stand-ins and fill in placeholder credentials."""
+    StandInAsyncOpenAI.latency = StandInGenerativeModel.latency = latency_ms / 1000
+    providers.install("openai", SimpleNamespace(AsyncOpenAI=StandInAsyncOpenAI))
+    providers.install(
+        "google.generativeai",
+        SimpleNamespace(GenerativeModel=StandInGenerativeModel, configure=lambda **kwargs: None),
+    )
+    from backend.services.agent_registry import registry
+
+    for spec in registry.specs():
+        os.environ.setdefault(spec.key_env, "stand-in")
+    os.environ.setdefault("GEMINI_API_KEY", "stand-in")
+    # credentials are read once per load; pick up the placeholders
+    registry.invalidate()
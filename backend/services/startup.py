@@ -0,0 +1,51 @@
+"""Startup timing and readiness state.
+
+Stages (module imports, DB init, provider warm-up) record how long they took
+so slow cold starts can be attributed, and ``/readyz`` reports ready only once
+the stages a worker needs before serving traffic have finished.
+"""
+import time
+import logging
+from contextlib import contextmanager
+
+_started_at = time.perf_counter()
+# stage name -> seconds, in the order stages finished
+_timings: dict = {}
+_pending: set = set()
+
+
+def record(stage: str, seconds: float):
+    _timings[stage] = round(seconds, 4)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def require(name: str):
+    """Mark a stage as required before the worker is ready."""
+    _pending.add(name)
+
+
+def complete(name: str):
+    _pending.discard(name)
+    if not _pending:
+        logging.info("Startup complete in %.3fs: %s", time.perf_counter() - _started_at, _timings)
+
+
+def is_ready() -> bool:
+    return not _pending
+
+
+def report() -> dict:
+    return {
+        "ready": is_ready(),
+        "pending": sorted(_pending),
+        "uptime_seconds": round(time.perf_counter() - _started_at, 3),
+        "timings": dict(_timings),
+    }
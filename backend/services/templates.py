@@ -0,0 +1,220 @@
+"""Content-hashed prompt templates.
+
+System prompts (the agent's country/language message, the goal checker's
+instructions) are stored once in the ``templates`` collection as
+``{_id: <hash>, name, version, body, created_at}``, where the hash is a digest
+of the body. A conversation's first message references its prompt instead of
+embedding the rendered text:
+
+    {"role": "system", "template": {"name": "goal_checker", "hash": "...",
+     "params": {"scenario_prompt": "..."}}, "seq": 1, ...}
+
+Bodies are ``str.format`` strings. A body never changes under its hash, so
+the in-memory cache needs no invalidation; editing a built-in template in
+``TEMPLATES`` creates a new version on the next start while existing
+conversations keep rendering the version they were created with.
+
+History readers call ``resolve`` (``get_conversation_state``, the
+write-behind window, ``GET /conversations/{id}``, events and exports), which
+fills in ``content`` at read time.
+
+Migrating existing conversations (embedded prompts -> references)::
+
+    python -m backend.services.templates migrate [--dry-run] [--limit N]
+"""
+import re
+import json
+import string
+import asyncio
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+TEMPLATES = {
+    "agent_system": "Your country is set to {country}, and your language is {language}.",
+    "goal_checker": """
+You are a goal checker for conversation practice.
+
+User's requested scenario: "{scenario_prompt}"
+
+Facilitate this conversational roleplay scenario. You will recieve input from the user.
+The user is trying to achieve goals in a conversation. The user is talking to an AI Agent playing the role of a foreign local.
+Help keep track of the goals for the user in the conversation. If anything the user says could count towards a goal, mark it as complete.
+
+ALL your responses must be ONLY with valid JSON in this exact format:
+
+{{
+  "goals": [
+    {{ "goal": "First goal to accomplish", "completed": false }},
+    {{ "goal": "Second goal to accomplish", "completed": false }},
+    {{ "goal": "Third goal to accomplish", "completed": false }}
+  ],
+}}
+
+Make it realistic and interactive. Keep goals simple and achievable through conversation. If a goal ever is completed, NEVER make it false.
+""",
+}
+
+
+def template_hash(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:24]
+
+
+def _pattern(body: str) -> re.Pattern:
+    """A regex matching renderings of ``body``, capturing each field."""
+    parts, seen = [], set()
+    for literal, field, _, _ in string.Formatter().parse(body):
+        parts.append(re.escape(literal))
+        if field is not None:
+            parts.append(f"(?P={field})" if field in seen else f"(?P<{field}>.*?)")
+            seen.add(field)
+    return re.compile("".join(parts), re.DOTALL)
+
+
+class TemplateStore:
+    def __init__(self, templates: dict = TEMPLATES):
+        self._bodies: dict = {}  # hash -> body
+        self.current: dict = {}  # name -> hash of the built-in body
+        for name, body in templates.items():
+            digest = template_hash(body)
+            self._bodies[digest] = body
+            self.current[name] = digest
+        self._registered = False
+        self._lock = asyncio.Lock()
+
+    def ref(self, name: str, **params) -> dict:
+        """A reference to the current version of built-in template ``name``."""
+        return {"name": name, "hash": self.current[name], "params": params}
+
+    def render(self, ref: dict) -> str:
+        """Render a reference whose body is cached; raises ``KeyError`` otherwise."""
+        return self._bodies[ref["hash"]].format(**ref.get("params") or {})
+
+    async def register(self, db):
+        """Store the built-in bodies (once per process); new bodies get the next version."""
+        if self._registered:
+            return
+        async with self._lock:
+            if self._registered:
+                return
+            for name, digest in self.current.items():
+                if await db.templates.count_documents({"_id": digest}, limit=1):
+                    continue
+                latest = await db.templates.find_one({"name": name}, {"version": 1}, sort=[("version", -1)])
+                try:
+                    await db.templates.insert_one({
+                        "_id": digest,
+                        "name": name,
+                        "version": (latest or {}).get("version", 0) + 1,
+                        "body": self._bodies[digest],
+                        "created_at": datetime.utcnow(),
+                    })
+                except DuplicateKeyError:
+                    # registered by another worker meanwhile
+                    pass
+            self._registered = True
+
+    async def load(self, digest: str, db) -> Optional[str]:
+        body = self._bodies.get(digest)
+        if body is None and db is not None:
+            doc = await db.templates.find_one({"_id": digest}, {"body": 1})
+            if doc:
+                body = self._bodies[digest] = doc["body"]
+        return body
+
+    async def resolve(self, messages: list, db=None) -> list:
+        """``messages`` with ``content`` rendered for template references.
+
+        A reference whose body cannot be found is left as is and logged.
+        """
+        resolved = messages
+        for i, message in enumerate(messages):
+            ref = message.get("template")
+            if ref is None or "content" in message:
+                continue
+            if await self.load(ref["hash"], db) is None:
+                logging.error("Unknown prompt template %s (%s)", ref.get("hash"), ref.get("name"))
+                continue
+            if resolved is messages:
+                resolved = list(messages)
+            resolved[i] = {**message, "content": self.render(ref)}
+        return resolved
+
+    def match(self, name: str, text: str) -> Optional[dict]:
+        """A reference to the current ``name`` template that renders exactly ``text``, if any."""
+        digest = self.current[name]
+        found = _pattern(self._bodies[digest]).fullmatch(text)
+        if found is None:
+            return None
+        ref = {"name": name, "hash": digest, "params": found.groupdict()}
+        return ref if self.render(ref) == text else None
+
+
+# Module-level singleton used by setupAgent and the history readers
+templates = TemplateStore()
+
+
+async def migrate(db, *, dry_run: bool = False, limit: int = 0, batch_size: int = 500) -> dict:
+    """Replace embedded system prompts with template references; returns counts."""
+    await templates.register(db)
+    # the prompt a conversation was created with is its first message; documents
+    # created before messages carried a seq have none, so it is not part of the query
+    query = {"messages.0.role": "system", "messages.0.content": {"$exists": True}}
+    cursor = db.conversations.find(query, {"agent": 1, "messages": {"$slice": 1}})
+    if limit:
+        cursor = cursor.limit(limit)
+    counts = {"scanned": 0, "migrated": 0, "unmatched": 0, "bytes_saved": 0}
+    ops = []
+    async for doc in cursor:
+        counts["scanned"] += 1
+        content = doc["messages"][0]["content"]
+        name = "goal_checker" if doc.get("agent") == "GEMINI" else "agent_system"
+        ref = templates.match(name, content)
+        if ref is None:
+            counts["unmatched"] += 1
+            continue
+        counts["migrated"] += 1
+        counts["bytes_saved"] += len(content.encode("utf-8")) - sum(len(str(v)) for v in ref["params"].values())
+        ops.append(UpdateOne(
+            # unchanged since it was read
+            {"_id": doc["_id"], "messages.0.content": content},
+            {"$set": {"messages.0.template": ref}, "$unset": {"messages.0.content": ""}},
+        ))
+        if len(ops) >= batch_size:
+            if not dry_run:
+                await db.conversations.bulk_write(ops, ordered=False)
+            ops = []
+    if ops and not dry_run:
+        await db.conversations.bulk_write(ops, ordered=False)
+    return counts
+
+
+async def _main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from backend.services.db import MONGO_DB, MONGO_URI
+
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        counts = await migrate(client[MONGO_DB], dry_run=args.dry_run, limit=args.limit, batch_size=args.batch_size)
+    finally:
+        client.close()
+    print(json.dumps({**counts, "dry_run": args.dry_run}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("migrate", help="replace embedded system prompts with template references")
+    run.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    run.add_argument("--limit", type=int, default=0, help="scan at most this many conversations")
+    run.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
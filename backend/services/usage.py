@@ -0,0 +1,210 @@
+"""Usage and cost ledger.
+
+Every upstream unit of work is recorded with ``record_usage``: LLM turns
+(prompt/completion tokens, upstream latency), TTS characters, STT audio
+seconds, conversation setups, and requests answered without an upstream call
+(``cache_hits``, e.g. an Idempotency-Key replay). Records are attributed to a
+conversation, a user and an agent; routes set the user and agent for the
+current task with ``attribute`` so the service layer only passes the
+conversation id.
+
+Nothing is written on the request path. The ledger folds records into
+in-process deltas and a flusher writes them every ``USAGE_FLUSH_SECONDS``:
+one ``$inc`` upsert per touched conversation, user and agent in the ``usage``
+collection (``_id`` is ``"<scope>:<key>"``), plus the individual records in
+``usage_events`` for per-turn analysis. ``totals`` adds deltas that are not
+flushed yet, so reads are current. Events expire after
+``USAGE_EVENTS_RETENTION_SECONDS`` (TTL index on ``at``); totals are kept.
+"""
+import os
+import asyncio
+import logging
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+load_dotenv()
+
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "true").lower() == "true"
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+USAGE_MAX_PENDING_EVENTS = int(os.getenv("USAGE_MAX_PENDING_EVENTS", "10000"))
+USAGE_EVENTS_ENABLED = os.getenv("USAGE_EVENTS_ENABLED", "true").lower() == "true"
+USAGE_EVENTS_RETENTION_SECONDS = int(os.getenv("USAGE_EVENTS_RETENTION_SECONDS", str(30 * 86400)))
+
+COUNTERS = (
+    "conversations",
+    "turns",
+    "prompt_tokens",
+    "completion_tokens",
+    "tts_chars",
+    "stt_seconds",
+    "upstream_calls",
+    "upstream_ms",
+    "cache_hits",
+)
+SCOPES = ("conversation", "user", "agent")
+
+_attribution: ContextVar[dict] = ContextVar("usage_attribution", default={})
+
+
+def attribute(*, agent: Optional[str] = None, user_id=None):
+    """Attribute usage recorded by the current task to ``agent`` and ``user_id``."""
+    fields = {k: v for k, v in (("agent", agent), ("user_id", user_id)) if v is not None}
+    _attribution.set({**_attribution.get(), **fields})
+
+
+def token_usage(response) -> tuple:
+    """``(prompt_tokens, completion_tokens)`` from a chat completion or Gemini response."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+    return 0, 0
+
+
+class UsageLedger:
+    def __init__(self, db, flush_seconds: float = USAGE_FLUSH_SECONDS):
+        self._db = db
+        self.flush_seconds = flush_seconds
+        # (scope, key) -> {counter: delta}
+        self._deltas: dict = {}
+        self._events: list = []
+        self.dropped_events = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def record(self, kind: str, *, conversation_id: Optional[str] = None, agent: Optional[str] = None, user_id=None, **counters):
+        attribution = _attribution.get()
+        agent = agent or attribution.get("agent")
+        user_id = user_id if user_id is not None else attribution.get("user_id")
+        counters = {k: v for k, v in counters.items() if k in COUNTERS and v}
+        if not counters:
+            return
+        for scope, key in (("conversation", conversation_id), ("user", user_id), ("agent", agent)):
+            if key is None:
+                continue
+            delta = self._deltas.setdefault((scope, str(key)), {})
+            for counter, value in counters.items():
+                delta[counter] = delta.get(counter, 0) + value
+        if USAGE_EVENTS_ENABLED:
+            if len(self._events) >= USAGE_MAX_PENDING_EVENTS:
+                self.dropped_events += 1
+                return
+            self._events.append({
+                "kind": kind,
+                "conversation_id": conversation_id,
+                "agent": agent,
+                "user_id": str(user_id) if user_id is not None else None,
+                "at": datetime.utcnow(),
+                **counters,
+            })
+
+    async def _ensure_indexes(self):
+        try:
+            await self._db.usage_events.create_index("at", expireAfterSeconds=USAGE_EVENTS_RETENTION_SECONDS)
+        except OperationFailure:
+            # the index exists with another retention: change it in place
+            await self._db.command(
+                "collMod", "usage_events",
+                index={"keyPattern": {"at": 1}, "expireAfterSeconds": USAGE_EVENTS_RETENTION_SECONDS},
+            )
+
+    async def _run(self):
+        try:
+            await self._ensure_indexes()
+        except Exception:
+            logging.exception("Creating usage event indexes failed")
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Usage ledger flush failed")
+
+    async def flush(self):
+        deltas, self._deltas = self._deltas, {}
+        events, self._events = self._events, []
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne(
+                {"_id": f"{scope}:{key}"},
+                {
+                    "$inc": delta,
+                    "$set": {"scope": scope, "key": key, "updated_at": now},
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            )
+            for (scope, key), delta in deltas.items()
+        ]
+        try:
+            if ops:
+                await self._db.usage.bulk_write(ops, ordered=False)
+        except Exception:
+            # put the deltas back so the next flush retries them
+            for key, delta in deltas.items():
+                merged = self._deltas.setdefault(key, {})
+                for counter, value in delta.items():
+                    merged[counter] = merged.get(counter, 0) + value
+            raise
+        if events:
+            await self._db.usage_events.insert_many(events, ordered=False)
+
+    async def totals(self, scope: str, key: str) -> dict:
+        doc = await self._db.usage.find_one({"_id": f"{scope}:{key}"}) or {"scope": scope, "key": key}
+        for counter, value in self._deltas.get((scope, key), {}).items():
+            doc[counter] = doc.get(counter, 0) + value
+        for counter in COUNTERS:
+            doc.setdefault(counter, 0)
+        doc.pop("_id", None)
+        return doc
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logging.exception("Final usage ledger flush failed")
+
+
+# Module-level singleton, created by init_db
+_ledger: Optional[UsageLedger] = None
+
+
+def start_usage_ledger(db) -> Optional[UsageLedger]:
+    global _ledger
+    if USAGE_ENABLED and _ledger is None:
+        _ledger = UsageLedger(db)
+        _ledger.start()
+    return _ledger
+
+
+def get_usage_ledger() -> Optional[UsageLedger]:
+    return _ledger
+
+
+def record_usage(kind: str, **fields):
+    """Record usage if the ledger is running; never raises into the caller."""
+    if _ledger is not None:
+        try:
+            _ledger.record(kind, **fields)
+        except Exception:
+            logging.exception("Failed to record %s usage", kind)
+
+
+async def stop_usage_ledger():
+    global _ledger
+    if _ledger is not None:
+        await _ledger.close()
+        _ledger = None
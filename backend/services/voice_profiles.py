@@ -0,0 +1,183 @@
+"""Voice and model profiles per agent and language.
+
+A profile picks the ElevenLabs voice, the TTS model for each latency tier,
+the voice settings, the default output format and the STT language code.
+Profiles are layered, most specific last:
+
+    "*"                  defaults for every agent
+    "*:<language>"       every agent speaking <language>
+    "<AGENT>"            one agent
+    "<AGENT>:<language>" one agent in one language
+
+on top of the built-in ``PROFILES``, with ``VOICE_PROFILES_FILE`` (a JSON
+object with the same keys) layered over those. Language keys are lower case.
+
+``setupAgent`` resolves a conversation's profile once and stores it in the
+conversation's metadata; the audio routes read it back through
+``conversation_profiles``, which keeps it in memory afterwards, so a turn
+costs no lookups.
+
+Latency tiers: replies up to ``TTS_FAST_MODEL_MAX_CHARS`` characters are
+synthesized with the profile's low-latency model, where model start-up
+dominates and quality differences are hard to hear; longer replies use the
+quality model. A known STT language skips auto-detection.
+"""
+import os
+import json
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from backend.services.audio_formats import AUDIO_FORMATS, TTS_AGENT_FORMATS, TTS_DEFAULT_FORMAT
+
+load_dotenv()
+
+VOICE_PROFILES_FILE = os.getenv("VOICE_PROFILES_FILE")
+TTS_FAST_MODEL_MAX_CHARS = int(os.getenv("TTS_FAST_MODEL_MAX_CHARS", "160"))
+VOICE_PROFILE_CACHE_SIZE = int(os.getenv("VOICE_PROFILE_CACHE_SIZE", "10000"))
+
+DEFAULT_VOICE = "UgBBYS2sOqTuMpoF3BR0"
+
+# ISO 639-1 codes for ElevenLabs STT, keyed by the language names the frontend uses
+LANGUAGE_CODES = {
+    "english": "en",
+    "mandarin": "zh",
+    "mandarin chinese": "zh",
+    "chinese": "zh",
+    "spanish": "es",
+    "french": "fr",
+    "german": "de",
+    "japanese": "ja",
+    "hindi": "hi",
+    "portuguese": "pt",
+}
+
+PROFILES = {
+    "*": {
+        "voice": DEFAULT_VOICE,
+        "model": "eleven_multilingual_v2",
+        "fast_model": "eleven_flash_v2_5",
+        "audio_format": TTS_DEFAULT_FORMAT,
+        "voice_settings": {
+            # Lower for more emotional and dramatic delivery.
+            "stability": 0.45,
+            # Higher for better clarity and consistency, especially with a high-quality voice.
+            "similarity_boost": 1.0,
+            # Recommended to keep at 0 for most realistic results and lower latency.
+            "style": 0,
+            # Default speed is 1.0. Adjust in small increments (0.9–1.1) for nuance.
+            "speed": 1.0,
+        },
+    },
+    # the standalone voice roleplay service (English practice)
+    "VOICE_ROLEPLAY": {
+        "voice": "pNInz6obpgDQGcFmaJgB",
+        "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
+    },
+}
+
+
+class VoiceProfile(NamedTuple):
+    voice: str
+    model: str
+    fast_model: str
+    audio_format: str
+    voice_settings: dict
+    stt_language: Optional[str] = None
+
+    def tts_model(self, text: str, fast: bool = False) -> str:
+        """The model for ``text``: the low-latency tier for short replies or when ``fast``."""
+        return self.fast_model if fast or len(text) <= TTS_FAST_MODEL_MAX_CHARS else self.model
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "VoiceProfile":
+        """Rebuild a stored profile; fields added since it was stored take their defaults."""
+        base = resolve_profile(None, None)._asdict()
+        base.update({k: v for k, v in doc.items() if k in cls._fields})
+        return cls(**base)
+
+
+def _load_file(path: Optional[str]) -> dict:
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+_overrides = _load_file(VOICE_PROFILES_FILE)
+
+
+def resolve_profile(agent: Optional[str], language: Optional[str]) -> VoiceProfile:
+    language = language.strip().lower() if isinstance(language, str) else None
+    agent = agent.upper() if agent else None
+    keys = ["*"]
+    if language:
+        keys.append(f"*:{language}")
+    if agent:
+        keys.append(agent)
+        if language:
+            keys.append(f"{agent}:{language}")
+
+    fields: dict = {"stt_language": LANGUAGE_CODES.get(language) if language else None}
+    for key in keys:
+        layers = [PROFILES.get(key), _overrides.get(key)]
+        if key == agent and TTS_AGENT_FORMATS.get(agent) in AUDIO_FORMATS:
+            # TTS_AGENT_FORMATS predates profiles; it counts as the agent's own layer
+            layers.insert(0, {"audio_format": TTS_AGENT_FORMATS[agent]})
+        for layer in layers:
+            for name, value in (layer or {}).items():
+                if name == "voice_settings":
+                    fields[name] = {**fields.get(name, {}), **value}
+                else:
+                    fields[name] = value
+    if fields.get("audio_format") not in AUDIO_FORMATS:
+        fields["audio_format"] = "mp3"
+    return VoiceProfile(**{name: fields[name] for name in VoiceProfile._fields if name in fields})
+
+
+class ConversationSession(NamedTuple):
+    profile: VoiceProfile
+    agent: Optional[str] = None
+    user_id: object = None
+
+
+class ConversationProfiles:
+    """In-memory ``conversation_id -> (VoiceProfile, agent, owner)``, filled from the stored conversation."""
+
+    def __init__(self, max_size: int = VOICE_PROFILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+
+    def remember(self, conversation_id: str, profile: VoiceProfile, agent: Optional[str] = None, user_id=None):
+        self._sessions[conversation_id] = ConversationSession(profile, agent, user_id)
+        self._sessions.move_to_end(conversation_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    async def session(self, conversation_id: str, db) -> ConversationSession:
+        """The conversation's voice profile, agent and owner (for usage attribution)."""
+        session = self._sessions.get(conversation_id)
+        if session is not None:
+            self._sessions.move_to_end(conversation_id)
+            return session
+        doc = await db.conversations.find_one(
+            {"_id": ObjectId(conversation_id)},
+            {"agent": 1, "user_id": 1, "metadata.language": 1, "metadata.voice_profile": 1},
+        ) or {}
+        metadata = doc.get("metadata") or {}
+        if metadata.get("voice_profile"):
+            profile = VoiceProfile.from_doc(metadata["voice_profile"])
+        else:
+            # conversations created before profiles were stored
+            profile = resolve_profile(doc.get("agent"), metadata.get("language"))
+        self.remember(conversation_id, profile, doc.get("agent"), doc.get("user_id"))
+        return self._sessions[conversation_id]
+
+    async def get(self, conversation_id: str, db) -> VoiceProfile:
+        return (await self.session(conversation_id, db)).profile
+
+
+# Module-level singleton used by setupAgent and the audio routes
+conversation_profiles = ConversationProfiles()
@@ -1,20 +1,99 @@
 import os
-import base64
+import logging
 import tempfile
 import json
-import re
 import requests
+from typing import List
 import google.generativeai as genai
 from fastapi import HTTPException
 from dotenv import load_dotenv
 
+from backend.services.goal_batcher import GOAL_BATCHING_ENABLED, get_goal_batcher
+from backend.services.degradation import timed_stage
+from backend.services.audio_formats import AUDIO_FORMATS, TTS_DEFAULT_FORMAT
+from backend.services import cassette
+from backend.services.json_stream import JSONExtractError, extract_json
+from backend.models.goals import Scenario
+from backend.services.logs import logged_stage
+from backend.services.voice_profiles import resolve_profile
+
 # Load environment variables
 load_dotenv()
 
+def build_goal_prompt(user_text: str, conversation_history: list, goals: list) -> str:
+    """Goal-completion prompt for ``update_goals_smart``."""
+    # Build conversation context
+    history_context = ""
+    if conversation_history:
+        history_context = "\nRecent conversation:\n"
+        for msg in conversation_history[-4:]:
+            role = msg.get('role', 'user')
+            content = msg.get('content', '')
+            history_context += f"{role}: {content}\n"
+
+    return f"""
+You are analyzing a conversation to determine if goals have been achieved.
+
+Current goals:
+{json.dumps([g.get('goal', '') for g in goals], indent=2)}
+
+{history_context}
+Latest user message: "{user_text}"
+
+For each goal, determine if it has been completed based on the conversation.
+
+Return ONLY a JSON array of booleans representing completion status for each goal, in order.
+Example: [true, false, true]
+
+Do not add any explanation or additional text. Only the JSON array.
+"""
+
+
+def build_chat_prompt(user_text: str, scenario_context: dict = None, conversation_history: list = None) -> str:
+    """In-character reply prompt for ``chat_with_context``."""
+    # Build context-aware prompt
+    if scenario_context:
+        context_prompt = f"""
+You are roleplaying as a character in a conversation practice scenario.
+
+SCENARIO CONTEXT:
+- Scenario: {scenario_context.get('scenario_title', 'General conversation')}
+- Character: {scenario_context.get('ai_character', 'AI Assistant')}
+- Environment: {scenario_context.get('environment', 'General setting')}
+- Description: {scenario_context.get('description', '')}
+
+Your role: You are playing the character "{scenario_context.get('ai_character', 'AI Assistant')}" in a realistic practice scenario. Respond naturally and in character.
+"""
+    else:
+        context_prompt = """
+You are a helpful AI assistant for conversation practice.
+"""
+
+    # Add conversation history if available
+    history_text = ""
+    if conversation_history:
+        history_text = "\n\nCONVERSATION HISTORY:\n"
+        for msg in conversation_history[-6:]:  # Last 6 messages for context
+            role = msg.get('role', 'user')
+            content = msg.get('content', '')
+            if role == 'user':
+                history_text += f"User: {content}\n"
+            elif role == 'assistant':
+                history_text += f"Assistant: {content}\n"
+
+    # Build the final prompt
+    return f"""{context_prompt}{history_text}
+
+USER'S MESSAGE: "{user_text}"
+
+Respond naturally as the character in this scenario. Keep your response conversational and appropriate for the context. If the user is continuing a previous topic, acknowledge that continuity.
+"""
+
+
 class VoiceRoleplayService:
     def __init__(self):
-        self.elevenlabs_key = os.getenv('ELEVENLABS_API_KEY', '')
-        self.gemini_key = os.getenv('GEMINI_API_KEY', '')
+        self.elevenlabs_key = cassette.credential('ELEVENLABS_API_KEY') or ''
+        self.gemini_key = cassette.credential('GEMINI_API_KEY') or ''
         
         # Configuration: Set to False for text-only mode, True for audio mode
         self.text_only_mode = os.getenv('TEXT_ONLY_MODE', 'true').lower() == 'true'
@@ -26,16 +105,16 @@ class VoiceRoleplayService:
         genai.configure(api_key=self.gemini_key)
         self.model = genai.GenerativeModel('gemini-2.5-flash')
         
+        # Voice, model tiers and voice settings shared with the agent conversations
+        self.voice_profile = resolve_profile("VOICE_ROLEPLAY", None)
+
         # Check audio mode
         self.use_audio = not self.text_only_mode and self.elevenlabs_key and self.elevenlabs_key != ""
         
         # Chat session tracking (in production, use proper session storage)
         self.chat_sessions = {}
         
-        print(f"Voice Roleplay Service initialized:")
-        print(f"- Text-only mode: {self.text_only_mode}")
-        print(f"- Audio enabled: {self.use_audio}")
-        print(f"- ElevenLabs key present: {bool(self.elevenlabs_key)}")
+        logging.info("Voice Roleplay Service initialized: text_only_mode=%s audio_enabled=%s elevenlabs_key_present=%s", self.text_only_mode, self.use_audio, bool(self.elevenlabs_key))
     
     def _get_or_create_session(self, session_id: str) -> dict:
         """Get or create a chat session."""
@@ -47,36 +126,19 @@ class VoiceRoleplayService:
             }
         return self.chat_sessions[session_id]
     
-    def _parse_json_response(self, response_text: str):
-        """Safely parse JSON from response text (handles objects and arrays)."""
-        # Remove markdown code fences if present
-        response_text = response_text.strip()
-        
-        # Remove markdown code fence patterns (```json ... ``` or ``` ... ```)
-        response_text = re.sub(r'^```json\s*', '', response_text, flags=re.MULTILINE)
-        response_text = re.sub(r'^```\s*', '', response_text, flags=re.MULTILINE)
-        response_text = re.sub(r'\s*```\s*$', '', response_text, flags=re.MULTILINE)
-        response_text = response_text.strip()
-        
-        # Try to find JSON (either object {} or array [])
-        json_match = re.search(r'(\[.*?\]|\{.*?\})', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {e}")
-                print(f"Attempted to parse: {json_str}")
-                print(f"Full response: {response_text}")
-        else:
-            print(f"No JSON found in response: {response_text}")
-        
+    def _parse_json_response(self, response_text: str, schema=None):
+        """Parse the first JSON value (object or array) in a reply; None if there is none or it does not match ``schema``."""
+        try:
+            return extract_json(response_text, schema)
+        except JSONExtractError as e:
+            logging.warning("JSON parsing error: %s", e, extra={"payload": {"response": response_text}})
         return None
 
+    @logged_stage("scenario")
     async def generate_scenario(self, scenario_prompt: str) -> dict:
         """Generate a conversational roleplay scenario using Gemini."""
         try:
-            print(f"Generating scenario for: {scenario_prompt}")
+            logging.debug("Generating scenario", extra={"payload": {"scenario_prompt": scenario_prompt}})
             
             prompt = f"""
 You are a roleplay generator for conversation practice.
@@ -101,24 +163,16 @@ Generate a conversational roleplay scenario. Respond ONLY with valid JSON in thi
 Make it realistic and interactive. Keep goals simple and achievable through conversation.
 """
             
-            response = self.model.generate_content(prompt)
-            print(f"Gemini scenario response: {response.text}")
+            response = cassette.gemini_generate_sync(self.model, prompt)
+            logging.debug("Gemini scenario response", extra={"payload": {"response": response.text}})
             
             # Parse JSON response
             response_text = response.text.strip()
-            
-            # Try to find JSON in the response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
+            scenario = self._parse_json_response(response_text, Scenario)
+            if scenario is not None:
+                scenario_data = scenario.model_dump()
             else:
-                json_str = response_text
-            
-            try:
-                scenario_data = json.loads(json_str)
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {e}")
-                print(f"Raw response: {response_text}")
+                logging.warning("Scenario JSON parsing failed; using fallback scenario")
                 # Fallback scenario
                 scenario_data = {
                     "scenario_title": f"Practice: {scenario_prompt}",
@@ -136,46 +190,28 @@ Make it realistic and interactive. Keep goals simple and achievable through conv
             return scenario_data
             
         except Exception as e:
-            print(f"Error generating scenario: {e}")
+            logging.exception("Error generating scenario")
             raise HTTPException(status_code=500, detail=str(e))
 
+    @logged_stage("goal")
     async def update_goals_smart(self, user_text: str, conversation_history: list, goals: list) -> list:
         """Smart goal tracking based on conversation context."""
         try:
-            print(f"Updating goals for: {user_text}")
+            logging.debug("Updating goals", extra={"payload": {"user_text": user_text, "goals": len(goals)}})
             
-            # Build conversation context
-            history_context = ""
-            if conversation_history:
-                history_context = "\nRecent conversation:\n"
-                for msg in conversation_history[-4:]:
-                    role = msg.get('role', 'user')
-                    content = msg.get('content', '')
-                    history_context += f"{role}: {content}\n"
+            prompt = build_goal_prompt(user_text, conversation_history, goals)
             
-            prompt = f"""
-You are analyzing a conversation to determine if goals have been achieved.
-
-Current goals:
-{json.dumps([g.get('goal', '') for g in goals], indent=2)}
-
-{history_context}
-Latest user message: "{user_text}"
-
-For each goal, determine if it has been completed based on the conversation.
-
-Return ONLY a JSON array of booleans representing completion status for each goal, in order.
-Example: [true, false, true]
-
-Do not add any explanation or additional text. Only the JSON array.
-"""
-            
-            response = self.model.generate_content(prompt)
-            print(f"Goal completion response: {response.text}")
+            with timed_stage("goal"):
+                if GOAL_BATCHING_ENABLED:
+                    # Batched with goal checks from other sessions
+                    response_text, _ = await get_goal_batcher(self.model.model_name).submit(prompt)
+                else:
+                    response_text = cassette.gemini_generate_sync(self.model, prompt).text
+            logging.debug("Goal completion response", extra={"payload": {"response": response_text}})
             
             # Parse the boolean array
-            result = self._parse_json_response(response.text)
-            if result is not None and isinstance(result, list):
+            result = self._parse_json_response(response_text, List[bool])
+            if result is not None:
                 # Update goals with completion status
                 updated_goals = []
                 for i, goal in enumerate(goals):
@@ -186,13 +222,14 @@ Do not add any explanation or additional text. Only the JSON array.
                 return updated_goals
             else:
                 # Return goals unchanged if parsing fails
-                print("Failed to parse goal completion, keeping current state")
+                logging.warning("Failed to parse goal completion, keeping current state")
                 return goals
             
-        except Exception as e:
-            print(f"Error in smart goal tracking: {e}")
+        except Exception:
+            logging.exception("Error in smart goal tracking")
             return goals
 
+    @logged_stage("stt")
     async def speech_to_text(self, audio_file_path: str) -> str:
         """Convert audio to text using ElevenLabs Speech-to-Text API."""
         if not self.use_audio:
@@ -210,139 +247,118 @@ Do not add any explanation or additional text. Only the JSON array.
                 data = {
                     "model_id": "scribe_v1"
                 }
-                print(f"Sending audio to ElevenLabs Speech-to-Text API...")
-                response = requests.post(url, headers=headers, files=files, data=data)
-                print(f"ElevenLabs Speech-to-Text response status: {response.status_code}")
-                print(f"ElevenLabs Speech-to-Text response: {response.text}")
+                logging.debug("Sending audio to ElevenLabs Speech-to-Text API")
+                response = cassette.call_sync(
+                    "stt",
+                    lambda: {"url": url, "model_id": "scribe_v1", "audio": cassette.file_digest(audio_file_path)},
+                    lambda: requests.post(url, headers=headers, files=files, data=data),
+                    cassette.HTTP,
+                )
+                logging.debug("ElevenLabs Speech-to-Text response status: %s", response.status_code)
                 if response.status_code == 200:
                     result = response.json()
                     transcription = result.get("text", "")
-                    print(f"ElevenLabs transcribed: '{transcription}'")
+                    logging.debug("ElevenLabs transcription done", extra={"payload": {"transcription": transcription}})
                     return transcription
                 else:
-                    print(f"ElevenLabs Speech-to-Text failed: {response.status_code}")
+                    logging.warning("ElevenLabs Speech-to-Text failed: %s", response.status_code, extra={"payload": {"response": response.text}})
                     return f"Speech-to-Text failed (status: {response.status_code})"
         except Exception as e:
-            print(f"Error calling ElevenLabs Speech-to-Text: {e}")
+            logging.exception("Error calling ElevenLabs Speech-to-Text")
             return f"Error transcribing audio: {str(e)}"
 
-    async def text_to_speech(self, text: str) -> str:
-        """Convert text to speech using ElevenLabs Text-to-Speech API."""
+    @logged_stage("tts")
+    async def text_to_speech(self, text: str, audio_format: str = TTS_DEFAULT_FORMAT) -> bytes:
+        """Convert text to speech using ElevenLabs Text-to-Speech API.
+
+        Returns the raw audio bytes in ``audio_format`` (a key of
+        ``AUDIO_FORMATS``) so callers can send them as a binary body instead
+        of inflating them by a third with base64.
+        """
         if not self.use_audio:
-            return ""
-            
-        url = "https://api.elevenlabs.io/v1/text-to-speech/pNInz6obpgDQGcFmaJgB"
+            return b""
+
+        fmt = AUDIO_FORMATS.get(audio_format, AUDIO_FORMATS["mp3"])
+        profile = self.voice_profile
+        url = f"https://api.elevenlabs.io/v1/text-to-speech/{profile.voice}"
         headers = {
-            "Accept": "audio/mpeg",
+            "Accept": fmt.media_type,
             "Content-Type": "application/json",
             "xi-api-key": self.elevenlabs_key
         }
         data = {
             "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
+            "model_id": profile.tts_model(text),
+            "voice_settings": dict(profile.voice_settings),
         }
         try:
-            print(f"Converting text to speech: '{text}'")
-            response = requests.post(url, json=data, headers=headers)
-            print(f"ElevenLabs TTS response status: {response.status_code}")
-            if response.status_code == 200:
-                print("Audio conversion complete")
-            else:
-                print(f"ElevenLabs TTS failed: {response.status_code}")
-                print(f"Response: {response.text}")
-        except Exception as e:
-            print(f"Error calling ElevenLabs TTS: {e}")
-            return ""
-        
-        # Convert audio to base64
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        return audio_base64
+            logging.debug("Converting text to speech", extra={"payload": {"text": text}})
+            params = {"output_format": fmt.provider_format}
+            response = cassette.call_sync(
+                "tts",
+                {"url": url, "payload": data, "params": params},
+                lambda: requests.post(url, json=data, headers=headers, params=params),
+                cassette.HTTP,
+            )
+            logging.debug("ElevenLabs TTS response status: %s", response.status_code)
+            if response.status_code != 200:
+                logging.warning("ElevenLabs TTS failed: %s", response.status_code, extra={"payload": {"response": response.text}})
+                return b""
+        except Exception:
+            logging.exception("Error calling ElevenLabs TTS")
+            return b""
+
+        return response.content
 
+    @logged_stage("voice")
     async def process_voice_input(self, audio_file_path: str) -> dict:
-        """Process voice input and return transcription, reply, and audio."""
+        """Process voice input and return transcription, reply, and audio.
+
+        ``audio`` holds raw bytes; the caller streams them with the format's
+        media type rather than embedding them in JSON.
+        """
         try:
             # Convert speech to text
-            print("Starting speech-to-text...")
             transcription = await self.speech_to_text(audio_file_path)
-            print(f"Transcription: {transcription}")
+            logging.debug("Transcription", extra={"payload": {"transcription": transcription}})
             
             # Generate reply with Gemini
-            print("Generating reply with Gemini...")
-            response = self.model.generate_content(transcription)
+            response = cassette.gemini_generate_sync(self.model, transcription)
             reply = response.text
-            print(f"Reply: {reply}")
+            logging.debug("Reply", extra={"payload": {"reply": reply}})
             
             # Convert reply to speech
-            print("Converting to speech...")
-            audio_base64 = await self.text_to_speech(reply)
+            audio = await self.text_to_speech(reply)
             
             return {
                 "transcription": transcription,
                 "reply": reply,
-                "audio_base64": audio_base64
+                "audio": audio
             }
             
         except Exception as e:
-            print(f"Error processing voice input: {e}")
+            logging.exception("Error processing voice input")
             raise HTTPException(status_code=500, detail=str(e))
 
+    @logged_stage("chat")
     async def chat_with_context(self, user_text: str, scenario_context: dict = None, conversation_history: list = None) -> str:
         """Generate a conversational response with proper context awareness."""
         try:
-            print(f"Chat request for: {user_text}")
-            print(f"Scenario context: {scenario_context}")
-            print(f"Conversation history: {conversation_history}")
+            logging.debug(
+                "Chat request",
+                extra={"payload": {"user_text": user_text, "scenario": scenario_context, "history": conversation_history}},
+            )
             
-            # Build context-aware prompt
-            if scenario_context:
-                context_prompt = f"""
-You are roleplaying as a character in a conversation practice scenario.
-
-SCENARIO CONTEXT:
-- Scenario: {scenario_context.get('scenario_title', 'General conversation')}
-- Character: {scenario_context.get('ai_character', 'AI Assistant')}
-- Environment: {scenario_context.get('environment', 'General setting')}
-- Description: {scenario_context.get('description', '')}
-
-Your role: You are playing the character "{scenario_context.get('ai_character', 'AI Assistant')}" in a realistic practice scenario. Respond naturally and in character.
-"""
-            else:
-                context_prompt = f"""
-You are a helpful AI assistant for conversation practice.
-"""
-            
-            # Add conversation history if available
-            history_text = ""
-            if conversation_history and len(conversation_history) > 0:
-                history_text = "\n\nCONVERSATION HISTORY:\n"
-                for msg in conversation_history[-6:]:  # Last 6 messages for context
-                    role = msg.get('role', 'user')
-                    content = msg.get('content', '')
-                    if role == 'user':
-                        history_text += f"User: {content}\n"
-                    elif role == 'assistant':
-                        history_text += f"Assistant: {content}\n"
-            
-            # Build the final prompt
-            final_prompt = f"""{context_prompt}{history_text}
-
-USER'S MESSAGE: "{user_text}"
-
-Respond naturally as the character in this scenario. Keep your response conversational and appropriate for the context. If the user is continuing a previous topic, acknowledge that continuity.
-"""
+            final_prompt = build_chat_prompt(user_text, scenario_context, conversation_history)
             
-            response = self.model.generate_content(final_prompt)
+            response = cassette.gemini_generate_sync(self.model, final_prompt)
             reply = response.text.strip()
-            print(f"Generated reply: {reply}")
+            logging.debug("Generated reply", extra={"payload": {"reply": reply}})
             
             return reply
             
         except Exception as e:
-            print(f"Error in chat_with_context: {e}")
+            logging.exception("Error in chat_with_context")
             raise HTTPException(status_code=500, detail=str(e))
 
     def get_config(self) -> dict:
@@ -0,0 +1,272 @@
+"""Write-behind persistence for conversation messages.
+
+When ``WRITE_BEHIND_ENABLED`` is set, ``messageAgent`` stops awaiting Mongo on
+the request path. Appends are queued in process and flushed in batches, with
+consecutive appends for the same conversation coalesced into one
+``$push``/``$each`` update. Recent history for prompt building is served from
+an in-process per-conversation window that is loaded from Mongo on first use.
+Each flush is conditional on the conversation's stored ``seq``, so a window
+that went stale because another worker wrote to the same conversation is
+detected and dropped rather than overwriting history out of order.
+
+Durability modes (``WRITE_BEHIND_DURABILITY``):
+- ``memory``: a write is acknowledged as soon as it is queued.
+- ``batch``: callers can wait for the batch holding their write to be flushed
+  (group commit). ``messageAgent`` does this before returning, so the upstream
+  call and the Mongo write overlap instead of running back to back.
+"""
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from backend.services.concurrency import ConversationConflictError, seq_filter
+from backend.services.events import hub
+from backend.services.templates import templates
+
+load_dotenv()
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_DURABILITY = os.getenv("WRITE_BEHIND_DURABILITY", "batch").lower()
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "1000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+WRITE_BEHIND_WINDOW_SIZE = int(os.getenv("WRITE_BEHIND_WINDOW_SIZE", "50"))
+WRITE_BEHIND_MAX_WINDOWS = int(os.getenv("WRITE_BEHIND_MAX_WINDOWS", "1000"))
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", "10"))
+
+DURABILITY_MODES = ("memory", "batch")
+
+
+class _Window:
+    """Recent messages and last sequence number for one conversation."""
+
+    __slots__ = ("messages", "seq", "pending")
+
+    def __init__(self, messages: list, seq: int, size: int):
+        self.messages = deque(messages, maxlen=size)
+        self.seq = seq
+        # queued messages not yet flushed; windows with pending writes are never evicted
+        self.pending = 0
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        db,
+        *,
+        durability: str = WRITE_BEHIND_DURABILITY,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_ms: int = WRITE_BEHIND_FLUSH_MS,
+        window_size: int = WRITE_BEHIND_WINDOW_SIZE,
+        max_windows: int = WRITE_BEHIND_MAX_WINDOWS,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown write-behind durability: {durability}")
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.window_size = window_size
+        self.max_windows = max_windows
+        self._db = db
+        # Bounded queue: once full, append() blocks until the flusher catches up
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _get_window(self, conversation_id: str) -> _Window:
+        window = self._windows.get(conversation_id)
+        if window is None:
+            doc = await self._db.conversations.find_one(
+                {"_id": ObjectId(conversation_id)},
+                {"messages": {"$slice": -self.window_size}, "seq": 1},
+            ) or {}
+            messages = await templates.resolve(doc.get("messages", []), self._db)
+            # another coroutine may have loaded the window while we waited
+            window = self._windows.get(conversation_id)
+            if window is None:
+                window = _Window(messages, doc.get("seq", 0), self.window_size)
+                self._windows[conversation_id] = window
+                self._evict()
+        self._windows.move_to_end(conversation_id)
+        return window
+
+    def _evict(self):
+        for conversation_id in list(self._windows):
+            if len(self._windows) <= self.max_windows:
+                break
+            if self._windows[conversation_id].pending == 0:
+                del self._windows[conversation_id]
+
+    async def history(self, conversation_id: str, n: int = 50) -> list:
+        """Return up to the last ``n`` messages, including queued ones."""
+        window = await self._get_window(conversation_id)
+        return list(window.messages)[-n:]
+
+    async def append(self, conversation_id: str, role: str, content: str, *, max_messages: int = 200):
+        """Queue a message for persistence and add it to the window.
+
+        Returns a future resolved once the message is flushed in ``batch``
+        mode, or ``None`` in ``memory`` mode.
+        """
+        window = await self._get_window(conversation_id)
+        window.seq += 1
+        msg_doc = {"role": role, "content": content, "timestamp": datetime.utcnow(), "seq": window.seq}
+        window.messages.append(msg_doc)
+        window.pending += 1
+
+        future = asyncio.get_running_loop().create_future() if self.durability == "batch" else None
+        # the window is queued with the message: a reload after a failed flush creates a new one
+        await self._queue.put((conversation_id, msg_doc, max_messages, future, window))
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return future
+
+    async def wait_durable(self, *futures):
+        """Wait for writes returned by ``append`` to reach Mongo."""
+        pending = [f for f in futures if f is not None]
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if self._queue.qsize() + 1 < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+
+            batch = [first]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list):
+        grouped: "OrderedDict[str, list]" = OrderedDict()
+        for item in batch:
+            grouped.setdefault(item[0], []).append(item)
+
+        now = datetime.utcnow()
+        # tags every document this flush touches, to tell which conditional updates
+        # applied; removed again once the flush is settled
+        token = ObjectId()
+        ops = []
+        for conversation_id, items in grouped.items():
+            docs = sorted((item[1] for item in items), key=lambda m: m["seq"])
+            ops.append(
+                UpdateOne(
+                    {"_id": ObjectId(conversation_id), "seq": seq_filter(docs[0]["seq"] - 1)},
+                    {
+                        "$push": {"messages": {"$each": docs, "$slice": -items[-1][2]}},
+                        "$set": {"updated_at": now, "write_token": token},
+                        "$inc": {"seq": len(docs)},
+                    },
+                )
+            )
+
+        errors: dict = {}
+        try:
+            result = await self._db.conversations.bulk_write(ops, ordered=False)
+            if result.matched_count < len(ops):
+                errors = await self._find_conflicts(list(grouped), token)
+        except Exception as exc:
+            logging.exception("Write-behind flush of %d messages failed", len(batch))
+            errors = {conversation_id: exc for conversation_id in grouped}
+
+        for conversation_id, items in grouped.items():
+            error = errors.get(conversation_id)
+            for item in items:
+                item[4].pending -= 1
+            current = self._windows.get(conversation_id)
+            if error is not None and any(item[4] is current for item in items):
+                # reload from Mongo on next use rather than serve unpersisted history
+                del self._windows[conversation_id]
+            if error is None:
+                for item in items:
+                    hub.publish(conversation_id, item[1])
+            for item in items:
+                future = item[3]
+                if future is not None and not future.done():
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(None)
+        await self._clear_token(list(grouped), token)
+
+    async def _find_conflicts(self, conversation_ids: list, token: ObjectId) -> dict:
+        """Work out which conditional updates in a flush matched nothing."""
+        cursor = self._db.conversations.find(
+            {"_id": {"$in": [ObjectId(c) for c in conversation_ids]}, "write_token": token}, {"_id": 1}
+        )
+        applied = {str(doc["_id"]) async for doc in cursor}
+        errors = {}
+        for conversation_id in conversation_ids:
+            if conversation_id not in applied:
+                logging.error("Write-behind conflict on conversation %s; dropping its window", conversation_id)
+                errors[conversation_id] = ConversationConflictError(
+                    f"Conversation {conversation_id} was modified by another writer"
+                )
+        return errors
+
+    async def _clear_token(self, conversation_ids: list, token: ObjectId):
+        try:
+            await self._db.conversations.update_many(
+                {"_id": {"$in": [ObjectId(c) for c in conversation_ids]}, "write_token": token},
+                {"$unset": {"write_token": ""}},
+            )
+        except Exception:
+            # a leftover token is only a stray field; the next flush replaces it
+            logging.exception("Could not clear the write-behind token from %d conversations", len(conversation_ids))
+
+    async def close(self, timeout: float = WRITE_BEHIND_DRAIN_TIMEOUT):
+        """Flush everything still queued, then stop the flusher."""
+        if self._task is None:
+            return
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.error("Write-behind drain timed out with %d messages unflushed", self._queue.qsize())
+        self._task.cancel()
+        self._task = None
+
+
+# Module-level singleton, created by init_db when write-behind is enabled
+_write_queue: Optional[WriteBehindQueue] = None
+
+
+def start_write_behind(db) -> Optional[WriteBehindQueue]:
+    global _write_queue
+    if WRITE_BEHIND_ENABLED and _write_queue is None:
+        _write_queue = WriteBehindQueue(db)
+        _write_queue.start()
+    return _write_queue
+
+
+def get_write_queue() -> Optional[WriteBehindQueue]:
+    return _write_queue
+
+
+async def stop_write_behind():
+    global _write_queue
+    if _write_queue is not None:
+        await _write_queue.close()
+        _write_queue = None
@@ -396,6 +396,8 @@ function ChatPageClient({ slug }: { slug: string }) {
             
             const formData = new FormData()
             formData.append('audio_file', audioBlob, 'recording.webm')
+            // the conversation's language lets the backend skip language detection
+            if (doConversationID) formData.append('conversation_id', doConversationID)
             
             const response = await fetch('http://localhost:8000/audio/stt', {
               method: 'POST',
@@ -516,6 +518,8 @@ function ChatPageClient({ slug }: { slug: string }) {
                 try {
                   const ttsForm = new FormData()
                   ttsForm.append('text', assistantText)
+                  // lets the backend keep the clip for replays of this turn
+                  if (doConversationID) ttsForm.append('conversation_id', doConversationID)
                   const ttsRes = await fetch('http://localhost:8000/audio/tts', { method: 'POST', body: ttsForm })
                   if (ttsRes.ok) {
                     const audioBlobResp = await ttsRes.blob()
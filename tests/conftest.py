@@ -0,0 +1,30 @@
+import pytest
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+
+from backend.services import stand_ins
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["atlastalk_test"]
+
+
+@pytest.fixture
+def providers():
+    """Provider stand-ins; call ``providers.install(latency_ms)`` to slow them down."""
+    stand_ins.install(0)
+    yield stand_ins
+    stand_ins.install(0)
+
+
+@pytest.fixture
+def app(db, providers):
+    from backend.routes.agents import router as agents
+    from backend.routes.conversation_routes import router as conversations
+
+    app = FastAPI()
+    app.include_router(agents)
+    app.include_router(conversations)
+    app.state._mongo_db = db
+    return app
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.services import admin
+from backend.services.agent_registry import DEFAULT_ENDPOINTS, AgentRegistry
+
+
+def test_reload_requires_the_admin_token(app, monkeypatch):
+    with TestClient(app) as client:
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+        assert client.post("/agents/reload").status_code == 404
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+        assert client.post("/agents/reload").status_code == 401
+        assert client.post("/agents/reload", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+def test_agents_from_mongo_only_get_keys_for_trusted_endpoints(db, monkeypatch):
+    monkeypatch.setenv("TAXI_PRIVATE_KEY", "taxi-key")
+    registry = AgentRegistry("mongo")
+    registry._db = db
+
+    async def run():
+        await db.agents.insert_many([
+            {"_id": "TAXI", "endpoint": DEFAULT_ENDPOINTS["TAXI"]},
+            # a document pointing a key at an endpoint nobody configured
+            {"_id": "EVIL", "endpoint": "https://collector.example", "key_env": "TAXI_PRIVATE_KEY"},
+        ])
+        registry._apply(await registry._load_specs())
+        return await registry.probe("EVIL")
+
+    health = asyncio.run(run())
+
+    status = {item["agent"]: item["credentials"] for item in registry.status()}
+    assert status == {"TAXI": True, "EVIL": False}
+    assert registry._current()["EVIL"].key is None
+    with pytest.raises(RuntimeError, match="not trusted"):
+        registry.client("EVIL")
+    assert health["healthy"] is False and "not trusted" in health["error"]
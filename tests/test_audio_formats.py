@@ -0,0 +1,34 @@
+import pytest
+
+from backend.services import audio_formats
+from backend.services.audio_formats import negotiate_format
+
+
+def test_explicit_format_wins_and_unknown_names_are_rejected():
+    assert negotiate_format("opus", "audio/mpeg", "mp3_low") == "opus"
+    with pytest.raises(ValueError):
+        negotiate_format("wav", None)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("audio/ogg", "opus"),
+        ("audio/mpeg;q=0.5, audio/ogg;q=0.9", "opus"),
+        # equal quality: the first listed wins
+        ("audio/L16, audio/mpeg", "pcm"),
+        # refused or unknown types fall through to the profile's format
+        ("audio/ogg;q=0, audio/wav", "mp3_low"),
+        ("*/*", "mp3_low"),
+    ],
+)
+def test_accept_header(accept, expected):
+    assert negotiate_format(None, accept, "mp3_low") == expected
+
+
+def test_without_a_preference_the_profile_then_the_server_default_applies(monkeypatch):
+    assert negotiate_format(None, None, "opus") == "opus"
+    monkeypatch.setattr(audio_formats, "TTS_DEFAULT_FORMAT", "mp3_low")
+    assert negotiate_format(None, None, None) == "mp3_low"
+    monkeypatch.setattr(audio_formats, "TTS_DEFAULT_FORMAT", "flac")
+    assert negotiate_format(None, None, "unknown") == "mp3"
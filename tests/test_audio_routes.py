@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.routes import audio_routes
+from backend.services import usage
+from backend.services.usage import UsageLedger
+from backend.services.voice_profiles import conversation_profiles
+
+
+def _client(app):
+    app.include_router(audio_routes.router)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_stt_usage_is_attributed_to_the_conversations_agent_and_owner(app, db, monkeypatch, cached):
+    ledger = UsageLedger(db)
+    monkeypatch.setattr(usage, "_ledger", ledger)
+
+    async def transcribe(path, language_code=None):
+        return "hola"
+
+    monkeypatch.setattr(audio_routes, "speech_to_text", transcribe)
+    with _client(app) as client:
+        setup = client.post(
+            "/agents/TAXI/setup", json={"country": "Spain", "language": "Spanish", "user_id": "learner-1"}
+        ).json()
+        if not cached:
+            # another worker: the owner comes from the stored conversation
+            conversation_profiles._sessions.clear()
+        response = client.post(
+            "/audio/stt",
+            files={"audio_file": ("a.webm", b"\0" * 4000, "audio/webm")},
+            data={"conversation_id": setup["conversation_id"]},
+        )
+    assert response.json() == {"transcription": "hola"}
+    assert ledger._deltas[("agent", "TAXI")]["stt_seconds"] > 0
+    assert ledger._deltas[("user", "learner-1")]["stt_seconds"] > 0
+
+
+def test_malformed_conversation_id_is_rejected(app):
+    with _client(app) as client:
+        tts = client.post("/audio/tts", data={"text": "hola", "conversation_id": "not-an-id"})
+        stt = client.post(
+            "/audio/stt",
+            files={"audio_file": ("a.webm", b"\0" * 100, "audio/webm")},
+            data={"conversation_id": "not-an-id"},
+        )
+    assert (tts.status_code, stt.status_code) == (400, 400)
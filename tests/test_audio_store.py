@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from backend.services import audio_store
+from backend.services.audio_store import AudioStore, RangeNotSatisfiable, parse_range
+
+CLIP = bytes(range(100))
+LINK = {"file_id": ObjectId(), "format": "mp3", "media_type": "audio/mpeg", "length": len(CLIP), "etag": "abc"}
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, None),
+        ("bytes=0-9", (0, 9)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=50-500", (50, 99)),
+        ("bytes=0-9, 20-29", None),
+        ("items=0-9", None),
+        ("bytes=a-b", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CLIP)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=9-5", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, len(CLIP))
+
+
+class _GridOut:
+    def __init__(self, data: bytes):
+        self._data, self._pos = data, 0
+
+    def seek(self, pos: int):
+        self._pos = pos
+
+    async def read(self, size: int) -> bytes:
+        data = self._data[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+
+class _Store:
+    read_range = AudioStore.read_range
+
+    async def open(self, link):
+        return _GridOut(CLIP)
+
+
+@pytest.fixture
+def client(app, db, monkeypatch):
+    monkeypatch.setattr(audio_store, "_store", _Store())
+    monkeypatch.setattr(audio_store, "AUDIO_READ_CHUNK_BYTES", 7)
+    oid = ObjectId()
+    asyncio.run(db.conversations.insert_one({"_id": oid, "seq": 1, "messages": [{"seq": 1, "role": "assistant", "audio": LINK}]}))
+    with TestClient(app) as client:
+        client.url = f"/conversations/{oid}/messages/1/audio"
+        yield client
+
+
+def test_whole_clip_and_single_ranges(client):
+    whole = client.get(client.url)
+    suffix = client.get(client.url, headers={"Range": "bytes=-10"})
+    open_ended = client.get(client.url, headers={"Range": "bytes=95-"})
+
+    assert (whole.status_code, whole.content) == (200, CLIP)
+    assert whole.headers["etag"] == '"abc"'
+    assert (suffix.status_code, suffix.content) == (206, CLIP[90:])
+    assert suffix.headers["content-range"] == "bytes 90-99/100"
+    assert (open_ended.status_code, open_ended.content) == (206, CLIP[95:])
+
+
+def test_unsatisfiable_and_multi_ranges(client):
+    outside = client.get(client.url, headers={"Range": "bytes=200-"})
+    multi = client.get(client.url, headers={"Range": "bytes=0-9, 20-29"})
+
+    assert outside.status_code == 416
+    assert outside.headers["content-range"] == "bytes */100"
+    assert (multi.status_code, multi.content) == (200, CLIP)
+
+
+def test_conditional_requests(client):
+    cached = client.get(client.url, headers={"If-None-Match": '"abc"'})
+    current = client.get(client.url, headers={"Range": "bytes=0-9", "If-Range": '"abc"'})
+    outdated = client.get(client.url, headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+
+    assert (cached.status_code, cached.content) == (304, b"")
+    assert (current.status_code, current.content) == (206, CLIP[:10])
+    assert (outdated.status_code, outdated.content) == (200, CLIP)
+
+
+class _Bucket:
+    def __init__(self, db, bucket_name):
+        self._files = db[f"{bucket_name}.files"]
+
+    async def delete(self, file_id):
+        await self._files.delete_one({"_id": file_id})
+
+
+def test_retention_drops_the_oldest_clips_over_the_cap(db, monkeypatch):
+    monkeypatch.setattr(audio_store, "AsyncIOMotorGridFSBucket", _Bucket)
+    store = AudioStore(db, retention_bytes=100)
+    conversation_id = ObjectId()
+    now = datetime.utcnow()
+    files = [
+        {
+            "_id": ObjectId(),
+            "length": 40,
+            "uploadDate": now - timedelta(minutes=age),
+            "metadata": {"owner": "user:u1", "conversation_id": str(conversation_id), "seq": seq},
+        }
+        for seq, age in [(1, 3), (2, 2), (3, 1)]
+    ]
+    other = {**files[0], "_id": ObjectId(), "metadata": {**files[0]["metadata"], "owner": "user:u2"}}
+
+    async def run():
+        await db["audio.files"].insert_many(files + [other])
+        await db.conversations.insert_one({
+            "_id": conversation_id,
+            "messages": [{"seq": f["metadata"]["seq"], "audio": {"file_id": f["_id"]}} for f in files],
+        })
+        freed = await store.enforce_retention("user:u1")
+        kept = [f["_id"] async for f in db["audio.files"].find({})]
+        doc = await db.conversations.find_one({"_id": conversation_id})
+        return freed, kept, doc
+
+    freed, kept, doc = asyncio.run(run())
+
+    assert freed == 40
+    assert kept == [f["_id"] for f in files[1:]] + [other["_id"]]
+    assert ["audio" in m for m in doc["messages"]] == [False, True, True]
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.services import cancellation
+from backend.services.cancellation import DeadlineExceededError, remaining, run_request
+
+
+class _Request:
+    def __init__(self, disconnect_after: float = None):
+        self.disconnect_after = disconnect_after
+        self.started = None
+
+    async def is_disconnected(self) -> bool:
+        loop = asyncio.get_running_loop()
+        if self.started is None:
+            self.started = loop.time()
+        return self.disconnect_after is not None and loop.time() - self.started >= self.disconnect_after
+
+
+def _slow_call(state: dict):
+    async def call():
+        state["budget"] = remaining()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    return call
+
+
+def test_disconnect_cancels_the_work_with_499(monkeypatch):
+    monkeypatch.setattr(cancellation, "DISCONNECT_POLL_SECONDS", 0.01)
+    state = {}
+
+    async def run():
+        with pytest.raises(HTTPException) as exc:
+            await run_request(_Request(disconnect_after=0), _slow_call(state), deadline=5)
+        return exc.value.status_code
+
+    assert asyncio.run(run()) == 499
+    assert state["cancelled"]
+    assert 0 < state["budget"] <= 5
+
+
+def test_deadline_cancels_the_work_with_504(monkeypatch):
+    monkeypatch.setattr(cancellation, "DISCONNECT_POLL_SECONDS", 0.01)
+    state = {}
+
+    async def run():
+        with pytest.raises(HTTPException) as exc:
+            await run_request(_Request(), _slow_call(state), deadline=0.05)
+        return exc.value.status_code
+
+    assert asyncio.run(run()) == 504
+    assert state["cancelled"]
+
+
+def test_result_is_returned_and_the_deadline_does_not_leak():
+    async def run():
+        async def call():
+            return remaining()
+
+        left = await run_request(_Request(), call, deadline=5)
+        return left, remaining(1.5)
+
+    left, outside = asyncio.run(run())
+    assert 0 < left <= 5
+    assert outside == 1.5
+
+
+def test_remaining_raises_once_the_deadline_passed():
+    token = cancellation._deadline.set(0.0)
+    try:
+        with pytest.raises(DeadlineExceededError):
+            remaining()
+    finally:
+        cancellation._deadline.reset(token)
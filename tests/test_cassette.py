@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from backend.services import cassette
+from backend.services.cassette import Cassette, CassetteMissError
+
+
+class _Completions:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        reply = f"respuesta {len(self.calls)}"
+        message = cassette._Namespace(content=reply)
+        usage = cassette._Namespace(prompt_tokens=12, completion_tokens=3)
+        return cassette._Namespace(choices=[cassette._Namespace(message=message, finish_reason="stop")], usage=usage)
+
+
+class _Client:
+    base_url = "https://agent.example/api/v1/"
+
+    def __init__(self):
+        self.chat = cassette._Namespace(completions=_Completions())
+
+
+def _mode(monkeypatch, path, mode: str):
+    monkeypatch.setattr(cassette, "_cassette", Cassette(str(path)))
+    monkeypatch.setattr(cassette, "RECORDING", mode == "record")
+    monkeypatch.setattr(cassette, "REPLAYING", mode == "replay")
+    monkeypatch.setattr(cassette, "REPLAY_SPEED", 0)
+
+
+def _messages(text: str) -> list:
+    return [{"role": "user", "content": text}]
+
+
+def test_replay_returns_recordings_in_order_and_ignores_timeouts(monkeypatch, tmp_path):
+    path = tmp_path / "providers.jsonl.gz"
+    live = _Client()
+
+    async def calls(client):
+        replies = []
+        for _ in range(2):
+            response = await cassette.chat_completion(client, model="m", messages=_messages("hola"), timeout=5)
+            replies.append((response.choices[0].message.content, response.usage.completion_tokens))
+        return replies
+
+    _mode(monkeypatch, path, "record")
+    recorded = asyncio.run(calls(live))
+
+    _mode(monkeypatch, path, "replay")
+    offline = _Client()
+
+    async def replay():
+        replies = await calls(offline)
+        # a timeout does not change the answer, so it is not part of the match
+        extra = await cassette.chat_completion(offline, model="m", messages=_messages("hola"), timeout=60)
+        return replies, extra.choices[0].message.content
+
+    replayed, past_the_end = asyncio.run(replay())
+
+    assert recorded == replayed == [("respuesta 1", 3), ("respuesta 2", 3)]
+    assert past_the_end == "respuesta 2"
+    assert offline.chat.completions.calls == []
+
+
+def test_an_unrecorded_request_is_a_miss(monkeypatch, tmp_path):
+    path = tmp_path / "providers.jsonl.gz"
+    _mode(monkeypatch, path, "record")
+    asyncio.run(cassette.chat_completion(_Client(), model="m", messages=_messages("hola")))
+
+    _mode(monkeypatch, path, "replay")
+    with pytest.raises(CassetteMissError):
+        asyncio.run(cassette.chat_completion(_Client(), model="m", messages=_messages("adiós")))
+
+
+def test_streams_replay_chunk_by_chunk(monkeypatch, tmp_path):
+    path = tmp_path / "providers.jsonl.gz"
+
+    async def upstream():
+        for chunk in (b"ID3", b"\x00\x01", b"\xff"):
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in cassette.stream("tts_stream", {"text": "hola"}, upstream)]
+
+    _mode(monkeypatch, path, "record")
+    recorded = asyncio.run(collect())
+    _mode(monkeypatch, path, "replay")
+    assert asyncio.run(collect()) == recorded == [b"ID3", b"\x00\x01", b"\xff"]
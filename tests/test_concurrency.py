@@ -0,0 +1,134 @@
+import asyncio
+
+import httpx
+import pytest
+from bson import ObjectId
+
+from backend.services import concurrency
+from backend.services.concurrency import ConversationBusyError, ConversationConflictError, conversation_lock
+from backend.services.conversation import append_message, setupAgent
+from backend.services.write_behind import WriteBehindQueue
+
+
+async def _conversation(db, seq=0) -> str:
+    oid = ObjectId()
+    await db.conversations.insert_one({"_id": oid, "messages": [], "seq": seq})
+    return str(oid)
+
+
+def test_lock_without_timeout_rejects_a_second_turn():
+    async def run():
+        async with conversation_lock("c1", timeout=0):
+            with pytest.raises(ConversationBusyError):
+                async with conversation_lock("c1", timeout=0):
+                    pass
+            # other conversations are not blocked
+            async with conversation_lock("c2", timeout=0):
+                pass
+        assert concurrency._locks == {}
+
+    asyncio.run(run())
+
+
+def test_lock_wait_times_out_without_keeping_the_lock():
+    async def run():
+        async with conversation_lock("c1"):
+            with pytest.raises(ConversationBusyError):
+                async with conversation_lock("c1", timeout=0.01):
+                    pass
+        # the timed-out waiter does not take the lock once it is released
+        await asyncio.sleep(0)
+        async with conversation_lock("c1", timeout=0):
+            pass
+        assert concurrency._locks == {}
+
+    asyncio.run(run())
+
+
+def test_lock_acquired_as_the_wait_times_out_is_released(monkeypatch):
+    async def late_wait_for(awaitable, timeout):
+        await awaitable
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(concurrency.asyncio, "wait_for", late_wait_for)
+
+    async def run():
+        lock = asyncio.Lock()
+        assert not await concurrency.acquire_within(lock, 1)
+        return lock.locked()
+
+    assert asyncio.run(run()) is False
+
+
+def test_append_with_stale_seq_conflicts(db):
+    async def run():
+        conversation_id = await _conversation(db)
+        stored = await append_message(conversation_id, "user", "hola", db=db, expected_seq=0)
+        assert stored["seq"] == 1
+        with pytest.raises(ConversationConflictError):
+            await append_message(conversation_id, "user", "otra vez", db=db, expected_seq=0)
+        doc = await db.conversations.find_one({"_id": ObjectId(conversation_id)})
+        assert doc["seq"] == 1
+        assert [m["content"] for m in doc["messages"]] == ["hola"]
+
+    asyncio.run(run())
+
+
+def test_concurrent_turns_return_409(app, db, providers, monkeypatch):
+    monkeypatch.setattr(concurrency, "CONVERSATION_LOCK_TIMEOUT", 0)
+    providers.install(200)
+
+    async def run():
+        await setupAgent("TAXI", "Spain", "Spanish", db=db)
+        doc = await db.conversations.find_one({"agent": "TAXI"})
+        url = f"/conversations/{doc['_id']}/messages"
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first, second = await asyncio.gather(
+                client.post(url, json={"role": "user", "content": "hola"}),
+                client.post(url, json={"role": "user", "content": "hola otra vez"}),
+            )
+        return sorted([first.status_code, second.status_code])
+
+    assert asyncio.run(run()) == [200, 409]
+
+
+def test_flush_conflict_fails_the_writes_and_drops_the_window(db):
+    async def run():
+        conversation_id = await _conversation(db)
+        queue = WriteBehindQueue(db, durability="batch", batch_size=10, flush_ms=1)
+        first = await queue.append(conversation_id, "user", "a")
+        second = await queue.append(conversation_id, "assistant", "b")
+        # another worker appends before the flush
+        await db.conversations.update_one({"_id": ObjectId(conversation_id)}, {"$inc": {"seq": 1}})
+        queue.start()
+        with pytest.raises(ConversationConflictError):
+            await queue.wait_durable(first, second)
+        assert conversation_id not in queue._windows
+
+        # the reloaded window continues from the stored seq
+        third = await queue.append(conversation_id, "user", "c")
+        await queue.wait_durable(third)
+        window = queue._windows[conversation_id]
+        assert (window.seq, window.pending) == (2, 0)
+        await queue.close()
+        assert "write_token" not in await db.conversations.find_one({"_id": ObjectId(conversation_id)})
+
+    asyncio.run(run())
+
+
+def test_flush_coalesces_appends_per_conversation(db):
+    async def run():
+        ids = [await _conversation(db) for _ in range(2)]
+        queue = WriteBehindQueue(db, durability="batch", batch_size=10, flush_ms=1)
+        futures = [await queue.append(c, "user", str(i)) for i in range(3) for c in ids]
+        queue.start()
+        await queue.wait_durable(*futures)
+        await queue.close()
+        for conversation_id in ids:
+            doc = await db.conversations.find_one({"_id": ObjectId(conversation_id)})
+            assert doc["seq"] == 3
+            assert [(m["seq"], m["content"]) for m in doc["messages"]] == [(1, "0"), (2, "1"), (3, "2")]
+            assert "write_token" not in doc
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.services import audio_store
+
+
+@pytest.mark.parametrize(
+    "method, path, body",
+    [
+        ("get", "/conversations/not-an-id", None),
+        ("post", "/conversations/not-an-id/messages", {"role": "user", "content": "Hola"}),
+        ("post", "/conversations/not-an-id/end", None),
+        ("get", "/conversations/not-an-id/messages/1/audio", None),
+        ("get", "/conversations/not-an-id/events", None),
+    ],
+)
+def test_malformed_conversation_ids_are_rejected(app, monkeypatch, method, path, body):
+    monkeypatch.setattr(audio_store, "_store", object())
+
+    with TestClient(app) as client:
+        response = client.request(method.upper(), path, json=body)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid conversation_id"
@@ -0,0 +1,57 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from backend.services import degradation as degradation_module
+from backend.services.conversation import messageAgent, setupAgent, trim_history
+from backend.services.degradation import ASYNC_GOALS, REDUCED_HISTORY, degradation
+
+
+def _messages(n):
+    return [{"role": "system", "content": "prompt"}] + [{"role": "user", "content": str(i)} for i in range(n)]
+
+
+def test_trim_history_keeps_the_system_prompt():
+    messages = _messages(20)
+    trimmed = trim_history(messages, 5)
+    assert [m["content"] for m in trimmed] == ["prompt", "16", "17", "18", "19"]
+    assert trim_history(messages, 50) is messages
+    assert trim_history(messages[1:], 3) == messages[-3:]
+
+
+def test_reduced_history_still_sends_the_system_prompt(db, providers, monkeypatch):
+    monkeypatch.setattr(degradation_module, "DEGRADED_HISTORY_SIZE", 4)
+    monkeypatch.setattr(type(degradation), "level", property(lambda self: REDUCED_HISTORY))
+    sent = []
+    original = providers.StandInAsyncOpenAI
+
+    async def run():
+        await setupAgent("TAXI", "Spain", "Spanish", db=db)
+        doc = await db.conversations.find_one({"agent": "TAXI"})
+        client = original(base_url="http://stand-in", api_key="stand-in")
+        create = client.chat.completions.create
+
+        async def record(**kwargs):
+            sent.append(kwargs["messages"])
+            return await create(**kwargs)
+
+        client.chat.completions.create = record
+        for i in range(6):
+            await messageAgent(client, str(doc["_id"]), "user", f"turn {i}", db=db)
+
+    asyncio.run(run())
+    last = sent[-1]
+    assert len(last) == 4
+    assert last[0] == {"role": "system", "content": "Your country is set to Spain, and your language is Spanish."}
+
+
+def test_goal_checks_stay_synchronous_by_default(app, db, monkeypatch):
+    monkeypatch.setattr(type(degradation), "level", property(lambda self: ASYNC_GOALS))
+    with TestClient(app) as client:
+        setup = client.post("/agents/TAXI/setup", json={"country": "Spain", "language": "Spanish"}).json()
+        reply = client.post(
+            f"/conversations/{setup['gemini_conversation_id']}/messages",
+            json={"role": "user", "content": "gen goals"},
+        ).json()
+    assert reply.get("pending") is None
+    assert '"goals"' in reply["assistant"]
@@ -0,0 +1,26 @@
+import asyncio
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from backend.services.events import hub
+
+
+def test_plain_conversation_messages_are_tagged_and_published(app, db):
+    with TestClient(app) as client:
+        conversation_id = client.post("/conversations").json()["conversation_id"]
+        sub = hub.subscribe([conversation_id])
+        try:
+            for text in ("hola", "adiós"):
+                assert client.post(
+                    f"/conversations/{conversation_id}/messages", json={"role": "user", "content": text}
+                ).json() == {"ok": True}
+            events, resync = sub.drain()
+        finally:
+            hub.unsubscribe(sub)
+
+    assert not resync
+    assert [(m["seq"], m["content"]) for _, m in events] == [(1, "hola"), (2, "adiós")]
+    doc = asyncio.run(db.conversations.find_one({"_id": ObjectId(conversation_id)}))
+    assert doc["seq"] == 2
+    assert [m["seq"] for m in doc["messages"]] == [1, 2]
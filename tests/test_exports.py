@@ -0,0 +1,32 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes import export_routes
+from backend.services import admin
+
+
+def _client(db):
+    app = FastAPI()
+    app.include_router(export_routes.router)
+    app.state._mongo_db = db
+    return TestClient(app)
+
+
+def test_export_is_disabled_without_a_token(db, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+    assert _client(db).get("/exports/conversations").status_code == 404
+
+
+def test_export_requires_the_token(db, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+    client = _client(db)
+    assert client.get("/exports/conversations").status_code == 401
+    assert client.get("/exports/conversations", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+
+def test_export_throttle_cannot_be_disabled(db, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+    response = _client(db).get(
+        "/exports/conversations?max_docs_per_second=0", headers={"Authorization": "Bearer s3cret"}
+    )
+    assert response.status_code == 422
@@ -0,0 +1,13 @@
+from backend.services.farewell import Farewell, FarewellCache
+
+
+def test_prepared_audio_is_only_served_to_its_conversation():
+    cache = FarewellCache()
+    cache._state("c1").farewell = Farewell("¡Adiós!", 7, 0, b"clip", "mp3")
+    cache._state("c2")
+
+    assert cache.audio("c1", "¡Adiós!", "mp3") == b"clip"
+    # same text from another conversation, another text, another format
+    assert cache.audio("c2", "¡Adiós!", "mp3") is None
+    assert cache.audio("c1", "Hasta luego", "mp3") is None
+    assert cache.audio("c1", "¡Adiós!", "opus") is None
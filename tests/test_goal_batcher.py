@@ -0,0 +1,64 @@
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+from backend.services import cancellation
+from backend.services.goal_batcher import GoalBatcher, split_usage
+from backend.services.stand_ins import StandInGenerativeModel
+
+
+class CountingModel(StandInGenerativeModel):
+    """Stand-in Gemini model that reports token usage and records request options."""
+
+    def __init__(self):
+        super().__init__("counting")
+        self.calls = []
+
+    async def generate_content_async(self, prompt, **kwargs):
+        text = self._answer(prompt)
+        usage = SimpleNamespace(prompt_token_count=len(prompt), candidates_token_count=len(text))
+        self.calls.append({**kwargs, "usage": usage})
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def _batcher():
+    batcher = GoalBatcher("counting", max_items=8, min_window_ms=5, max_window_ms=5)
+    batcher._model = CountingModel()
+    return batcher
+
+
+def test_split_usage_is_proportional():
+    assert split_usage((100, 10), ["a" * 30, "b" * 10], ["x", "yyy"]) == [(75, 2), (25, 8)]
+
+
+def test_batched_checks_share_one_call_and_its_tokens():
+    async def run():
+        batcher = _batcher()
+        prompts = [f"User: hola {i}\n\nUser: gen goals" for i in range(3)]
+        results = await asyncio.gather(*(batcher.submit(p) for p in prompts))
+        return batcher, results
+
+    batcher, results = asyncio.run(run())
+    (call,) = batcher._model.calls
+    assert not batcher._sending
+    for text, (prompt_tokens, completion_tokens) in results:
+        assert json.loads(text)["goals"]
+        assert prompt_tokens > 0 and completion_tokens > 0
+    # the shares add up to the batch's usage, give or take rounding
+    assert abs(sum(usage[0] for _, usage in results) - call["usage"].prompt_token_count) <= 2
+    assert abs(sum(usage[1] for _, usage in results) - call["usage"].candidates_token_count) <= 2
+
+
+def test_batched_call_is_bounded_by_the_callers_deadline():
+    async def run():
+        batcher = _batcher()
+        token = cancellation._deadline.set(time.monotonic() + 5)
+        try:
+            await asyncio.gather(batcher.submit("User: a\n\nUser: gen goals"), batcher.submit("User: b"))
+        finally:
+            cancellation._deadline.reset(token)
+        return batcher._model.calls
+
+    (call,) = asyncio.run(run())
+    assert 0 < call["request_options"]["timeout"] <= 5
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.services.idempotency import IdempotencyStore, run_idempotent
+
+
+def test_a_repeat_attaches_to_the_in_flight_call_then_replays_its_result():
+    store = IdempotencyStore()
+    calls, replays = [], []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"reply": len(calls)}
+
+    async def run():
+        first = asyncio.ensure_future(store.run("k", work, "fp"))
+        await asyncio.sleep(0)
+        second = await store.run("k", work, "fp", on_replay=lambda: replays.append(1))
+        third = await store.run("k", work, "fp", on_replay=lambda: replays.append(1))
+        return await first, second, third
+
+    assert asyncio.run(run()) == ({"reply": 1},) * 3
+    assert (len(calls), len(replays)) == (1, 2)
+
+
+def test_the_call_survives_its_first_caller_while_a_repeat_waits():
+    store = IdempotencyStore()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(store.run("k", work))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(store.run("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_failures_are_not_cached_and_a_changed_payload_is_rejected():
+    store = IdempotencyStore()
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await store.run("k", flaky, "fp")
+        assert await store.run("k", flaky, "fp") == "ok"
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+
+
+def test_route_helper_maps_key_reuse_to_422():
+    async def run():
+        async def work():
+            return "ok"
+
+        assert await run_idempotent("key", "tests", work, "hola") == "ok"
+        with pytest.raises(HTTPException) as exc:
+            await run_idempotent("key", "tests", work, "adiós")
+        return exc.value.status_code
+
+    assert asyncio.run(run()) == 422
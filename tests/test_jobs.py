@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.services import jobs
+from backend.services.jobs import DONE, FAILED, QUEUED, RUNNING, JobRunner
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Registers ``echo`` (fails while ``calls["fail"]``) and records its calls."""
+    monkeypatch.setattr(jobs, "_types", {})
+    calls = {"fail": False, "runs": []}
+
+    async def echo(payload, db):
+        calls["runs"].append((payload, db))
+        if calls["fail"]:
+            raise RuntimeError("upstream down")
+
+    jobs.register("echo", echo, max_attempts=2, backoff_seconds=60)
+    return calls
+
+
+def test_dedup_keeps_one_active_job_per_key(db, calls):
+    runner = JobRunner(db, worker_id="w1")
+
+    async def run():
+        await runner._ensure_indexes()
+        first = await runner.enqueue("echo", {"n": 1}, dedup_key="k")
+        again = await runner.enqueue("echo", {"n": 2}, dedup_key="k")
+        other = await runner.enqueue("echo", {"n": 3}, dedup_key="other")
+        job = await runner._claim(jobs._types["echo"])
+        await runner._run(jobs._types["echo"], job)
+        after = await runner.enqueue("echo", {"n": 4}, dedup_key="k")
+        return first, again, other, after
+
+    first, again, other, after = asyncio.run(run())
+
+    assert first == again
+    assert len({first, other, after}) == 3
+    assert calls["runs"] == [({"n": 1}, db)]
+
+
+def test_failed_attempts_are_retried_with_backoff_then_failed(db, calls):
+    calls["fail"] = True
+    runner = JobRunner(db, worker_id="w1")
+    echo = jobs._types["echo"]
+
+    async def run():
+        await runner.enqueue("echo", dedup_key="k")
+        await runner._run(echo, await runner._claim(echo))
+        retried = await db.jobs.find_one({})
+        # not due yet
+        early = await runner._claim(echo)
+        await db.jobs.update_one({}, {"$set": {"run_at": datetime.utcnow()}})
+        await runner._run(echo, await runner._claim(echo))
+        return retried, early, await db.jobs.find_one({})
+
+    retried, early, failed = asyncio.run(run())
+
+    assert (retried["status"], retried["attempts"], retried["last_error"]) == (QUEUED, 1, "RuntimeError: upstream down")
+    assert retried["run_at"] > datetime.utcnow() + timedelta(seconds=30)
+    assert early is None
+    assert (failed["status"], failed["attempts"]) == (FAILED, 2)
+    assert "active_key" not in failed
+    assert (runner.retried, runner.failed) == ({"echo": 1}, {"echo": 1})
+
+
+def test_an_expired_lease_is_claimed_by_another_worker(db, calls):
+    dead, alive = JobRunner(db, worker_id="dead"), JobRunner(db, worker_id="alive")
+    echo = jobs._types["echo"]
+
+    async def run():
+        await dead.enqueue("echo", {"n": 1})
+        held = await dead._claim(echo)
+        leased = await alive._claim(echo)
+        await db.jobs.update_one({}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+        taken = await alive._claim(echo)
+        await alive._run(echo, taken)
+        # the dead worker's late result is ignored
+        await dead._settle(echo, held, "too late")
+        return held, leased, taken, await db.jobs.find_one({})
+
+    held, leased, taken, job = asyncio.run(run())
+
+    assert held["status"] == RUNNING and leased is None
+    assert (taken["lease_owner"], taken["attempts"]) == ("alive", 2)
+    assert (job["status"], job.get("last_error")) == (DONE, None)
+
+
+def test_a_lease_expired_on_the_last_attempt_is_not_run_again(db, calls):
+    runner = JobRunner(db, worker_id="w1")
+    echo = jobs._types["echo"]
+
+    async def run():
+        await runner.enqueue("echo")
+        await db.jobs.update_one({}, {"$set": {
+            "status": RUNNING, "attempts": 2, "lease_until": datetime.utcnow() - timedelta(seconds=1),
+        }})
+        await runner._run(echo, await runner._claim(echo))
+        return await db.jobs.find_one({})
+
+    job = asyncio.run(run())
+
+    assert (job["status"], job["last_error"]) == (FAILED, "lease expired")
+    assert calls["runs"] == []
+
+
+def test_without_a_runner_handlers_get_the_app_database(db, calls, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_ENABLED", False)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await jobs.enqueue("echo", {"n": 1})
+        assert jobs.start_job_runner(db) is None
+        try:
+            await jobs.enqueue("echo", {"n": 2})
+            await asyncio.gather(*jobs._local)
+        finally:
+            await jobs.stop_job_runner()
+
+    asyncio.run(run())
+
+    assert calls["runs"] == [({"n": 2}, db)]
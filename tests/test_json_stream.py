@@ -0,0 +1,56 @@
+import pytest
+
+from backend.models.goals import GoalState
+from backend.services.json_stream import JSONExtractError, JSONExtractor, extract_json
+
+REPLY = '{"goals": [{"goal": "Pedir la cuenta", "completed": true}, {"goal": "Dar las gracias", "completed": false}]}'
+GOALS = {
+    "goals": [
+        {"goal": "Pedir la cuenta", "completed": True},
+        {"goal": "Dar las gracias", "completed": False},
+    ]
+}
+
+
+def _feed(text: str, size: int):
+    extractor = JSONExtractor(GoalState)
+    events = []
+    for i in range(0, len(text), size):
+        events += extractor.feed(text[i:i + size])
+    return extractor.close(), events
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_chunk_boundaries_do_not_change_the_result(size):
+    result, events = _feed(f"Sure! {REPLY}", size)
+
+    assert result.model_dump() == GOALS
+    assert [path for path, _ in events] == [("goals", 0), ("goals", 1), ("goals",), ()]
+    assert events[0][1] == GOALS["goals"][0]
+
+
+def test_code_fence_and_trailing_commas():
+    text = '```json\n{"goals": [{"goal": "Pedir la cuenta", "completed": true,},,],}\n```'
+
+    assert extract_json(text) == {"goals": [{"goal": "Pedir la cuenta", "completed": True}]}
+
+
+@pytest.mark.parametrize("size", [1, 1000])
+def test_bracketed_prose_before_the_value_is_skipped(size):
+    result, _ = _feed(f"Here are the goals [updated] (see [notes]): {REPLY}", size)
+
+    assert result.model_dump() == GOALS
+
+
+def test_a_broken_value_with_content_is_not_skipped():
+    with pytest.raises(JSONExtractError, match="Unexpected"):
+        extract_json('{"goals": oops} {"goals": []}')
+
+
+def test_schema_mismatch_and_missing_value():
+    with pytest.raises(JSONExtractError, match="schema"):
+        extract_json('{"goals": [{"completed": true}]}', GoalState)
+    with pytest.raises(JSONExtractError, match="No JSON value"):
+        extract_json("I could not decide.", GoalState)
+    with pytest.raises(JSONExtractError, match="Incomplete"):
+        extract_json('{"goals": [', GoalState)
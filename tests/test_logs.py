@@ -0,0 +1,56 @@
+import json
+import logging
+import queue
+
+from backend.services import logs
+from backend.services.logs import JSONFormatter, SamplingFilter, log_context, scrub
+
+
+def _logger(log_queue: queue.Queue) -> logging.Logger:
+    handler = logs._QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    logger = logging.getLogger("tests.logs")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_payloads_are_redacted_and_credentials_masked(monkeypatch):
+    payload = {"reply": "Hola, ¿qué tal?", "api_key": "sk-live", "headers": {"Authorization": "Bearer x"}}
+    assert scrub(payload) == {
+        "reply": "<redacted 15 chars>",
+        "api_key": "<masked>",
+        "headers": {"Authorization": "<masked>"},
+    }
+    monkeypatch.setattr(logs, "LOG_REDACT_PAYLOADS", False)
+    monkeypatch.setattr(logs, "LOG_PAYLOAD_CHARS", 4)
+    assert scrub(payload)["reply"] == "Hola... (15 chars)"
+    assert scrub(payload)["api_key"] == "<masked>"
+
+
+def test_queued_records_carry_context_and_a_scrubbed_payload():
+    log_queue = queue.Queue()
+    logger = _logger(log_queue)
+    with log_context(conversation_id="c1", agent="TAXI"):
+        logger.info("Gemini reply", extra={"payload": {"reply": "secreto", "token": "t"}})
+
+    entry = json.loads(JSONFormatter().format(log_queue.get_nowait()))
+    assert entry["msg"] == "Gemini reply"
+    assert (entry["conversation_id"], entry["agent"]) == ("c1", "TAXI")
+    assert entry["payload"] == {"reply": "<redacted 7 chars>", "token": "<masked>"}
+
+
+def test_sampling_and_a_full_queue_drop_records(monkeypatch):
+    monkeypatch.setattr(logs, "LOG_SAMPLE_RATES", {"DEBUG": 0.0})
+    monkeypatch.setattr(logs, "dropped_records", 0)
+    log_queue = queue.Queue(maxsize=1)
+    logger = _logger(log_queue)
+
+    logger.debug("sampled out")
+    logger.info("kept")
+    logger.warning("queue full")
+
+    assert log_queue.get_nowait().msg == "kept"
+    assert log_queue.empty()
+    assert logs.dropped_records == 1
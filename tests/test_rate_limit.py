@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.authentication import SimpleUser
+from starlette.requests import Request
+
+from backend.services import rate_limit
+from backend.services.rate_limit import MemoryBucketBackend, check_rate_limit, client_key
+
+
+class _User(SimpleUser):
+    @property
+    def identity(self) -> str:
+        return self.username
+
+
+def _request(user_id: str, host: str = "203.0.113.7", user=None) -> Request:
+    scope = {
+        "type": "http",
+        "headers": [(b"x-user-id", user_id.encode())],
+        "client": (host, 50000),
+    }
+    if user is not None:
+        scope["user"] = user
+    return Request(scope)
+
+
+def test_a_new_x_user_id_does_not_get_a_fresh_budget(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_memory_backend", MemoryBucketBackend())
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BUDGETS", {"llm_turns": "2/60"})
+
+    async def run():
+        for i in range(2):
+            await check_rate_limit(_request(f"learner-{i}"), "llm_turns")
+        with pytest.raises(HTTPException) as exc:
+            await check_rate_limit(_request("learner-2"), "llm_turns")
+        # another client still has its own budget
+        await check_rate_limit(_request("learner-2", host="198.51.100.1"), "llm_turns")
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+
+
+def test_authenticated_users_are_keyed_by_identity():
+    assert client_key(_request("spoofed", user=_User("ana"))) == "user:ana"
+    assert client_key(_request("spoofed")) == "ip:203.0.113.7"
+
+
+def test_admission_sheds_after_the_queue_timeout_without_leaking_slots():
+    controller = rate_limit.AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=0.01)
+
+    async def run():
+        async with controller.slot():
+            with pytest.raises(HTTPException) as exc:
+                async with controller.slot():
+                    pass
+        # the shed request does not take the slot once it frees up
+        await asyncio.sleep(0)
+        async with controller.slot():
+            pass
+        return exc.value.status_code
+
+    assert asyncio.run(run()) == 429
+    assert (controller.in_flight, controller.queued, controller._semaphore.locked()) == (0, 0, False)
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from backend.models.agent import AgentSetupRequest
+from backend.services import conversation
+
+
+def _learners(n: int) -> list:
+    return [
+        AgentSetupRequest(country="Spain", language="Spanish", scenario_prompt="taxi", user_id=f"{i:024x}")
+        for i in range(n)
+    ]
+
+
+def _fail_first_chunk(db, monkeypatch):
+    # the insert holding learner 0, the first chunk of its group
+    collection = type(db.conversations)
+    insert_many = collection.insert_many
+
+    async def flaky(self, docs, **kwargs):
+        if any(str(doc.get("user_id")) == f"{0:024x}" for doc in docs):
+            raise RuntimeError("primary stepped down")
+        return await insert_many(self, docs, **kwargs)
+
+    monkeypatch.setattr(collection, "insert_many", flaky)
+
+
+def test_warm_up_is_queued_by_the_first_chunk_that_stores_sessions(db, providers, monkeypatch):
+    _fail_first_chunk(db, monkeypatch)
+    warm_ups = []
+
+    async def queue_warmup(agent, doc, goal_doc, dedup_key=None):
+        warm_ups.append((dedup_key, doc["_id"]))
+
+    monkeypatch.setattr(conversation, "queue_warmup", queue_warmup)
+
+    async def run():
+        stream = conversation.setup_cohort("TAXI", _learners(4), db=db, concurrency=1, chunk_size=2)
+        return [result async for result in stream]
+
+    results = asyncio.run(run())
+
+    assert sorted(r["index"] for r in results if r.get("error")) == [0, 1]
+    stored = [r for r in results if not r.get("error")]
+    assert sorted(r["index"] for r in stored) == [2, 3]
+    assert len(warm_ups) == 1
+    assert str(warm_ups[0][1]) in {r["conversation_id"] for r in stored}
+
+
+def test_failed_learners_are_streamed_as_error_records(app, db, monkeypatch):
+    _fail_first_chunk(db, monkeypatch)
+    learners = [learner.model_dump() for learner in _learners(2)]
+
+    with TestClient(app) as client:
+        response = client.post("/agents/TAXI/setup:batch", json={"learners": learners})
+
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["type"], r["index"]) for r in records[:-1]] == [("error", 0), ("error", 1)]
+    assert records[-1] == {"type": "summary", "agent": "TAXI", "sessions": 0, "errors": 2}
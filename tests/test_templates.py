@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from backend.services.conversation import get_conversation_state
+from backend.services.templates import TEMPLATES, migrate
+
+
+def _baseline_doc(agent: str, content: str) -> dict:
+    # as setupAgent stored it before messages carried a seq
+    return {
+        "_id": ObjectId(),
+        "agent": agent,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "metadata": {"country": "Spain", "language": "Spanish"},
+        "messages": [
+            {"role": "system", "content": content, "timestamp": datetime.utcnow()},
+            {"role": "user", "content": "Hola", "timestamp": datetime.utcnow()},
+        ],
+    }
+
+
+def test_migrate_converts_conversations_stored_without_seq(db):
+    docs = [
+        _baseline_doc("TAXI", TEMPLATES["agent_system"].format(country="Spain", language="Spanish")),
+        _baseline_doc("GEMINI", TEMPLATES["goal_checker"].format(scenario_prompt='buy "bread"')),
+        _baseline_doc("TAXI", "A prompt written by hand"),
+    ]
+
+    async def run():
+        await db.conversations.insert_many(docs)
+        counts = await migrate(db)
+        stored = [await db.conversations.find_one({"_id": doc["_id"]}) for doc in docs]
+        rendered = [(await get_conversation_state(str(doc["_id"]), db=db))[0] for doc in docs]
+        return counts, stored, rendered, await migrate(db)
+
+    counts, stored, rendered, again = asyncio.run(run())
+
+    assert (counts["scanned"], counts["migrated"], counts["unmatched"]) == (3, 2, 1)
+    assert [doc["messages"][0]["template"]["name"] for doc in stored[:2]] == ["agent_system", "goal_checker"]
+    assert all("content" not in doc["messages"][0] for doc in stored[:2])
+    assert stored[2]["messages"][0]["content"] == "A prompt written by hand"
+    for doc, messages in zip(docs, rendered):
+        assert [m["content"] for m in messages] == [m["content"] for m in doc["messages"]]
+    assert again["migrated"] == 0
@@ -0,0 +1,39 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes import usage_routes
+from backend.services import admin, usage
+from backend.services.usage import UsageLedger
+
+
+def _client(db):
+    app = FastAPI()
+    app.include_router(usage_routes.router)
+    app.state._mongo_db = db
+    return TestClient(app)
+
+
+def test_usage_reports_require_the_admin_token(db, monkeypatch):
+    ledger = UsageLedger(db)
+    ledger.record("tts", agent="TAXI", user_id="learner-1", tts_chars=42)
+    monkeypatch.setattr(usage, "_ledger", ledger)
+    client = _client(db)
+
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+    assert client.get("/usage/user").status_code == 404
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/usage/user").status_code == 401
+    assert client.get("/usage/user/learner-1", headers={"Authorization": "Bearer nope"}).status_code == 401
+    response = client.get("/usage/user/learner-1", headers={"Authorization": "Bearer s3cret"})
+    assert response.json()["tts_chars"] == 42
+
+
+def test_usage_events_expire(db, monkeypatch):
+    async def indexes(retention: int) -> dict:
+        monkeypatch.setattr(usage, "USAGE_EVENTS_RETENTION_SECONDS", retention)
+        await UsageLedger(db)._ensure_indexes()
+        return await db.usage_events.index_information()
+
+    assert asyncio.run(indexes(3600))["at_1"]["expireAfterSeconds"] == 3600